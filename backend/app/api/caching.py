@@ -0,0 +1,45 @@
+"""
+Hỗ trợ ETag và conditional GET (If-None-Match -> 304 Not Modified).
+
+ETag được tính từ updated_at / bộ đếm thay đổi trước khi nạp ORM, nên 304 không
+tốn chi phí hydrate và serialize.
+"""
+import hashlib
+
+from fastapi import Request, Response, status
+
+
+# Client luôn phải xác thực lại với server, nhưng được dùng bản đã lưu khi nhận 304
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts) -> str:
+    """Tạo strong ETag từ các thành phần (phiên bản, tham số truy vấn...)."""
+    digest = hashlib.sha1(":".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Kiểm tra header If-None-Match có khớp ETag hiện tại (so sánh weak theo RFC 9110)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+
+    candidates = [tag.strip() for tag in header.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def not_modified(etag: str) -> Response:
+    """Phản hồi 304 kèm ETag và Cache-Control."""
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED,
+        headers={"ETag": etag, "Cache-Control": CACHE_CONTROL},
+    )
+
+
+def set_cache_headers(response: Response, etag: str):
+    """Gắn ETag và Cache-Control vào phản hồi 200."""
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
@@ -1,14 +1,18 @@
 """
 Các dependency API cho xác thực và các dependency chung.
 """
+from uuid import UUID
+
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from jose import JWTError
 
 from app.core.config import settings
 from app.core.database import get_db
 from app.core.security import decode_token
+from app.core.user_cache import CurrentUser, user_cache
 from app.models import User
 
 
@@ -18,9 +22,11 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_PREFIX}/auth/login
 def get_current_user(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
-) -> User:
+) -> CurrentUser:
     """
     Dependency để lấy người dùng đã xác thực hiện tại.
+
+    Trạng thái user được lấy từ user_cache (TTL ngắn); chỉ truy vấn database khi cache miss.
     
     Raises:
         HTTPException: Nếu xác thực thất bại
@@ -36,11 +42,23 @@ def get_current_user(
         user_id: str | None = payload.get("sub")
         if user_id is None:
             raise credentials_exception
-    except JWTError:
+        user_uuid = UUID(user_id)
+    except (JWTError, ValueError):
         raise credentials_exception
 
-    user = db.get(User, user_id)
-    if not user or not user.is_active:
+    user = user_cache.get(user_uuid)
+    if user is None:
+        row = db.execute(
+            select(User.id, User.is_active, User.role).where(User.id == user_uuid)
+        ).one_or_none()
+        if row is None:
+            raise credentials_exception
+        user = CurrentUser(id=row.id, is_active=row.is_active, role=row.role)
+        user_cache.set(user)
+        # Kết thúc transaction đọc: handler có thể chờ OCR / LLM rất lâu trước lần ghi đầu tiên
+        db.rollback()
+
+    if not user.is_active:
         raise credentials_exception
     
     return user
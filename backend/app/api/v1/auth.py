@@ -2,7 +2,6 @@
 Các endpoint xác thực.
 """
 import uuid
-from datetime import datetime, timezone
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
@@ -25,11 +24,11 @@ from app.crud.user import (
 )
 from app.crud.auth import (
     create_refresh_token as create_refresh_token_record,
-    get_valid_refresh_token,
-    revoke_refresh_token,
+    rotate_refresh_token,
 )
 from app.schemas import UserCreate, UserOut, TokenPair, TokenRefreshIn
 from app.api.dependencies import get_current_user
+from app.core.user_cache import CurrentUser
 from app.models import User
 from app.core.utils import hash_text_sha256
 
@@ -97,16 +96,7 @@ def login(
 @router.post("/refresh", response_model=TokenPair)
 def refresh_token(data: TokenRefreshIn, db: Session = Depends(get_db)):
     """Làm mới access token bằng refresh token."""
-    hashed = hash_text_sha256(data.refresh_token)
-    token_row = get_valid_refresh_token(db, hashed)
-    
-    if not token_row:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Mã thông báo làm mới không hợp lệ"
-        )
-
-    # Giải mã và xác thực token
+    # Giải mã và xác thực token (không cần database)
     try:
         payload = decode_token(data.refresh_token)
     except Exception:
@@ -135,25 +125,22 @@ def refresh_token(data: TokenRefreshIn, db: Session = Depends(get_db)):
             detail="Người dùng không hoạt động"
         )
 
-    # Kiểm tra thời hạn
-    if datetime.now(timezone.utc) >= token_row.expires_at:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Mã thông báo đã hết hạn"
-        )
-
     # Tạo tokens mới
     access = create_access_token(user_id)
     new_refresh, exp = create_refresh_token(user_id)
     
-    # Thu hồi token cũ và tạo token mới
-    revoke_refresh_token(db, token_row)
-    create_refresh_token_record(
+    # Thu hồi token cũ và tạo token mới trong một câu lệnh
+    rotated_user_id = rotate_refresh_token(
         db,
-        user_id=user.id,
-        token_hash=hash_text_sha256(new_refresh),
+        token_hash=hash_text_sha256(data.refresh_token),
+        new_token_hash=hash_text_sha256(new_refresh),
         expires_at=exp,
     )
+    if rotated_user_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Mã thông báo làm mới không hợp lệ"
+        )
     
     db.commit()
 
@@ -161,6 +148,15 @@ def refresh_token(data: TokenRefreshIn, db: Session = Depends(get_db)):
 
 
 @router.get("/me", response_model=UserOut)
-def get_current_user_info(current_user: User = Depends(get_current_user)):
+def get_current_user_info(
+    current_user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
     """Lấy thông tin người dùng hiện tại."""
-    return current_user
+    user = db.get(User, current_user.id)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Người dùng không hoạt động"
+        )
+    return user
@@ -1,15 +1,22 @@
 """
 Các endpoint quản lý entity types - Phân loại và lọc ghi chú theo loại.
 """
-from typing import List
-from fastapi import APIRouter, Depends
+from typing import List, Optional, Union
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from sqlalchemy.orm import Session
 
 from app.core.database import get_db
-from app.models import User
-from app.schemas import NoteOut, EntityTypeInfo
+from app.core.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER
+from app.core.user_cache import CurrentUser
+from app.schemas import NoteOut, NoteSummaryOut, NoteListView, EntityTypeInfo
+from app.api.caching import make_etag, etag_matches, not_modified, set_cache_headers
 from app.api.dependencies import get_current_user
-from app.crud.note import get_notes_by_entity_type, get_all_entity_types
+from app.crud.note import (
+    get_notes_by_entity_type,
+    get_all_entity_types,
+    get_entity_type_stats as crud_get_entity_type_stats,
+)
+from app.crud.user import get_notes_version
 
 
 router = APIRouter(prefix="/entity-types", tags=["entity-types"])
@@ -18,7 +25,7 @@ router = APIRouter(prefix="/entity-types", tags=["entity-types"])
 @router.get("/", response_model=List[str])
 def list_entity_types(
     db: Session = Depends(get_db),
-    user: User = Depends(get_current_user)
+    user: CurrentUser = Depends(get_current_user)
 ):
     """
     Liệt kê tất cả entity types có trong notes của người dùng.
@@ -30,43 +37,62 @@ def list_entity_types(
     return entity_types
 
 
-@router.get("/{entity_type}/notes", response_model=List[NoteOut])
+@router.get("/{entity_type}/notes", response_model=Union[List[NoteOut], List[NoteSummaryOut]])
 def get_notes_by_type(
     entity_type: str,
-    limit: int = 100,
-    offset: int = 0,
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    view: NoteListView = "full",
     db: Session = Depends(get_db),
-    user: User = Depends(get_current_user)
+    user: CurrentUser = Depends(get_current_user)
 ):
     """
-    Lấy tất cả ghi chú theo entity type cụ thể.
+    Lấy ghi chú theo entity type cụ thể, phân trang bằng cursor.
     
     Args:
         entity_type: Loại entity (work_tasks, personal_tasks, shopping_list, etc.)
-        limit: Số lượng notes tối đa (default: 100)
-        offset: Vị trí bắt đầu (default: 0)
+        cursor: Cursor trang trước (lấy từ header X-Next-Cursor)
+        limit: Số lượng notes mỗi trang (default: 50)
+        view: "full" (NoteOut) hoặc "summary" (NoteSummaryOut - id, title, snippet, ...)
     
     Returns:
-        Danh sách notes có entity_type khớp
+        Danh sách notes có entity_type khớp; header X-Next-Cursor nếu còn trang sau
     
     Example:
         GET /api/v1/entity-types/work_tasks/notes
-        GET /api/v1/entity-types/shopping_list/notes?limit=20
+        GET /api/v1/entity-types/shopping_list/notes?limit=20&cursor=<X-Next-Cursor>
+        GET /api/v1/entity-types/work_tasks/notes?view=summary
     """
-    notes = get_notes_by_entity_type(
-        db=db,
-        user_id=user.id,
-        entity_type=entity_type,
-        limit=limit,
-        offset=offset
-    )
+    etag = make_etag("entity-notes", user.id, get_notes_version(db, user.id), entity_type, cursor, limit, view)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    
+    try:
+        notes, next_cursor = get_notes_by_entity_type(
+            db=db,
+            user_id=user.id,
+            entity_type=entity_type,
+            limit=limit,
+            cursor=cursor,
+            summary=(view == "summary")
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    set_cache_headers(response, etag)
     return notes
 
 
 @router.get("/stats", response_model=List[EntityTypeInfo])
 def get_entity_type_stats(
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db),
-    user: User = Depends(get_current_user)
+    user: CurrentUser = Depends(get_current_user)
 ):
     """
     Lấy thống kê số lượng notes theo từng entity type.
@@ -81,28 +107,14 @@ def get_entity_type_stats(
             {"entity_type": "personal_tasks", "count": 23}
         ]
     """
-    from sqlalchemy import select, func
-    from app.models import NoteItem
-    
-    result = db.execute(
-        select(
-            NoteItem.entity_type,
-            func.count(NoteItem.id).label('count')
-        )
-        .where(
-            NoteItem.user_id == user.id,
-            NoteItem.entity_type.isnot(None),
-            NoteItem.is_archived == False
-        )
-        .group_by(NoteItem.entity_type)
-        .order_by(func.count(NoteItem.id).desc())
-    )
+    etag = make_etag("entity-stats", user.id, get_notes_version(db, user.id))
+    if etag_matches(request, etag):
+        return not_modified(etag)
     
-    stats = []
-    for row in result.fetchall():
-        stats.append({
-            "entity_type": row[0],
-            "count": row[1]
-        })
+    stats = [
+        {"entity_type": entity_type, "count": count}
+        for entity_type, count in crud_get_entity_type_stats(db, user.id)
+    ]
     
+    set_cache_headers(response, etag)
     return stats
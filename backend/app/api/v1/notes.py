@@ -1,19 +1,44 @@
 """
 Các endpoint ghi chú - Sử dụng NoteItem và RAG với embedding.
 """
+import asyncio
+import mimetypes
 import uuid
-from typing import List
+import zipfile
+from typing import List, Optional, Union
 
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status, UploadFile, File, Form
+from jose import JWTError
 from sqlalchemy.orm import Session
 
+from app.core.config import settings
 from app.core.database import get_db
-from app.models import User
-from app.schemas import NoteCreate, NoteUpdate, NoteOut, QuestionIn, AnswerOut, QAHistoryOut
+from app.core.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, ChangeTokenExpired
+from app.core.security import create_upload_token, decode_token
+from app.core.user_cache import CurrentUser
+from app.schemas import (
+    NoteCreate,
+    NoteUpdate,
+    NoteOut,
+    NoteSummaryOut,
+    NoteListView,
+    NoteChangesOut,
+    QuestionIn,
+    AnswerOut,
+    QAHistoryOut,
+    PresignedUploadIn,
+    PresignedUploadOut,
+    FinalizeUploadIn,
+    BatchUploadItemOut,
+    BatchUploadOut,
+)
+from app.api.caching import make_etag, etag_matches, not_modified, set_cache_headers
 from app.api.dependencies import get_current_user
 from app.crud.note import (
     get_note_by_id,
+    get_note_updated_at,
     get_user_notes,
+    get_note_changes,
     create_note as crud_create_note,
     update_note as crud_update_note,
     delete_note as crud_delete_note,
@@ -22,15 +47,16 @@ from app.crud.note import (
     update_note_summary,
     update_note_entity_type,
 )
+from app.crud.user import get_notes_version
 from app.crud.qa import (
     create_qa_request,
     get_user_qa_history,
     get_qa_request_by_id,
     delete_qa_request,
 )
+from app.crud.storage import claim_upload, get_upload_claim, release_storage_keys
 from app.services.storage import storage_service
-from app.services.image import image_service
-from app.services.ocr import ocr_service
+from app.services.ingestion import BatchImage, ingestion_service
 from app.services.llm import llm_service
 from app.services.embedding import embedding_service
 from app.services.smart_retrieval import SmartRetrieval
@@ -43,7 +69,7 @@ router = APIRouter(prefix="/notes", tags=["notes"])
 async def create_note(
     payload: NoteCreate,
     db: Session = Depends(get_db),
-    user: User = Depends(get_current_user)
+    user: CurrentUser = Depends(get_current_user)
 ):
     """Tạo ghi chú mới từ văn bản."""
     content_text = payload.content_text
@@ -103,112 +129,59 @@ async def create_note(
     return note
 
 
+def _upload_size(image: UploadFile) -> int:
+    """Kích thước file đã nhận (file tạm của UploadFile) - kiểm tra trước khi đọc vào RAM."""
+    if image.size is not None:
+        return image.size
+    image.file.seek(0, 2)
+    size = image.file.tell()
+    image.file.seek(0)
+    return size
+
+
 @router.post("/upload-image", response_model=NoteOut, status_code=status.HTTP_201_CREATED)
 async def create_note_with_image(
     image: UploadFile = File(...),
     title: str = Form(None),
     db: Session = Depends(get_db),
-    user: User = Depends(get_current_user)
+    user: CurrentUser = Depends(get_current_user)
 ):
-    """Tạo ghi chú với hình ảnh đã tải lên."""
+    """
+    Tạo ghi chú với hình ảnh đã tải lên.
+
+    EXIF / OCR / ảnh thu nhỏ vẫn cần toàn bộ ảnh trong RAM; kích thước được kiểm tra trên
+    file tạm trước khi đọc nên mỗi request giữ tối đa UPLOAD_MAX_BYTES (413 nếu lớn hơn).
+    """
     if not image.content_type or not image.content_type.startswith('image/'):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Chỉ chấp nhận tệp hình ảnh hợp lệ."
         )
+    if _upload_size(image) > settings.UPLOAD_MAX_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Ảnh vượt quá {settings.UPLOAD_MAX_BYTES} bytes"
+        )
     
+    note = None
     try:
+        # EXIF / OCR cần nội dung ảnh; upload S3 đọc lại theo luồng từ file tạm của UploadFile
         image_data = await image.read()
+        await image.seek(0)
         
-        # Upload hình ảnh lên S3
-        try:
-            image_url, storage_key = storage_service.upload_image(
-                file_data=image_data,
-                filename=image.filename or "image.jpg",
-                content_type=image.content_type
-            )
-            print(f"✓ Đã upload hình ảnh: {image_url}")
-        except Exception as e:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Tải lên S3 thất bại: {str(e)}"
-            )
-        
-        # Trích xuất metadata EXIF
-        image_metadata = {}
-        try:
-            exif_data = image_service.extract_exif_data(image_data)
-            if exif_data:
-                image_metadata = image_service.parse_metadata(exif_data)
-                print(f"✓ Đã trích xuất EXIF metadata")
-        except Exception as e:
-            print(f"⚠ Không thể trích xuất EXIF: {str(e)}")
-        
-        # Trích xuất văn bản qua OCR
-        ocr_text = None
-        try:
-            ocr_text, ocr_confidence = await ocr_service.extract_text(
-                image_data, 
-                lang='vie+eng'
-            )
-            
-            if ocr_text:
-                print(f"✓ OCR đã trích xuất {len(ocr_text)} ký tự")
-                
-        except Exception as e:
-            print(f"⚠ Không thể trích xuất văn bản qua OCR: {str(e)}")
-        
-        # Tạo embedding và trích xuất entities từ OCR text
-        embedding = None
-        entities = None
-        semantic_summary = None
-        entity_type = None
-        
-        if ocr_text:
-            try:
-                # Tạo embedding
-                print(f"ℹ Tạo embedding cho OCR text (length={len(ocr_text)})")
-                embedding = await embedding_service.create_embedding(ocr_text)
-                
-                if embedding:
-                    print(f"✓ Đã tạo embedding type={embedding.get('type')}")
-                
-            except Exception as e:
-                print(f"⚠ Không thể tạo embedding: {e}")
-            
-            try:
-                # Trích xuất entities
-                entities_json = await llm_service.extract_entities(ocr_text)
-                if entities_json and isinstance(entities_json, dict):
-                    entities = entities_json
-                    # Lấy entity_type từ JSON và lưu vào cột riêng
-                    entity_type = entities_json.get('entity_type')
-                    print(f"✓ Đã trích xuất entities type={entity_type}")
-                    
-            except Exception as e:
-                print(f"⚠ Không thể trích xuất entities: {e}")
-            
-            try:
-                # Tạo semantic summary từ OCR text
-                semantic_summary = await llm_service.generate_semantic_summary(ocr_text)
-                if semantic_summary:
-                    print(f"✓ Đã tạo semantic summary ({len(semantic_summary)} ký tự)")
-            except Exception as e:
-                print(f"⚠ Không thể tạo semantic summary: {e}")
-        
-        # Tạo note với đầy đủ thông tin
-        note = crud_create_note(
+        note = await ingestion_service.create_image_note(
             db,
             user_id=user.id,
-            title=title or "Ghi chú hình ảnh",
-            ocr_text=ocr_text,
-            raw_image_url=image_url,
-            image_metadata=image_metadata,
-            semantic_summary=semantic_summary,
-            entity_type=entity_type,
-            embedding=embedding,
-            entities=entities
+            image_data=image_data,
+            title=title,
+            upload=lambda: ingestion_service.upload_image(
+                image_data,
+                filename=image.filename or "image.jpg",
+                content_type=image.content_type,
+                fileobj=image.file
+            ),
         )
+        print(f"✓ Đã upload hình ảnh: {note.raw_image_url}")
         
         db.commit()
         db.refresh(note)
@@ -219,6 +192,9 @@ async def create_note_with_image(
         raise
     except Exception as e:
         db.rollback()
+        if note is not None:
+            # Ảnh đã lên storage nhưng ghi chú không được lưu
+            ingestion_service.discard_images(db, [note])
         import traceback
         traceback.print_exc()
         raise HTTPException(
@@ -227,29 +203,367 @@ async def create_note_with_image(
         )
 
 
-@router.get("/", response_model=List[NoteOut])
+def _batch_image_from_upload(image: UploadFile) -> BatchImage:
+    async def read() -> bytes:
+        if not image.content_type or not image.content_type.startswith('image/'):
+            raise ValueError("Chỉ chấp nhận tệp hình ảnh hợp lệ.")
+        if _upload_size(image) > settings.UPLOAD_MAX_BYTES:
+            raise ValueError(f"Ảnh vượt quá {settings.UPLOAD_MAX_BYTES} bytes")
+        image_data = await image.read()
+        # Upload S3 đọc lại theo luồng từ file tạm của UploadFile
+        await image.seek(0)
+        return image_data
+
+    return BatchImage(
+        filename=image.filename or "image.jpg",
+        read=read,
+        upload=lambda image_data: ingestion_service.upload_image(
+            image_data,
+            filename=image.filename or "image.jpg",
+            content_type=image.content_type,
+            fileobj=image.file
+        ),
+    )
+
+
+def _batch_image_from_zip(archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> BatchImage:
+    content_type = mimetypes.guess_type(info.filename)[0] or ""
+
+    async def read() -> bytes:
+        if not content_type.startswith('image/'):
+            raise ValueError("Chỉ chấp nhận tệp hình ảnh hợp lệ.")
+        # Kiểm tra kích thước khai báo trước khi giải nén
+        if info.file_size > settings.UPLOAD_MAX_BYTES:
+            raise ValueError(f"Ảnh vượt quá {settings.UPLOAD_MAX_BYTES} bytes")
+        return await asyncio.to_thread(archive.read, info)
+
+    return BatchImage(
+        filename=info.filename,
+        read=read,
+        upload=lambda image_data: ingestion_service.upload_image(
+            image_data,
+            filename=info.filename.rsplit("/", 1)[-1],
+            content_type=content_type
+        ),
+    )
+
+
+def _zip_image_members(archive: zipfile.ZipFile) -> List[zipfile.ZipInfo]:
+    """Các file trong zip, bỏ qua thư mục và metadata của macOS."""
+    return [
+        info for info in archive.infolist()
+        if not info.is_dir()
+        and not info.filename.startswith("__MACOSX/")
+        and not info.filename.rsplit("/", 1)[-1].startswith(".")
+    ]
+
+
+@router.post("/upload-images", response_model=BatchUploadOut)
+async def create_notes_with_images(
+    images: List[UploadFile] = File(None),
+    archive: UploadFile = File(None),
+    title: str = Form(None),
+    db: Session = Depends(get_db),
+    user: CurrentUser = Depends(get_current_user)
+):
+    """
+    Tạo nhiều ghi chú từ nhiều ảnh và / hoặc một file zip chứa ảnh.
+
+    Ảnh được xử lý song song có giới hạn, mỗi BATCH_UPLOAD_CHUNK_SIZE ghi chú được lưu trong
+    một transaction. Trả về trạng thái từng file - ảnh lỗi không làm hỏng các ảnh còn lại.
+    """
+    images = images or []
+    if not images and archive is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cần ít nhất một ảnh hoặc một file zip."
+        )
+
+    zip_file = None
+    try:
+        batch = [_batch_image_from_upload(image) for image in images]
+        if archive is not None:
+            try:
+                # UploadFile đã được lưu tạm (spooled) - ZipFile chỉ đọc từng ảnh khi cần
+                zip_file = zipfile.ZipFile(archive.file)
+            except zipfile.BadZipFile:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="File zip không hợp lệ."
+                )
+            batch.extend(_batch_image_from_zip(zip_file, info) for info in _zip_image_members(zip_file))
+
+        if len(batch) > settings.BATCH_UPLOAD_MAX_FILES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Tối đa {settings.BATCH_UPLOAD_MAX_FILES} ảnh mỗi request."
+            )
+
+        results = await ingestion_service.create_image_notes(db, user.id, batch, title=title)
+    finally:
+        if zip_file is not None:
+            zip_file.close()
+
+    items = [
+        BatchUploadItemOut(
+            filename=result.filename,
+            status="error" if result.error else "ok",
+            note_id=result.note_id,
+            error=result.error,
+        )
+        for result in results
+    ]
+    succeeded = sum(item.status == "ok" for item in items)
+    return BatchUploadOut(items=items, succeeded=succeeded, failed=len(items) - succeeded)
+
+
+@router.post("/uploads/presign", response_model=PresignedUploadOut)
+def create_presigned_upload(
+    payload: PresignedUploadIn,
+    user: CurrentUser = Depends(get_current_user)
+):
+    """
+    Bước 1 của upload trực tiếp: trả về presigned PUT URL.
+
+    Client PUT nội dung ảnh lên `upload_url` kèm `headers`, sau đó gọi /notes/uploads/finalize
+    với `upload_token` - ảnh không đi qua API worker.
+    """
+    if not payload.content_type.startswith('image/'):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Chỉ chấp nhận tệp hình ảnh hợp lệ."
+        )
+
+    expires_in = settings.PRESIGNED_UPLOAD_EXPIRES_SECONDS
+    try:
+        upload_url, storage_key = storage_service.create_presigned_upload(
+            filename=payload.filename,
+            content_type=payload.content_type,
+            expires_in=expires_in,
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+    return PresignedUploadOut(
+        upload_url=upload_url,
+        upload_token=create_upload_token(str(user.id), storage_key, payload.content_type),
+        storage_key=storage_key,
+        expires_in=expires_in,
+        headers={"Content-Type": payload.content_type},
+    )
+
+
+def _finalized_upload_note(db: Session, storage_key: str, user_id, response: Response):
+    """Ghi chú đã tạo từ storage key (finalize lặp lại); 409 nếu ghi chú đó đã bị xóa."""
+    claim = get_upload_claim(db, storage_key)
+    note = get_note_by_id(db, claim.note_id, user_id) if claim else None
+    if note is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Upload token đã được sử dụng"
+        )
+    response.status_code = status.HTTP_200_OK
+    return note
+
+
+@router.post("/uploads/finalize", response_model=NoteOut, status_code=status.HTTP_201_CREATED)
+async def finalize_presigned_upload(
+    payload: FinalizeUploadIn,
+    response: Response,
+    db: Session = Depends(get_db),
+    user: CurrentUser = Depends(get_current_user)
+):
+    """
+    Bước 2 của upload trực tiếp: đọc ảnh đã upload từ storage, chạy EXIF / OCR và tạo ghi chú.
+
+    Idempotent theo storage key: gửi lại cùng upload token trả về ghi chú đã tạo (200),
+    hoặc 409 nếu ghi chú đó đã bị xóa.
+    """
+    try:
+        claims = decode_token(payload.upload_token)
+    except JWTError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Upload token không hợp lệ hoặc đã hết hạn"
+        )
+    if claims.get("type") != "upload" or claims.get("sub") != str(user.id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Upload token không hợp lệ hoặc đã hết hạn"
+        )
+
+    storage_key = claims["key"]
+    if get_upload_claim(db, storage_key) is not None:
+        return _finalized_upload_note(db, storage_key, user.id, response)
+    # Không giữ transaction (và kết nối trong pool) trong lúc tải ảnh, OCR và gọi LLM
+    db.rollback()
+
+    size = await storage_service.get_object_size_async(storage_key)
+    if size is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Chưa tìm thấy ảnh trên storage - hãy PUT ảnh lên upload_url trước"
+        )
+    if size > settings.UPLOAD_MAX_BYTES:
+        await storage_service.delete_image_by_key_async(storage_key)
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Ảnh vượt quá {settings.UPLOAD_MAX_BYTES} bytes"
+        )
+
+    try:
+        image_data = await storage_service.download_image_async(storage_key)
+        note = await ingestion_service.create_image_note(
+            db,
+            user_id=user.id,
+            image_data=image_data,
+            image_url=storage_service.public_url(storage_key),
+            storage_key=storage_key,
+            title=payload.title,
+        )
+        # Ghi nhận key ngay trước commit: request finalize song song cùng key chỉ chờ
+        # khóa unique trong thời gian rất ngắn
+        claimed = claim_upload(db, storage_key, user.id, note.id)
+        if claimed:
+            db.commit()
+            db.refresh(note)
+        else:
+            derivatives = note.image_derivatives
+            db.rollback()
+            if settings.STORAGE_CONTENT_ADDRESSED:
+                # Ảnh thu nhỏ dùng chung với ghi chú đã finalize - chỉ trả lại pin của request này
+                ingestion_service.discard_images(db, [{"image_derivatives": derivatives}])
+    except Exception as e:
+        db.rollback()
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Xử lý ảnh đã upload thất bại: {str(e)}"
+        )
+    if not claimed:
+        return _finalized_upload_note(db, storage_key, user.id, response)
+    return note
+
+
+@router.get("/", response_model=Union[List[NoteOut], List[NoteSummaryOut]])
 def list_notes(
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    view: NoteListView = "full",
     db: Session = Depends(get_db),
-    user: User = Depends(get_current_user)
+    user: CurrentUser = Depends(get_current_user)
 ):
-    """Liệt kê tất cả ghi chú của người dùng hiện tại."""
-    notes = get_user_notes(db, user.id, include_archived=False)
+    """
+    Liệt kê ghi chú của người dùng hiện tại theo trang (mới nhất trước).
+
+    Cursor của trang tiếp theo trả về trong header X-Next-Cursor (không có = hết dữ liệu).
+    view=summary chỉ trả về id, title, snippet, entity_type và timestamps.
+    Hỗ trợ If-None-Match (ETag theo bộ đếm thay đổi của user).
+    """
+    etag = make_etag("notes", user.id, get_notes_version(db, user.id), cursor, limit, view)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    
+    try:
+        notes, next_cursor = get_user_notes(
+            db, user.id, include_archived=False, limit=limit, cursor=cursor,
+            summary=(view == "summary")
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    set_cache_headers(response, etag)
     return notes
 
 
+@router.get("/chat-history", response_model=List[QAHistoryOut])
+def get_chat_history(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    user: CurrentUser = Depends(get_current_user)
+):
+    """
+    Lấy lịch sử chat Q&A của người dùng theo trang (mới nhất trước).
+
+    Cursor của trang tiếp theo trả về trong header X-Next-Cursor.
+    """
+    try:
+        history, next_cursor = get_user_qa_history(db, user.id, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return history
+
+
+@router.get("/changes", response_model=NoteChangesOut)
+def get_changes(
+    since: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    user: CurrentUser = Depends(get_current_user)
+):
+    """
+    Đồng bộ delta: ghi chú đã tạo/sửa/lưu trữ và id đã xóa kể từ change token.
+
+    Không truyền `since` để lấy bản đầy đủ lần đầu. Gọi lại với `next_token` khi
+    `has_more` = true. 410 nghĩa là token quá cũ - client cần đồng bộ lại từ đầu.
+    """
+    try:
+        notes, deleted_ids, next_token, has_more = get_note_changes(
+            db, user.id, since=since, limit=limit
+        )
+    except ChangeTokenExpired as e:
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    return NoteChangesOut(
+        notes=notes,
+        deleted_ids=deleted_ids,
+        next_token=next_token,
+        has_more=has_more
+    )
+
+
 @router.get("/{note_id}", response_model=NoteOut)
 def get_note(
     note_id: uuid.UUID,
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db),
-    user: User = Depends(get_current_user)
+    user: CurrentUser = Depends(get_current_user)
 ):
-    """Lấy một ghi chú cụ thể theo ID."""
+    """Lấy một ghi chú cụ thể theo ID (hỗ trợ If-None-Match theo updated_at)."""
+    updated_at = get_note_updated_at(db, note_id, user.id)
+    if updated_at is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Không tìm thấy ghi chú"
+        )
+    
+    etag = make_etag("note", note_id, updated_at.isoformat())
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    
     note = get_note_by_id(db, note_id, user.id)
     if not note:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Không tìm thấy ghi chú"
         )
+    set_cache_headers(response, etag)
     return note
 
 
@@ -258,9 +572,14 @@ async def update_note(
     note_id: uuid.UUID,
     payload: NoteUpdate,
     db: Session = Depends(get_db),
-    user: User = Depends(get_current_user)
+    user: CurrentUser = Depends(get_current_user)
 ):
-    """Cập nhật ghi chú."""
+    """
+    Cập nhật ghi chú.
+
+    Embedding / entities / summary được tính khi không mở transaction nào; ghi chú được đọc lại
+    và cập nhật trong một transaction ngắn ngay trước commit.
+    """
     note = get_note_by_id(db, note_id, user.id)
     if not note:
         raise HTTPException(
@@ -270,22 +589,14 @@ async def update_note(
     
     # Cập nhật nội dung
     content_text = payload.content_text if payload.content_text is not None else note.content_text
-    
-    crud_update_note(
-        db,
-        note,
-        title=payload.title,
-        content_text=content_text
-    )
-    
+    db.rollback()
+
+    embedding = entities_json = semantic_summary = None
     # Cập nhật embedding và entities nếu nội dung thay đổi
     if payload.content_text is not None and content_text:
         try:
             # Tạo embedding mới
             embedding = await embedding_service.create_embedding(content_text)
-            if embedding:
-                update_note_embedding(db, note, embedding)
-                print(f"✓ Đã cập nhật embedding")
         except Exception as e:
             print(f"⚠ Không thể cập nhật embedding: {e}")
         
@@ -294,24 +605,40 @@ async def update_note(
                 entities_json = await llm_service.extract_entities(payload.title + content_text)
             else:
                 entities_json = await llm_service.extract_entities(content_text)
-            if entities_json and isinstance(entities_json, dict):
-                update_note_entities(db, note, entities_json)
-                # Cập nhật entity_type nếu có
-                entity_type = entities_json.get('entity_type')
-                if entity_type:
-                    update_note_entity_type(db, note, entity_type)
-                print(f"✓ Đã cập nhật entities type={entity_type}")
         except Exception as e:
             print(f"⚠ Không thể cập nhật entities: {e}")
         
         try:
             # Tạo semantic summary mới
             semantic_summary = await llm_service.generate_semantic_summary(content_text)
-            if semantic_summary:
-                update_note_summary(db, note, semantic_summary)
-                print(f"✓ Đã cập nhật semantic summary ({len(semantic_summary)} ký tự)")
         except Exception as e:
             print(f"⚠ Không thể cập nhật semantic summary: {e}")
+
+    note = get_note_by_id(db, note_id, user.id)
+    if not note:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Không tìm thấy ghi chú"
+        )
+    crud_update_note(
+        db,
+        note,
+        title=payload.title,
+        content_text=content_text
+    )
+    if embedding:
+        update_note_embedding(db, note, embedding)
+        print(f"✓ Đã cập nhật embedding")
+    if entities_json and isinstance(entities_json, dict):
+        update_note_entities(db, note, entities_json)
+        # Cập nhật entity_type nếu có
+        entity_type = entities_json.get('entity_type')
+        if entity_type:
+            update_note_entity_type(db, note, entity_type)
+        print(f"✓ Đã cập nhật entities type={entity_type}")
+    if semantic_summary:
+        update_note_summary(db, note, semantic_summary)
+        print(f"✓ Đã cập nhật semantic summary ({len(semantic_summary)} ký tự)")
     
     db.commit()
     db.refresh(note)
@@ -322,7 +649,7 @@ async def update_note(
 def delete_note(
     note_id: uuid.UUID,
     db: Session = Depends(get_db),
-    user: User = Depends(get_current_user)
+    user: CurrentUser = Depends(get_current_user)
 ):
     """Xóa ghi chú."""
     note = get_note_by_id(db, note_id, user.id)
@@ -332,16 +659,9 @@ def delete_note(
             detail="Không tìm thấy ghi chú"
         )
     
-    # Xóa hình ảnh từ storage nếu có
-    if note.raw_image_url:
-        try:
-            # Extract storage key from URL
-            storage_key = note.raw_image_url.split('/')[-1]
-            storage_service.delete_image_by_key(storage_key)
-            print(f"✓ Đã xóa hình ảnh: {storage_key}")
-        except Exception as e:
-            print(f"⚠ Không thể xóa hình ảnh từ storage: {str(e)}")
-    
+    # Ảnh gốc và ảnh thu nhỏ được job storage_gc xóa sau khi transaction commit
+    # (object theo nội dung chỉ bị xóa khi không còn ghi chú nào dùng)
+    release_storage_keys(db, storage_service.note_storage_keys(note.raw_image_url, note.image_derivatives))
     crud_delete_note(db, note)
     db.commit()
     return None
@@ -351,7 +671,7 @@ def delete_note(
 async def ask_question(
     payload: QuestionIn,
     db: Session = Depends(get_db),
-    user: User = Depends(get_current_user)
+    user: CurrentUser = Depends(get_current_user)
 ):
     """
     Trả lời câu hỏi của người dùng dựa trên ghi chú của họ.
@@ -467,23 +787,11 @@ async def ask_question(
         )
 
 
-@router.get("/chat-history", response_model=List[QAHistoryOut])
-def get_chat_history(
-    limit: int = 50,
-    offset: int = 0,
-    db: Session = Depends(get_db),
-    user: User = Depends(get_current_user)
-):
-    """Lấy lịch sử chat Q&A của người dùng."""
-    history = get_user_qa_history(db, user.id, limit=limit, offset=offset)
-    return history
-
-
 @router.get("/chat-history/{qa_id}", response_model=QAHistoryOut)
 def get_chat_detail(
     qa_id: uuid.UUID,
     db: Session = Depends(get_db),
-    user: User = Depends(get_current_user)
+    user: CurrentUser = Depends(get_current_user)
 ):
     """Lấy chi tiết một bản ghi chat."""
     qa_request = get_qa_request_by_id(db, qa_id, user.id)
@@ -499,7 +807,7 @@ def get_chat_detail(
 def delete_chat_history(
     qa_id: uuid.UUID,
     db: Session = Depends(get_db),
-    user: User = Depends(get_current_user)
+    user: CurrentUser = Depends(get_current_user)
 ):
     """Xóa một bản ghi lịch sử chat."""
     qa_request = get_qa_request_by_id(db, qa_id, user.id)
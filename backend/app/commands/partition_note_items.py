@@ -0,0 +1,92 @@
+"""
+Lệnh chuyển note_items sang hash partition theo user_id (tùy chọn, cho tenant lớn).
+
+    python -m app.commands.partition_note_items prepare --partitions 16
+    python -m app.commands.partition_note_items copy --batch-size 5000
+    python -m app.commands.partition_note_items swap
+    python -m app.commands.partition_note_items status
+
+prepare và copy chạy khi ứng dụng vẫn phục vụ bình thường; swap chỉ giữ
+ACCESS EXCLUSIVE trong thời gian đổi tên và cài lại trigger. Sau khi đối chiếu,
+xóa bảng cũ bằng: DROP TABLE note_items_unpartitioned;
+"""
+import argparse
+import time
+import uuid
+
+from app.core.config import settings
+from app.core.database import engine
+from app.core.partitioning import (
+    copy_note_items_batch,
+    mark_copy_complete,
+    note_items_is_partitioned,
+    partition_stats,
+    prepare_partitioned_note_items,
+    swap_partitioned_note_items,
+)
+
+
+def run_prepare(args):
+    with engine.begin() as conn:
+        prepare_partitioned_note_items(conn, args.partitions)
+    print(f"✅ Đã tạo bảng partitioned ({args.partitions} partition) và trigger mirror")
+
+
+def run_copy(args):
+    started = time.perf_counter()
+    after_id = uuid.UUID(int=0)
+    total = 0
+    while True:
+        # Mỗi lô một transaction ngắn, chỉ khóa KEY SHARE các dòng trong lô
+        with engine.begin() as conn:
+            count, last_id = copy_note_items_batch(conn, after_id, args.batch_size)
+        if not count:
+            break
+        total += count
+        after_id = last_id
+        print(f"🔄 Đã copy {total} note...")
+
+    with engine.begin() as conn:
+        mark_copy_complete(conn)
+    print(f"✅ Đã copy {total} note trong {time.perf_counter() - started:.1f}s")
+
+
+def run_swap(args):
+    with engine.begin() as conn:
+        swap_partitioned_note_items(conn, settings.FTS_CONFIG)
+    print("✅ note_items đã chuyển sang bảng partitioned (bảng cũ: note_items_unpartitioned)")
+
+
+def run_status(args):
+    with engine.connect() as conn:
+        if not note_items_is_partitioned(conn):
+            print("ℹ note_items chưa được partition")
+            return
+        for name, rows, size in partition_stats(conn):
+            print(f"  {name}: ~{rows} dòng, {size}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hash partition note_items theo user_id")
+    subparsers = parser.add_subparsers(dest="step", required=True)
+
+    prepare = subparsers.add_parser("prepare", help="Tạo bảng partitioned + trigger mirror")
+    prepare.add_argument("--partitions", type=int, default=16, help="Số partition hash")
+    prepare.set_defaults(handler=run_prepare)
+
+    copy = subparsers.add_parser("copy", help="Copy dữ liệu cũ theo lô")
+    copy.add_argument("--batch-size", type=int, default=5000, help="Số note mỗi lô")
+    copy.set_defaults(handler=run_copy)
+
+    swap = subparsers.add_parser("swap", help="Đổi sang bảng partitioned")
+    swap.set_defaults(handler=run_swap)
+
+    status = subparsers.add_parser("status", help="Kích thước từng partition")
+    status.set_defaults(handler=run_status)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Lệnh rebuild cột tsv_content theo lô, chạy song song.
+
+Chạy sau khi thay đổi FTS_CONFIG hoặc cách dựng tsvector (FTS_SCHEMA_VERSION):
+
+    python -m app.commands.rebuild_fts --workers 4 --batch-size 1000
+
+Mỗi worker xử lý một dải UUID riêng (keyset theo khóa chính), mỗi lô là một
+transaction ngắn nên không khóa bảng lâu.
+"""
+import argparse
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.database import engine
+from app.core.fts import install_note_items_fts, fts_needs_rebuild, mark_fts_rebuilt
+
+
+REBUILD_BATCH_SQL = text(
+    """
+WITH batch AS (
+    SELECT id FROM note_items
+    WHERE id > :after_id AND id <= :upper_id
+    ORDER BY id
+    LIMIT :batch_size
+)
+UPDATE note_items n
+SET tsv_content = note_items_build_tsv(n.title, n.content_text, n.ocr_text, n.semantic_summary)
+FROM batch
+WHERE n.id = batch.id
+RETURNING n.id
+"""
+)
+
+
+def _uuid_ranges(workers: int) -> list[tuple[uuid.UUID, uuid.UUID]]:
+    """Chia không gian UUID thành `workers` dải [lower, upper] liên tiếp, không chồng lấn."""
+    size = 1 << 128
+    bounds = [(i * size) // workers for i in range(workers + 1)]
+    return [
+        (uuid.UUID(int=bounds[i]), uuid.UUID(int=bounds[i + 1] - 1))
+        for i in range(workers)
+    ]
+
+
+def rebuild_range(lower: uuid.UUID, upper: uuid.UUID, batch_size: int) -> int:
+    """Rebuild tsv_content cho các note có id trong [lower, upper], mỗi lô một transaction."""
+    # Cận dưới loại trừ: cả hai điều kiện đều là index condition nên mỗi lô là một range scan
+    # (UUID 0 không bao giờ được sinh ra nên bỏ qua nó ở dải đầu tiên là an toàn)
+    after_id = uuid.UUID(int=max(lower.int - 1, 0))
+    total = 0
+    while True:
+        with engine.begin() as conn:
+            ids = conn.execute(
+                REBUILD_BATCH_SQL,
+                {
+                    "upper_id": upper,
+                    "after_id": after_id,
+                    "batch_size": batch_size,
+                },
+            ).scalars().all()
+        if not ids:
+            break
+        total += len(ids)
+        after_id = max(ids)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild tsv_content theo cấu hình FTS hiện tại")
+    parser.add_argument("--workers", type=int, default=4, help="Số worker song song")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Số note mỗi lô")
+    parser.add_argument("--force", action="store_true", help="Rebuild kể cả khi cấu hình không đổi")
+    args = parser.parse_args()
+
+    with engine.begin() as conn:
+        install_note_items_fts(conn, settings.FTS_CONFIG)
+        needs_rebuild = fts_needs_rebuild(conn)
+
+    if not needs_rebuild and not args.force:
+        print("✅ tsv_content đã khớp cấu hình FTS hiện tại, không cần rebuild")
+        return
+
+    workers = max(args.workers, 1)
+    ranges = _uuid_ranges(workers)
+    started = time.perf_counter()
+    print(f"🔄 Rebuild tsv_content (cfg={settings.FTS_CONFIG}, workers={workers}, batch={args.batch_size})")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(rebuild_range, lower, upper, args.batch_size)
+            for lower, upper in ranges
+        ]
+        total = sum(f.result() for f in futures)
+
+    with engine.begin() as conn:
+        mark_fts_rebuilt(conn, settings.FTS_CONFIG)
+
+    print(f"✅ Đã rebuild {total} note trong {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
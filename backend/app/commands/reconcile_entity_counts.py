@@ -0,0 +1,34 @@
+"""
+Lệnh đối soát bảng user_entity_type_counts với note_items.
+
+    python -m app.commands.reconcile_entity_counts
+    python -m app.commands.reconcile_entity_counts --user-id <uuid>
+
+Bảng được trigger duy trì chính xác; lệnh này dùng khi nghi ngờ lệch số liệu
+(ví dụ sau khi sửa dữ liệu thủ công với trigger bị tắt).
+"""
+import argparse
+import time
+import uuid
+
+from app.core.counters import reconcile_entity_type_counts
+from app.core.database import engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tính lại thống kê entity_type theo user")
+    parser.add_argument("--user-id", type=uuid.UUID, default=None, help="Chỉ đối soát một user")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    scope = f"user={args.user_id}" if args.user_id else "toàn bộ user"
+    print(f"🔄 Đối soát user_entity_type_counts ({scope})")
+
+    with engine.begin() as conn:
+        rows = reconcile_entity_type_counts(conn, args.user_id)
+
+    print(f"✅ Đã tính lại {rows} dòng thống kê trong {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""
+Lệnh đối soát bucket S3 với note_items và xóa object mồ côi.
+
+    python -m app.commands.reconcile_storage --dry-run
+    python -m app.commands.reconcile_storage
+
+Job storage_reconcile chạy việc này mỗi ngày; lệnh dùng để kiểm tra trước (--dry-run)
+hoặc dọn ngay, ví dụ sau khi nhập / xóa dữ liệu hàng loạt.
+"""
+import argparse
+import time
+
+from app.services.jobs import drain_storage_deletes, reconcile_storage_orphans
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tìm và xóa object S3 không còn ghi chú tham chiếu")
+    parser.add_argument("--dry-run", action="store_true", help="Chỉ đếm object mồ côi, không xóa")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    print("🔄 Đối soát bucket với note_items")
+    orphans = reconcile_storage_orphans(dry_run=args.dry_run)
+    if not args.dry_run:
+        drain_storage_deletes()
+
+    action = "Tìm thấy" if args.dry_run else "Đã xử lý"
+    print(f"✅ {action} {orphans} object mồ côi trong {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -21,15 +21,37 @@ class Settings(BaseSettings):
 
     # Cơ sở dữ liệu
     DATABASE_URL: str
+    DB_AUTO_MIGRATE: bool = False        # True = tự chạy `alembic upgrade head` khi khởi động
 
     # Xác thực JWT
     JWT_SECRET: str
     JWT_ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRES_MINUTES: int = 30
     REFRESH_TOKEN_EXPIRES_DAYS: int = 14
+    USER_CACHE_TTL_SECONDS: int = 30     # cache trạng thái user trong get_current_user (0 = tắt)
+    USER_CACHE_MAX_SIZE: int = 10000
+    METRICS_TOKEN: str = ""              # bearer token cho GET /metrics (rỗng = chỉ cho phép từ localhost)
 
     # Tìm kiếm toàn văn
-    FTS_CONFIG: str = "simple"
+    FTS_CONFIG: str = "ainote_vi"        # tự tạo (COPY = simple + unaccent) nếu chưa tồn tại
+
+    # Truy xuất RAG
+    RETRIEVAL_MODE: str = "sql"          # "sql" (một truy vấn CTE) hoặc "python" (3 truy vấn + fusion trong Python)
+    RETRIEVAL_FUSION: str = "weighted"   # "weighted" hoặc "rrf" (reciprocal rank fusion)
+    RETRIEVAL_RRF_K: int = 60
+    RETRIEVAL_VECTOR_CANDIDATES: int = 2000  # số note sửa gần nhất được chấm điểm vector (SQL mode)
+
+    # Đồng bộ delta
+    NOTE_TOMBSTONE_RETENTION_DAYS: int = 30    # change token cũ hơn -> 410, client đồng bộ lại toàn bộ
+    SYNC_SAFETY_WINDOW_SECONDS: int = 120      # lùi mốc để không sót giao dịch commit muộn
+
+    # Lưu giữ lịch sử chat (qa_requests partition theo tháng)
+    QA_RETENTION_MONTHS: int = 12              # partition cũ hơn được tách, nén ra file rồi DROP
+    QA_ARCHIVE_DIR: str = "archive/qa_requests"
+    QA_PARTITION_MONTHS_AHEAD: int = 2         # số tháng tới được tạo sẵn partition
+
+    # Job bảo trì định kỳ (app/services/jobs.py)
+    JOBS_ENABLED: bool = True
 
     # Supabase (tùy chọn)
     SUPABASE_URL: str | None = None
@@ -41,6 +63,62 @@ class Settings(BaseSettings):
     S3_ENDPOINT_URL: str
     S3_BUCKET_NAME: str = "AiNote"
     S3_REGION: str = "ap-south-1"
+    S3_MAX_CONCURRENCY: int = 16                   # số lời gọi S3 chạy song song (thread pool)
+    S3_MULTIPART_PART_SIZE_MB: int = 8             # kích thước mỗi phần khi upload multipart
+    S3_MULTIPART_CONCURRENCY: int = 4              # số phần upload song song cho một file
+    PRESIGNED_UPLOAD_EXPIRES_SECONDS: int = 900    # thời hạn presigned PUT URL và upload token
+    UPLOAD_MAX_BYTES: int = 20 * 1024 * 1024       # ảnh lớn hơn bị từ chối (413 / finalize / batch)
+
+    # Lưu ảnh theo nội dung: key = SHA-256, ảnh trùng chỉ lưu một lần (đếm tham chiếu trong storage_objects)
+    STORAGE_CONTENT_ADDRESSED: bool = False
+
+    # Dọn object S3 (job storage_gc / storage_reconcile)
+    STORAGE_RECONCILE_ENABLED: bool = True   # đối soát bucket với note_items mỗi ngày
+    STORAGE_ORPHAN_GRACE_HOURS: int = 24     # object mới hơn khoảng này không bị coi là mồ côi
+
+    # Tiền xử lý ảnh trước OCR
+    IMAGE_WORKERS: int = 4                   # số thread xử lý ảnh (Pillow)
+    OCR_PREPROCESS_ENABLED: bool = True
+    OCR_MAX_EDGE: int = 2048                 # cạnh dài tối đa (pixel) gửi cho model vision
+    OCR_IMAGE_FORMAT: str = "JPEG"           # "JPEG" hoặc "WEBP"
+    OCR_IMAGE_QUALITY: int = 85
+    OCR_GRAYSCALE: bool = False
+    OCR_AUTOCONTRAST: bool = False
+    OCR_MAX_CONCURRENCY: int = 4             # số request OCR đồng thời tới provider (mỗi worker)
+
+    # Ảnh thu nhỏ WebP (thumbnail / medium / large) cho ảnh của ghi chú
+    IMAGE_DERIVATIVES_ENABLED: bool = True
+    IMAGE_DERIVATIVE_QUALITY: int = 80
+
+    # OCR theo tile cho ảnh dài
+    OCR_TILING_ENABLED: bool = True
+    OCR_TILE_THRESHOLD: int = 2400           # cắt tile khi chiều cao (sau khi thu về OCR_MAX_EDGE chiều rộng) vượt ngưỡng
+    OCR_TILE_HEIGHT: int = 1600
+    OCR_TILE_OVERLAP: int = 160              # pixel chồng lấn giữa hai tile kề nhau
+
+    # OCR cục bộ bằng Tesseract trước, chỉ gửi model vision khi kết quả kém
+    OCR_LOCAL_ENABLED: bool = True           # tự tắt nếu không tìm thấy TESSERACT_CMD
+    TESSERACT_CMD: str = "tesseract"
+    OCR_LOCAL_PSM: int = 3                   # page segmentation mode của Tesseract (3 = tự động)
+    OCR_LOCAL_MAX_EDGE: int = 4000
+    OCR_LOCAL_TIMEOUT_SECONDS: int = 30
+    OCR_LOCAL_MAX_CONCURRENCY: int = 2       # số tiến trình tesseract đồng thời (mỗi worker)
+    OCR_LOCAL_MIN_WORDS: int = 3
+    OCR_LOCAL_MIN_CONFIDENCE: float = 80.0   # độ tin cậy trung bình tối thiểu (0-100)
+    OCR_LOCAL_WORD_CONFIDENCE: float = 60.0  # từ dưới ngưỡng này tính là "kém"
+    OCR_LOCAL_MAX_LOW_CONF_RATIO: float = 0.2
+    OCR_LOCAL_MAX_COLUMN_LINE_RATIO: float = 0.3  # tỷ lệ dòng dạng bảng / nhiều cột tối đa
+
+    # Cache kết quả OCR (bảng ocr_cache)
+    OCR_CACHE_ENABLED: bool = True
+    OCR_CACHE_PERCEPTUAL: bool = True        # nhận ra ảnh gần giống của cùng user bằng dHash
+    OCR_CACHE_MAX_HAMMING: int = 4           # số bit dHash khác nhau tối đa (trên 64)
+
+    # Upload nhiều ảnh (POST /notes/upload-images)
+    BATCH_UPLOAD_MAX_FILES: int = 200        # số ảnh tối đa mỗi request (kể cả trong file zip)
+    BATCH_UPLOAD_CHUNK_SIZE: int = 16        # số ghi chú mỗi transaction / mỗi lô embedding
+    BATCH_UPLOAD_CONCURRENCY: int = 4        # số ảnh xử lý đồng thời (giới hạn ảnh nằm trong RAM)
+    LLM_MAX_CONCURRENCY: int = 8             # số request entities / summary đồng thời tới LLM (mỗi worker)
 
     # API LLM
     API_EXTRACT_NAME:  str | None = None 
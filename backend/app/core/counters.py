@@ -0,0 +1,231 @@
+"""
+Bộ đếm theo người dùng, duy trì bằng trigger PostgreSQL.
+
+- `users.notes_version` tăng mỗi khi một ghi chú của người dùng được tạo, xóa hoặc
+  sửa các cột mà API trả về - dùng làm nguồn ETag cho các endpoint danh sách.
+- `user_entity_type_counts` giữ số ghi chú chưa lưu trữ theo entity_type, thay cho
+  GROUP BY / DISTINCT trên toàn bộ note_items mỗi lần gọi.
+"""
+from uuid import UUID
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+
+# Các cột NoteOut / NoteSummaryOut - thay đổi cột khác (embedding, tsv_content...) không đổi ETag
+NOTE_VERSIONED_COLUMNS = (
+    "user_id",
+    "title",
+    "content_text",
+    "ocr_text",
+    "raw_image_url",
+    "image_metadata",
+    "semantic_summary",
+    "entity_type",
+    "entities",
+    "is_archived",
+)
+
+
+# Phần thân hàm trigger cấp câu lệnh theo từng sự kiện. Dòng users được cập nhật (khóa) trước,
+# bảng thống kê entity_type sau - mọi thay đổi bộ đếm của một user tuần tự theo dòng users
+COUNTERS_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION note_items_version_stmt_trigger() RETURNS trigger AS $fn$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE users SET notes_version = notes_version + 1
+        WHERE id IN (SELECT user_id FROM new_notes);
+
+        INSERT INTO user_entity_type_counts AS c (user_id, entity_type, count)
+        SELECT user_id, entity_type, count(*)
+        FROM new_notes
+        WHERE entity_type IS NOT NULL AND NOT is_archived
+        GROUP BY user_id, entity_type
+        ORDER BY user_id, entity_type
+        ON CONFLICT (user_id, entity_type) DO UPDATE SET count = c.count + EXCLUDED.count;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE users SET notes_version = notes_version + 1
+        WHERE id IN (SELECT user_id FROM old_notes);
+
+        UPDATE user_entity_type_counts c SET count = c.count - d.n
+        FROM (
+            SELECT user_id, entity_type, count(*) AS n
+            FROM old_notes
+            WHERE entity_type IS NOT NULL AND NOT is_archived
+            GROUP BY user_id, entity_type
+        ) d
+        WHERE c.user_id = d.user_id AND c.entity_type = d.entity_type;
+    ELSE
+        UPDATE users SET notes_version = notes_version + 1
+        WHERE id IN (
+            SELECT unnest(ARRAY[o.user_id, n.user_id])
+            FROM old_notes o JOIN new_notes n ON n.id = o.id
+            WHERE ({old_cols}) IS DISTINCT FROM ({new_cols})
+        );
+
+        WITH delta AS (
+            SELECT user_id, entity_type, sum(n) AS n
+            FROM (
+                SELECT user_id, entity_type, -1 AS n FROM old_notes
+                WHERE entity_type IS NOT NULL AND NOT is_archived
+                UNION ALL
+                SELECT user_id, entity_type, 1 AS n FROM new_notes
+                WHERE entity_type IS NOT NULL AND NOT is_archived
+            ) s
+            GROUP BY user_id, entity_type
+            HAVING sum(n) <> 0
+        ), decremented AS (
+            UPDATE user_entity_type_counts c SET count = c.count + d.n
+            FROM delta d
+            WHERE d.n < 0 AND c.user_id = d.user_id AND c.entity_type = d.entity_type
+        )
+        INSERT INTO user_entity_type_counts AS c (user_id, entity_type, count)
+        SELECT user_id, entity_type, n FROM delta
+        WHERE n > 0
+        ORDER BY user_id, entity_type
+        ON CONFLICT (user_id, entity_type) DO UPDATE SET count = c.count + EXCLUDED.count;
+    END IF;
+    RETURN NULL;
+END
+$fn$ LANGUAGE plpgsql;
+"""
+
+
+def _counters_trigger_sql() -> str:
+    """Hàm trigger cấp câu lệnh: mỗi user bị ảnh hưởng chỉ được cập nhật một lần mỗi câu lệnh."""
+    return COUNTERS_TRIGGER_SQL.format(
+        old_cols=", ".join(f"o.{col}" for col in NOTE_VERSIONED_COLUMNS),
+        new_cols=", ".join(f"n.{col}" for col in NOTE_VERSIONED_COLUMNS),
+    )
+
+
+def install_note_counters(conn: Connection):
+    """
+    Cài đặt cột users.notes_version và trigger duy trì bộ đếm (notes_version và
+    user_entity_type_counts) trên note_items.
+
+    Trigger cấp câu lệnh với transition table: một INSERT nhiều dòng (create_notes theo lô)
+    chỉ cập nhật và khóa dòng users của mỗi user một lần. UPDATE chỉ tăng bộ đếm khi giá trị
+    một cột trong NOTE_VERSIONED_COLUMNS thực sự thay đổi (transition table không dùng được
+    với UPDATE OF danh sách cột); thay đổi entity_type / is_archived / user_id luôn nằm trong đó,
+    nên dòng users bị khóa trước mọi thay đổi thống kê entity_type.
+
+    Args:
+        conn: Kết nối cơ sở dữ liệu
+    """
+    conn.execute(
+        text(
+            """
+ALTER TABLE users
+    ADD COLUMN IF NOT EXISTS notes_version bigint NOT NULL DEFAULT 0;
+"""
+        )
+    )
+
+    conn.execute(text(_counters_trigger_sql()))
+
+    # Transition table chỉ dùng được với trigger một sự kiện - mỗi sự kiện một trigger
+    conn.execute(
+        text(
+            """
+DROP TRIGGER IF EXISTS note_items_version_trigger ON note_items;
+DROP FUNCTION IF EXISTS note_items_version_trigger();
+
+DROP TRIGGER IF EXISTS note_items_version_insert_trigger ON note_items;
+CREATE TRIGGER note_items_version_insert_trigger
+AFTER INSERT ON note_items
+REFERENCING NEW TABLE AS new_notes
+FOR EACH STATEMENT EXECUTE FUNCTION note_items_version_stmt_trigger();
+
+DROP TRIGGER IF EXISTS note_items_version_update_trigger ON note_items;
+CREATE TRIGGER note_items_version_update_trigger
+AFTER UPDATE ON note_items
+REFERENCING OLD TABLE AS old_notes NEW TABLE AS new_notes
+FOR EACH STATEMENT EXECUTE FUNCTION note_items_version_stmt_trigger();
+
+DROP TRIGGER IF EXISTS note_items_version_delete_trigger ON note_items;
+CREATE TRIGGER note_items_version_delete_trigger
+AFTER DELETE ON note_items
+REFERENCING OLD TABLE AS old_notes
+FOR EACH STATEMENT EXECUTE FUNCTION note_items_version_stmt_trigger();
+"""
+        )
+    )
+
+
+def install_entity_type_counts(conn: Connection, reconcile: bool = True):
+    """
+    Cài đặt bảng user_entity_type_counts (gỡ trigger từng dòng cũ) và đối soát lần đầu.
+
+    Args:
+        conn: Kết nối cơ sở dữ liệu
+        reconcile: Tính lại bảng thống kê từ note_items sau khi cài trigger
+    """
+    conn.execute(
+        text(
+            """
+CREATE TABLE IF NOT EXISTS user_entity_type_counts (
+    user_id uuid NOT NULL,
+    entity_type varchar NOT NULL,
+    count bigint NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, entity_type)
+);
+"""
+        )
+    )
+
+    # Thống kê do trigger cấp câu lệnh của install_note_counters duy trì; dòng về 0 được giữ lại
+    # (đọc lọc count > 0) để tránh race DELETE / INSERT đồng thời
+    conn.execute(
+        text(
+            """
+DROP TRIGGER IF EXISTS note_items_entity_count_trigger ON note_items;
+DROP FUNCTION IF EXISTS note_items_entity_count_trigger();
+"""
+        )
+    )
+
+    if reconcile:
+        reconcile_entity_type_counts(conn)
+
+
+def reconcile_entity_type_counts(conn: Connection, user_id: UUID | None = None) -> int:
+    """
+    Tính lại user_entity_type_counts từ note_items.
+
+    Một user: khóa dòng users của user đó (FOR UPDATE) - trigger bộ đếm cập nhật dòng này trước
+    khi sửa thống kê, nên ghi chú của user khác không bị chặn. Toàn bộ: khóa ghi trên
+    note_items (SHARE MODE) trong transaction hiện tại.
+
+    Args:
+        conn: Kết nối cơ sở dữ liệu (trong transaction)
+        user_id: Chỉ đối soát một user (None = toàn bộ)
+
+    Returns:
+        Số dòng thống kê sau khi tính lại
+    """
+    if user_id:
+        conn.execute(text("SELECT 1 FROM users WHERE id = :user_id FOR UPDATE"), {"user_id": user_id})
+    else:
+        conn.execute(text("LOCK TABLE note_items IN SHARE MODE"))
+
+    user_filter = "AND user_id = :user_id" if user_id else ""
+    params = {"user_id": user_id} if user_id else {}
+
+    conn.execute(
+        text(f"DELETE FROM user_entity_type_counts WHERE true {user_filter}"),
+        params,
+    )
+    result = conn.execute(
+        text(
+            f"""
+INSERT INTO user_entity_type_counts (user_id, entity_type, count)
+SELECT user_id, entity_type, count(*)
+FROM note_items
+WHERE entity_type IS NOT NULL AND NOT is_archived {user_filter}
+GROUP BY user_id, entity_type
+"""
+        ),
+        params,
+    )
+    return result.rowcount or 0
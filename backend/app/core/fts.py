@@ -1,31 +1,112 @@
 """
 Thiết lập tìm kiếm toàn văn cho PostgreSQL trên bảng note_items.
 """
+import re
+
 from sqlalchemy import text
 from sqlalchemy.engine import Connection
 
 
+# Văn bản chuẩn hóa (chữ thường) dùng cho tìm kiếm chuỗi con / gõ sai với pg_trgm
+SEARCH_TEXT_EXPR = (
+    "lower(coalesce(title, '') || ' ' || coalesce(content_text, '') || ' ' || coalesce(ocr_text, ''))"
+)
+
+
+# Truy vấn tsquery: websearch_to_tsquery (cú pháp tự nhiên) OR tiền tố từng từ ("điện:*")
+TSQUERY_SQL = (
+    "(websearch_to_tsquery(CAST(:fts_cfg AS regconfig), :fts_question)"
+    " || to_tsquery(CAST(:fts_cfg AS regconfig), :fts_prefix))"
+)
+
+
+def tsquery_params(question: str, words: list[str], cfg: str) -> dict:
+    """
+    Tham số cho TSQUERY_SQL.
+
+    Args:
+        question: Câu hỏi gốc (cho websearch_to_tsquery)
+        words: Các từ đã tách an toàn (chỉ ký tự chữ/số) để so khớp tiền tố
+        cfg: Cấu hình tìm kiếm văn bản
+    """
+    return {
+        "fts_cfg": cfg,
+        "fts_question": question,
+        "fts_prefix": " | ".join(f"{w}:*" for w in words),
+    }
+
+
+# Tăng khi thay đổi cách dựng tsvector (trọng số, cột nguồn) để buộc backfill lại
+FTS_SCHEMA_VERSION = 2
+
+_BUILTIN_TS_CONFIGS = {"simple"}
+_IDENTIFIER_RE = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+
+def fts_signature(cfg: str) -> str:
+    """Chữ ký cấu hình FTS hiện tại - khác chữ ký đã backfill nghĩa là cần rebuild tsv_content."""
+    return f"cfg={cfg};weights=A:title,B:content+ocr,C:summary;v={FTS_SCHEMA_VERSION}"
+
+
 def install_note_items_fts(conn: Connection, cfg: str = "simple"):
     """
     Cài đặt trigger tìm kiếm toàn văn cho bảng note_items.
+
+    Nếu `cfg` chưa tồn tại, tạo text search configuration mới (COPY = simple)
+    với từ điển `unaccent` để "dien thoai" khớp "điện thoại".
+    tsvector có trọng số: title (A), content_text + ocr_text (B), semantic_summary (C);
+    image_metadata không còn được index.
     
     Args:
         conn: Kết nối cơ sở dữ liệu
         cfg: Cấu hình tìm kiếm văn bản PostgreSQL (mặc định: "simple")
     """
-    # Tạo hoặc thay thế hàm trigger
+    if not _IDENTIFIER_RE.match(cfg):
+        raise ValueError(f"Tên cấu hình FTS không hợp lệ: {cfg}")
+
+    # Cấu hình tìm kiếm bỏ dấu tiếng Việt
+    if cfg not in _BUILTIN_TS_CONFIGS:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS unaccent"))
+        conn.execute(
+            text(
+                f"""
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = '{cfg}') THEN
+        CREATE TEXT SEARCH CONFIGURATION {cfg} (COPY = simple);
+        ALTER TEXT SEARCH CONFIGURATION {cfg}
+            ALTER MAPPING FOR hword, hword_part, word WITH unaccent, simple;
+    END IF;
+END$$;
+"""
+            )
+        )
+
+    # Hàm dựng tsvector có trọng số - dùng chung cho trigger và lệnh backfill
     conn.execute(
         text(
             f"""
+CREATE OR REPLACE FUNCTION note_items_build_tsv(
+    p_title text, p_content text, p_ocr text, p_summary text
+) RETURNS tsvector AS $fn$
+    SELECT setweight(to_tsvector('{cfg}'::regconfig, coalesce(p_title, '')), 'A')
+        || setweight(to_tsvector('{cfg}'::regconfig, coalesce(p_content, '') || ' ' || coalesce(p_ocr, '')), 'B')
+        || setweight(to_tsvector('{cfg}'::regconfig, coalesce(p_summary, '')), 'C')
+$fn$ LANGUAGE sql STABLE;
+
+COMMENT ON FUNCTION note_items_build_tsv(text, text, text, text) IS '{fts_signature(cfg)}';
+"""
+        )
+    )
+
+    # Tạo hoặc thay thế hàm trigger
+    conn.execute(
+        text(
+            """
 CREATE OR REPLACE FUNCTION note_items_tsv_trigger() RETURNS trigger AS $fn$
 BEGIN
-    -- Kết hợp title + content_text + ocr_text + image_metadata thành tsvector
-    NEW.tsv_content := to_tsvector(
-        '{cfg}',
-        coalesce(NEW.title,'') || ' ' ||
-        coalesce(NEW.content_text,'') || ' ' ||
-        coalesce(NEW.ocr_text,'') || ' ' ||
-        coalesce(NEW.image_metadata::text,'')
+    NEW.tsv_content := note_items_build_tsv(
+        NEW.title, NEW.content_text, NEW.ocr_text, NEW.semantic_summary
     );
     RETURN NEW;
 END
@@ -34,21 +115,15 @@ $fn$ LANGUAGE plpgsql;
         )
     )
 
-    # Tạo trigger chỉ khi chưa tồn tại
+    # Tạo lại trigger để cập nhật danh sách cột theo dõi
     conn.execute(
         text(
             """
-DO $$
-BEGIN
-    IF NOT EXISTS (
-        SELECT 1 FROM pg_trigger WHERE tgname = 'note_items_tsv_content_trigger'
-    ) THEN
-        CREATE TRIGGER note_items_tsv_content_trigger
-        BEFORE INSERT OR UPDATE OF title, content_text, ocr_text, image_metadata
-        ON note_items
-        FOR EACH ROW EXECUTE FUNCTION note_items_tsv_trigger();
-    END IF;
-END$$;
+DROP TRIGGER IF EXISTS note_items_tsv_content_trigger ON note_items;
+CREATE TRIGGER note_items_tsv_content_trigger
+BEFORE INSERT OR UPDATE OF title, content_text, ocr_text, semantic_summary
+ON note_items
+FOR EACH ROW EXECUTE FUNCTION note_items_tsv_trigger();
 """
         )
     )
@@ -70,3 +145,158 @@ END$$;
 """
         )
     )
+
+    # Cột search_text + GIN trigram cho tìm kiếm chuỗi con và chịu lỗi gõ
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    conn.execute(
+        text(
+            f"""
+ALTER TABLE note_items
+    ADD COLUMN IF NOT EXISTS search_text text
+        GENERATED ALWAYS AS ({SEARCH_TEXT_EXPR}) STORED;
+"""
+        )
+    )
+    conn.execute(
+        text(
+            """
+CREATE INDEX IF NOT EXISTS idx_note_items_search_text_trgm
+    ON note_items USING GIN (search_text gin_trgm_ops);
+"""
+        )
+    )
+
+
+def install_note_items_entity_search(conn: Connection):
+    """
+    Cài đặt tìm kiếm entity phía PostgreSQL cho bảng note_items.
+
+    - GIN jsonb_path_ops trên `entities` cho truy vấn containment (@>)
+    - Cột sinh `entities_text` (đã chuẩn hóa chữ thường) + GIN trigram cho so khớp mờ
+    - Các cột giá trị chuẩn hóa `entity_phones`, `entity_emails`, `entity_prices`
+      do trigger duy trì, có GIN index để tra cứu chính xác
+
+    Args:
+        conn: Kết nối cơ sở dữ liệu
+    """
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+    # Cột mới cho các database đã tồn tại (create_all đã tạo sẵn với database mới)
+    conn.execute(
+        text(
+            """
+ALTER TABLE note_items
+    ADD COLUMN IF NOT EXISTS entities_text text
+        GENERATED ALWAYS AS (lower(entities::text)) STORED,
+    ADD COLUMN IF NOT EXISTS entity_phones text[],
+    ADD COLUMN IF NOT EXISTS entity_emails text[],
+    ADD COLUMN IF NOT EXISTS entity_prices numeric[];
+"""
+        )
+    )
+
+    # Hàm trigger chuẩn hóa số điện thoại / email / giá tiền từ entities
+    conn.execute(
+        text(
+            r"""
+CREATE OR REPLACE FUNCTION note_items_entity_values_trigger() RETURNS trigger AS $fn$
+DECLARE
+    doc text := lower(coalesce(NEW.entities::text, ''));
+BEGIN
+    -- Số điện thoại: chỉ giữ chữ số, +84/84 -> 0
+    NEW.entity_phones := ARRAY(
+        SELECT DISTINCT p.digits
+        FROM (
+            SELECT regexp_replace(regexp_replace(m[1], '\D', '', 'g'), '^84(\d{9,10})$', '0\1') AS digits
+            FROM regexp_matches(doc, '(\+?\d[\d .-]{7,}\d)', 'g') AS m
+        ) p
+        WHERE p.digits ~ '^0\d{8,10}$'
+    );
+    NEW.entity_emails := ARRAY(
+        SELECT DISTINCT m[1]
+        FROM regexp_matches(doc, '([a-z0-9._%+-]+@[a-z0-9.-]+\.[a-z]{2,})', 'g') AS m
+    );
+    -- Giá tiền: số có dấu phân cách nghìn hoặc có đơn vị (k, đ, vnd...)
+    NEW.entity_prices := ARRAY(
+        SELECT DISTINCT regexp_replace(m[1], '[.,]', '', 'g')::numeric
+            * CASE WHEN m[2] = 'k' THEN 1000 ELSE 1 END
+        FROM regexp_matches(doc, '(\d{1,3}(?:[.,]\d{3})+|\d+)\s*(k|đ|₫|vnd|vnđ|đồng)?', 'g') AS m
+        WHERE m[2] IS NOT NULL OR m[1] ~ '[.,]'
+    );
+    RETURN NEW;
+END
+$fn$ LANGUAGE plpgsql;
+"""
+        )
+    )
+
+    conn.execute(
+        text(
+            """
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_trigger WHERE tgname = 'note_items_entity_values_trigger'
+    ) THEN
+        CREATE TRIGGER note_items_entity_values_trigger
+        BEFORE INSERT OR UPDATE OF entities
+        ON note_items
+        FOR EACH ROW EXECUTE FUNCTION note_items_entity_values_trigger();
+    END IF;
+END$$;
+"""
+        )
+    )
+
+    conn.execute(
+        text(
+            """
+CREATE INDEX IF NOT EXISTS idx_note_items_entities_path
+    ON note_items USING GIN (entities jsonb_path_ops);
+CREATE INDEX IF NOT EXISTS idx_note_items_entities_text_trgm
+    ON note_items USING GIN (entities_text gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_note_items_entity_phones
+    ON note_items USING GIN (entity_phones);
+CREATE INDEX IF NOT EXISTS idx_note_items_entity_emails
+    ON note_items USING GIN (entity_emails);
+CREATE INDEX IF NOT EXISTS idx_note_items_entity_prices
+    ON note_items USING GIN (entity_prices);
+"""
+        )
+    )
+
+    # Backfill các note cũ chưa có giá trị chuẩn hóa (trigger tự tính lại)
+    conn.execute(
+        text(
+            """
+UPDATE note_items SET entities = entities
+WHERE entities IS NOT NULL AND entity_phones IS NULL;
+"""
+        )
+    )
+
+
+def fts_needs_rebuild(conn: Connection) -> bool:
+    """
+    Kiểm tra tsv_content có được dựng bằng cấu hình FTS hiện tại hay chưa.
+
+    So sánh chữ ký của hàm note_items_build_tsv với chữ ký ghi trên cột
+    tsv_content sau lần backfill gần nhất.
+    """
+    row = conn.execute(
+        text(
+            """
+SELECT
+    obj_description(to_regprocedure('note_items_build_tsv(text, text, text, text)'), 'pg_proc') AS installed,
+    col_description('note_items'::regclass, a.attnum) AS built
+FROM pg_attribute a
+WHERE a.attrelid = 'note_items'::regclass AND a.attname = 'tsv_content'
+"""
+        )
+    ).first()
+    return row is None or row.installed is None or row.installed != row.built
+
+
+def mark_fts_rebuilt(conn: Connection, cfg: str):
+    """Ghi chữ ký cấu hình FTS đã backfill lên cột tsv_content."""
+    conn.execute(text(f"COMMENT ON COLUMN note_items.tsv_content IS '{fts_signature(cfg)}'"))
@@ -27,6 +27,7 @@ class APIClient:
         prompt: str,
         system_message: Optional[str] = None,
         image_base64: Optional[str] = None,
+        image_mime: str = "image/jpeg",
         timeout: float = 120.0
     ) -> Optional[str]:
         """Gọi OpenAI API (GPT)."""
@@ -45,7 +46,7 @@ class APIClient:
                     "role": "user",
                     "content": [
                         {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}}
+                        {"type": "image_url", "image_url": {"url": f"data:{image_mime};base64,{image_base64}"}}
                     ]
                 })
             else:
@@ -81,6 +82,7 @@ class APIClient:
         model: str,
         prompt: str,
         image_base64: Optional[str] = None,
+        image_mime: str = "image/jpeg",
         timeout: float = 120.0
     ) -> Optional[str]:
         """Gọi Google Gemini API."""
@@ -93,7 +95,7 @@ class APIClient:
                 contents.append({
                     "parts": [
                         {"text": prompt},
-                        {"inline_data": {"mime_type": "image/jpeg", "data": image_base64}}
+                        {"inline_data": {"mime_type": image_mime, "data": image_base64}}
                     ]
                 })
             else:
@@ -213,6 +215,7 @@ class APIClient:
         prompt: str,
         system_message: Optional[str] = None,
         image_base64: Optional[str] = None,
+        image_mime: str = "image/jpeg",
         timeout: float = 120.0
     ) -> Optional[str]:
         """Gọi Anthropic Claude API."""
@@ -229,7 +232,7 @@ class APIClient:
                     "type": "image",
                     "source": {
                         "type": "base64",
-                        "media_type": "image/jpeg",
+                        "media_type": image_mime,
                         "data": image_base64
                     }
                 })
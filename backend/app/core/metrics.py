@@ -0,0 +1,78 @@
+"""
+Bộ đếm metrics trong tiến trình, xuất theo định dạng text của Prometheus tại GET /metrics.
+
+Mỗi worker giữ số liệu riêng; Prometheus scrape từng worker (hoặc cộng theo instance).
+"""
+import threading
+from collections import defaultdict
+from typing import Dict, Tuple
+
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key: LabelKey) -> str:
+    if not key:
+        return ""
+    body = ",".join(f'{name}="{value}"' for name, value in key)
+    return "{" + body + "}"
+
+
+class MetricsRegistry:
+    """Counter và summary (tổng + số lần) đơn giản, an toàn giữa các thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = defaultdict(lambda: defaultdict(float))
+        self._summaries: Dict[str, Dict[LabelKey, list]] = defaultdict(lambda: defaultdict(lambda: [0.0, 0]))
+        self._help: Dict[str, str] = {}
+
+    def describe(self, name: str, help_text: str):
+        """Gắn mô tả (# HELP) cho một metric."""
+        self._help[name] = help_text
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        """Tăng counter `name`."""
+        key = _label_key(labels)
+        with self._lock:
+            self._counters[name][key] += amount
+
+    def observe(self, name: str, value: float, **labels):
+        """Ghi nhận một giá trị (ví dụ thời gian, số byte) vào summary `name`."""
+        key = _label_key(labels)
+        with self._lock:
+            entry = self._summaries[name][key]
+            entry[0] += value
+            entry[1] += 1
+
+    def get(self, name: str, **labels) -> float:
+        """Giá trị hiện tại của counter."""
+        with self._lock:
+            return self._counters.get(name, {}).get(_label_key(labels), 0.0)
+
+    def render(self) -> str:
+        """Xuất toàn bộ metrics theo định dạng text của Prometheus."""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(key)} {value:g}")
+            for name, series in sorted(self._summaries.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} summary")
+                for key, (total, count) in sorted(series.items()):
+                    lines.append(f"{name}_sum{_format_labels(key)} {total:g}")
+                    lines.append(f"{name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+# Singleton instance
+metrics = MetricsRegistry()
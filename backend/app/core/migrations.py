@@ -0,0 +1,44 @@
+"""
+Kiểm tra và chạy migration Alembic khi khởi động ứng dụng.
+"""
+from pathlib import Path
+
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy.engine import Connection
+
+
+ALEMBIC_INI = Path(__file__).resolve().parents[2] / "alembic.ini"
+
+
+def alembic_config() -> Config:
+    """Tạo cấu hình Alembic từ backend/alembic.ini."""
+    config = Config(str(ALEMBIC_INI))
+    # Không để fileConfig của Alembic ghi đè cấu hình logging của uvicorn
+    config.attributes["configure_logger"] = False
+    return config
+
+
+def head_revision() -> str | None:
+    """Revision mới nhất trong migrations/versions."""
+    return ScriptDirectory.from_config(alembic_config()).get_current_head()
+
+
+def current_revision(conn: Connection) -> str | None:
+    """Revision hiện tại của database (None nếu chưa từng migrate)."""
+    return MigrationContext.configure(conn).get_current_revision()
+
+
+def upgrade_database(conn: Connection):
+    """
+    Chạy `alembic upgrade head` trên kết nối có sẵn.
+
+    Args:
+        conn: Kết nối chưa mở transaction (engine.connect()) - Alembic tự quản lý
+              transaction để autocommit_block (CREATE INDEX CONCURRENTLY) hoạt động
+    """
+    config = alembic_config()
+    config.attributes["connection"] = conn
+    command.upgrade(config, "head")
@@ -0,0 +1,134 @@
+"""
+Phân trang keyset (cursor) theo cặp (created_at, id).
+
+Cursor là chuỗi base64 mờ (opaque) mã hóa vị trí của phần tử cuối trang trước;
+mỗi trang là một index range scan thay vì LIMIT/OFFSET quét lại các dòng đã bỏ qua.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from sqlalchemy import Select, tuple_
+
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def _encode_token(data: dict) -> str:
+    """Mã hóa dict thành chuỗi base64 url-safe (bỏ padding)."""
+    raw = json.dumps(data, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_token(token: str) -> dict:
+    """Giải mã chuỗi do _encode_token tạo ra."""
+    padded = token + "=" * (-len(token) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+
+
+def encode_cursor(created_at: datetime, item_id: UUID) -> str:
+    """Mã hóa vị trí (created_at, id) thành cursor."""
+    return _encode_token({"c": created_at.isoformat(), "i": str(item_id)})
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    """
+    Giải mã cursor thành (created_at, id).
+
+    Raises:
+        ValueError: Nếu cursor không hợp lệ
+    """
+    try:
+        data = _decode_token(cursor)
+        return datetime.fromisoformat(data["c"]), UUID(data["i"])
+    except Exception as e:
+        raise ValueError("Cursor không hợp lệ") from e
+
+
+class ChangeTokenExpired(ValueError):
+    """Change token cũ hơn thời gian lưu tombstone - client phải đồng bộ lại toàn bộ."""
+
+
+def encode_change_token(
+    changed_at: datetime,
+    item_id: Optional[UUID] = None,
+    issued_at: Optional[datetime] = None,
+) -> str:
+    """
+    Mã hóa change token cho đồng bộ delta.
+
+    Args:
+        changed_at: Mốc thời gian thay đổi
+        item_id: id dòng cuối của trang trước khi còn dữ liệu (keyset chính xác);
+                 None = mốc cuối đợt đồng bộ (áp dụng cửa sổ an toàn ở lần sau)
+        issued_at: Thời điểm phát hành token tiếp trang (kiểm tra hết hạn thay cho changed_at,
+                   vì changed_at của trang giữa có thể là updated_at của ghi chú rất cũ)
+    """
+    data = {"t": changed_at.isoformat()}
+    if item_id is not None:
+        data["i"] = str(item_id)
+    if issued_at is not None:
+        data["s"] = issued_at.isoformat()
+    return _encode_token(data)
+
+
+def decode_change_token(token: str) -> Tuple[datetime, Optional[UUID], Optional[datetime]]:
+    """
+    Giải mã change token thành (changed_at, id hoặc None, issued_at hoặc None).
+
+    Raises:
+        ValueError: Nếu token không hợp lệ
+    """
+    try:
+        data = _decode_token(token)
+        item_id = UUID(data["i"]) if "i" in data else None
+        issued_at = datetime.fromisoformat(data["s"]) if "s" in data else None
+        return datetime.fromisoformat(data["t"]), item_id, issued_at
+    except Exception as e:
+        raise ValueError("Change token không hợp lệ") from e
+
+
+def keyset_paginate(
+    query: Select,
+    created_col: Any,
+    id_col: Any,
+    cursor: Optional[str],
+    limit: int,
+) -> Select:
+    """
+    Áp dụng điều kiện keyset + ORDER BY (created_at DESC, id DESC) cho truy vấn.
+
+    Lấy dư một dòng (limit + 1) để biết còn trang sau hay không.
+
+    Args:
+        query: Truy vấn đã có các điều kiện lọc
+        created_col: Cột created_at
+        id_col: Cột id
+        cursor: Cursor của trang trước (None = trang đầu)
+        limit: Kích thước trang
+    """
+    if cursor:
+        created_at, item_id = decode_cursor(cursor)
+        query = query.where(tuple_(created_col, id_col) < tuple_(created_at, item_id))
+
+    return query.order_by(created_col.desc(), id_col.desc()).limit(limit + 1)
+
+
+def split_page(rows: Sequence[Any], limit: int) -> Tuple[List[Any], Optional[str]]:
+    """
+    Tách kết quả (limit + 1 dòng) thành trang hiện tại và cursor trang sau.
+
+    Returns:
+        Tuple (items, next_cursor) - next_cursor là None nếu đã hết dữ liệu
+    """
+    items = list(rows[:limit])
+    if len(rows) <= limit or not items:
+        return items, None
+
+    last = items[-1]
+    return items, encode_cursor(last.created_at, last.id)
@@ -0,0 +1,252 @@
+"""
+Chia hash partition bảng note_items theo user_id (tùy chọn, cho tenant lớn).
+
+Quy trình chuyển đổi trực tuyến (xem app/commands/partition_note_items.py):
+
+1. prepare: tạo note_items_partitioned (PARTITION BY HASH (user_id)) cùng các index,
+   cài trigger mirror trên note_items để mọi thay đổi mới được ghi sang bảng mới
+2. copy: sao chép dữ liệu cũ theo lô (keyset theo id), không khóa ghi
+3. swap: trong một transaction ngắn, đổi tên bảng / index và cài lại các trigger
+   (FTS, entity, bộ đếm) trên bảng partitioned - PostgreSQL tự nhân bản xuống từng partition
+
+Khóa chính của bảng partitioned là (id, user_id) vì phải chứa khóa partition.
+"""
+import re
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from app.core.counters import install_note_counters, install_entity_type_counts
+from app.core.fts import install_note_items_fts, install_note_items_entity_search
+
+
+PARTITIONED_TABLE = "note_items_partitioned"
+UNPARTITIONED_TABLE = "note_items_unpartitioned"
+PARTITION_PREFIX = "note_items_p"
+
+# Index trên bảng mới tạm mang hậu tố này tới khi swap (tên index là duy nhất trong schema)
+_INDEX_SUFFIX = "_hp"
+_COPY_DONE_COMMENT = "copy-complete"
+
+# Các trigger đang gắn với note_items, được cài lại trên bảng partitioned khi swap
+_NOTE_ITEMS_TRIGGERS = (
+    "note_items_tsv_content_trigger",
+    "note_items_entity_values_trigger",
+    "note_items_version_trigger",
+    "note_items_entity_count_trigger",
+)
+
+# BEFORE ROW trigger trên bảng partitioned cần PostgreSQL 13+
+_MIN_SERVER_VERSION = 130000
+
+
+COPY_BATCH_SQL = """
+WITH batch AS (
+    SELECT {columns} FROM note_items
+    WHERE id > :after_id
+    ORDER BY id
+    LIMIT :batch_size
+    FOR KEY SHARE
+), copied AS (
+    INSERT INTO {table} ({columns})
+    SELECT {columns} FROM batch
+    ON CONFLICT (id, user_id) DO NOTHING
+)
+SELECT
+    (SELECT count(*) FROM batch) AS batch_count,
+    (SELECT id FROM batch ORDER BY id DESC LIMIT 1) AS last_id
+"""
+
+
+def note_items_is_partitioned(conn: Connection) -> bool:
+    """Kiểm tra note_items đã là bảng partitioned hay chưa."""
+    return bool(
+        conn.execute(
+            text("SELECT relkind = 'p' FROM pg_class WHERE oid = 'note_items'::regclass")
+        ).scalar()
+    )
+
+
+def _copy_columns(conn: Connection, table: str = "note_items") -> list[str]:
+    """Các cột ghi được (bỏ cột GENERATED) theo thứ tự định nghĩa."""
+    return conn.execute(
+        text(
+            """
+SELECT column_name FROM information_schema.columns
+WHERE table_schema = current_schema() AND table_name = :table AND is_generated = 'NEVER'
+ORDER BY ordinal_position
+"""
+        ),
+        {"table": table},
+    ).scalars().all()
+
+
+def _index_definitions(conn: Connection, table: str) -> list[tuple[str, str]]:
+    """(tên, định nghĩa) của các index trên bảng, trừ khóa chính."""
+    return conn.execute(
+        text(
+            """
+SELECT i.indexname, i.indexdef FROM pg_indexes i
+WHERE i.schemaname = current_schema() AND i.tablename = :table
+    AND i.indexname <> :table || '_pkey'
+ORDER BY i.indexname
+"""
+        ),
+        {"table": table},
+    ).all()
+
+
+def prepare_partitioned_note_items(conn: Connection, partitions: int):
+    """
+    Tạo bảng note_items_partitioned + partition + index và trigger mirror.
+
+    Args:
+        conn: Kết nối cơ sở dữ liệu (trong transaction)
+        partitions: Số partition hash (MODULUS)
+
+    Raises:
+        RuntimeError: Nếu PostgreSQL quá cũ hoặc note_items đã được partition
+    """
+    if partitions < 2:
+        raise ValueError("Cần ít nhất 2 partition")
+
+    version = conn.execute(text("SHOW server_version_num")).scalar()
+    if int(version) < _MIN_SERVER_VERSION:
+        raise RuntimeError("Hash partitioning note_items cần PostgreSQL 13 trở lên")
+    if note_items_is_partitioned(conn):
+        raise RuntimeError("note_items đã là bảng partitioned")
+
+    conn.execute(
+        text(
+            f"""
+CREATE TABLE {PARTITIONED_TABLE} (
+    LIKE note_items INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE INCLUDING COMMENTS
+) PARTITION BY HASH (user_id);
+ALTER TABLE {PARTITIONED_TABLE} ADD CONSTRAINT {PARTITIONED_TABLE}_pkey PRIMARY KEY (id, user_id);
+"""
+        )
+    )
+    for remainder in range(partitions):
+        conn.execute(
+            text(
+                f"CREATE TABLE {PARTITION_PREFIX}{remainder} PARTITION OF {PARTITIONED_TABLE} "
+                f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+            )
+        )
+
+    # Index tạo trên bảng cha được PostgreSQL tạo tương ứng trên từng partition
+    for name, definition in _index_definitions(conn, "note_items"):
+        definition = definition.replace(f"INDEX {name} ON", f"INDEX {name}{_INDEX_SUFFIX} ON", 1)
+        definition = re.sub(r" ON (ONLY )?(\S+\.)?note_items ", f" ON {PARTITIONED_TABLE} ", definition, count=1)
+        conn.execute(text(definition))
+
+    # Trigger mirror: thay đổi trên note_items trong lúc copy được ghi ngay sang bảng mới
+    columns = _copy_columns(conn)
+    column_list = ", ".join(columns)
+    new_values = ", ".join(f"NEW.{column}" for column in columns)
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns if column not in ("id", "user_id"))
+    conn.execute(
+        text(
+            f"""
+CREATE OR REPLACE FUNCTION note_items_partition_mirror() RETURNS trigger AS $fn$
+BEGIN
+    IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND NEW.user_id IS DISTINCT FROM OLD.user_id) THEN
+        DELETE FROM {PARTITIONED_TABLE} WHERE id = OLD.id AND user_id = OLD.user_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO {PARTITIONED_TABLE} ({column_list}) VALUES ({new_values})
+        ON CONFLICT (id, user_id) DO UPDATE SET {updates};
+    END IF;
+    RETURN NULL;
+END
+$fn$ LANGUAGE plpgsql;
+
+CREATE TRIGGER note_items_partition_mirror
+AFTER INSERT OR UPDATE OR DELETE ON note_items
+FOR EACH ROW EXECUTE FUNCTION note_items_partition_mirror();
+"""
+        )
+    )
+
+
+def copy_note_items_batch(conn: Connection, after_id, batch_size: int) -> tuple[int, object]:
+    """
+    Sao chép một lô note sang bảng partitioned (lô đầu tiên: after_id = UUID 0).
+
+    FOR KEY SHARE bỏ qua các dòng vừa bị xóa đồng thời; dòng đã được trigger mirror
+    ghi (bản mới hơn) được giữ nguyên nhờ ON CONFLICT DO NOTHING.
+
+    Returns:
+        Tuple (số dòng trong lô, id cuối cùng) - số dòng 0 nghĩa là đã hết
+    """
+    columns = ", ".join(_copy_columns(conn))
+    row = conn.execute(
+        text(COPY_BATCH_SQL.format(columns=columns, table=PARTITIONED_TABLE)),
+        {"after_id": after_id, "batch_size": batch_size},
+    ).one()
+    return row.batch_count, row.last_id
+
+
+def mark_copy_complete(conn: Connection):
+    """Đánh dấu đã copy xong dữ liệu cũ - điều kiện để swap."""
+    conn.execute(text(f"COMMENT ON TABLE {PARTITIONED_TABLE} IS '{_COPY_DONE_COMMENT}'"))
+
+
+def swap_partitioned_note_items(conn: Connection, fts_cfg: str):
+    """
+    Đổi note_items sang bảng partitioned trong một transaction (ACCESS EXCLUSIVE ngắn).
+
+    Bảng cũ được giữ lại với tên note_items_unpartitioned để đối chiếu trước khi DROP.
+
+    Raises:
+        RuntimeError: Nếu chưa copy xong
+    """
+    comment = conn.execute(
+        text("SELECT obj_description(to_regclass(:table), 'pg_class')"),
+        {"table": PARTITIONED_TABLE},
+    ).scalar()
+    if comment != _COPY_DONE_COMMENT:
+        raise RuntimeError("Chưa copy xong dữ liệu sang bảng partitioned - chạy bước copy trước")
+
+    conn.execute(text("LOCK TABLE note_items IN ACCESS EXCLUSIVE MODE"))
+    conn.execute(text("DROP TRIGGER IF EXISTS note_items_partition_mirror ON note_items"))
+    for trigger in _NOTE_ITEMS_TRIGGERS:
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger} ON note_items"))
+
+    # Bảng cũ: giải phóng tên bảng / index
+    old_indexes = _index_definitions(conn, "note_items")
+    conn.execute(text(f"ALTER TABLE note_items RENAME TO {UNPARTITIONED_TABLE}"))
+    conn.execute(text(f"ALTER INDEX note_items_pkey RENAME TO {UNPARTITIONED_TABLE}_pkey"))
+    for name, _definition in old_indexes:
+        conn.execute(text(f"ALTER INDEX {name} RENAME TO {name}_old"))
+
+    # Bảng mới nhận tên note_items
+    new_indexes = _index_definitions(conn, PARTITIONED_TABLE)
+    conn.execute(text(f"ALTER TABLE {PARTITIONED_TABLE} RENAME TO note_items"))
+    conn.execute(text(f"ALTER INDEX {PARTITIONED_TABLE}_pkey RENAME TO note_items_pkey"))
+    for name, _definition in new_indexes:
+        if name.endswith(_INDEX_SUFFIX):
+            conn.execute(text(f"ALTER INDEX {name} RENAME TO {name[:-len(_INDEX_SUFFIX)]}"))
+    conn.execute(text("COMMENT ON TABLE note_items IS NULL"))
+    conn.execute(text("DROP FUNCTION IF EXISTS note_items_partition_mirror()"))
+
+    # Trigger trên bảng cha được nhân bản xuống mọi partition
+    install_note_items_fts(conn, fts_cfg)
+    install_note_items_entity_search(conn)
+    install_entity_type_counts(conn, reconcile=False)
+    install_note_counters(conn)
+
+
+def partition_stats(conn: Connection) -> list[tuple[str, int, str]]:
+    """(tên partition, số dòng ước lượng, kích thước) của note_items."""
+    return conn.execute(
+        text(
+            """
+SELECT c.relname, c.reltuples::bigint, pg_size_pretty(pg_total_relation_size(c.oid))
+FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = 'note_items'::regclass
+ORDER BY c.relname
+"""
+        )
+    ).all()
@@ -0,0 +1,182 @@
+"""
+Partition theo tháng (RANGE created_at) cho qa_requests và chính sách lưu giữ.
+
+- Partition được đặt tên qa_requests_yYYYYmMM, biên theo UTC; qa_requests_default nhận bản ghi
+  ngoài mọi partition tháng (job ngừng chạy lâu hơn số tháng tạo trước) thay vì làm INSERT lỗi
+- Job định kỳ tạo trước partition cho các tháng tới và tách (DETACH) các partition
+  cũ hơn QA_RETENTION_MONTHS, nén COPY ra file .csv.gz rồi DROP - không có DELETE hàng loạt
+"""
+import gzip
+import os
+import re
+from datetime import date, datetime, timezone
+from pathlib import Path
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+
+PARTITION_PREFIX = "qa_requests_y"
+_PARTITION_RE = re.compile(r"^qa_requests_y(\d{4})m(\d{2})$")
+
+
+def _month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def _add_months(value: date, months: int) -> date:
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    """Tên partition của tháng chứa `month`."""
+    return f"{PARTITION_PREFIX}{month.year:04d}m{month.month:02d}"
+
+
+def _partition_month(name: str) -> date | None:
+    match = _PARTITION_RE.match(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def create_month_partition(conn: Connection, month: date, table: str = "qa_requests"):
+    """
+    Tạo partition cho một tháng nếu chưa có (biên [đầu tháng, đầu tháng sau) theo UTC).
+
+    Bản ghi của tháng đã rơi vào DEFAULT partition được chuyển sang partition mới trước khi
+    ATTACH (ATTACH kiểm tra DEFAULT partition không còn dòng nào thuộc khoảng của tháng).
+    """
+    start = _month_start(month)
+    end = _add_months(start, 1)
+    name = partition_name(start)
+    default = f"{table}_default"
+    bounds = f"FROM ('{start.isoformat()} 00:00:00+00') TO ('{end.isoformat()} 00:00:00+00')"
+    in_range = f"created_at >= '{start.isoformat()} 00:00:00+00' AND created_at < '{end.isoformat()} 00:00:00+00'"
+
+    exists = conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name}).scalar()
+    if exists:
+        return
+    has_default = conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": default}).scalar()
+    moved = has_default and conn.execute(
+        text(f"SELECT EXISTS (SELECT 1 FROM {default} WHERE {in_range})")
+    ).scalar()
+    if not moved:
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} FOR VALUES {bounds}"))
+        return
+
+    conn.execute(
+        text(
+            f"""
+CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS);
+WITH moved AS (DELETE FROM {default} WHERE {in_range} RETURNING *)
+INSERT INTO {name} SELECT * FROM moved;
+ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES {bounds};
+"""
+        )
+    )
+    print(f"⚠ Đã chuyển bản ghi từ {default} sang {name}")
+
+
+def create_default_partition(conn: Connection, table: str = "qa_requests"):
+    """Tạo DEFAULT partition nhận bản ghi không thuộc partition tháng nào."""
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+
+
+def ensure_qa_partitions(
+    conn: Connection,
+    months_ahead: int = 2,
+    since: date | None = None,
+    table: str = "qa_requests",
+):
+    """
+    Đảm bảo có partition từ tháng `since` (mặc định: tháng hiện tại) tới `months_ahead` tháng tới.
+
+    DEFAULT partition bình thường rỗng (tháng luôn được tạo trước), nên tạo partition mới chỉ
+    phải quét một bảng rỗng.
+    """
+    today = datetime.now(timezone.utc).date()
+    month = _month_start(since or today)
+    last = _add_months(_month_start(today), months_ahead)
+    while month <= last:
+        create_month_partition(conn, month, table)
+        month = _add_months(month, 1)
+
+
+def list_qa_partitions(conn: Connection) -> list[str]:
+    """Tên các partition đang gắn với qa_requests."""
+    return conn.execute(
+        text(
+            """
+SELECT c.relname FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = 'qa_requests'::regclass
+ORDER BY c.relname
+"""
+        )
+    ).scalars().all()
+
+
+def list_detached_qa_partitions(conn: Connection) -> list[str]:
+    """Partition đã DETACH nhưng chưa lưu trữ xong (ví dụ do lần chạy trước bị gián đoạn)."""
+    return conn.execute(
+        text(
+            """
+SELECT c.relname FROM pg_class c
+WHERE c.relkind = 'r' AND c.relnamespace = current_schema()::regnamespace
+    AND c.relname ~ '^qa_requests_y[0-9]{4}m[0-9]{2}$'
+    AND NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid)
+ORDER BY c.relname
+"""
+        )
+    ).scalars().all()
+
+
+def expired_qa_partitions(conn: Connection, retention_months: int) -> list[str]:
+    """Các partition có toàn bộ dữ liệu cũ hơn `retention_months` tháng."""
+    cutoff = _add_months(_month_start(datetime.now(timezone.utc).date()), -retention_months)
+    return [
+        name for name in list_qa_partitions(conn)
+        if (month := _partition_month(name)) is not None and _add_months(month, 1) <= cutoff
+    ]
+
+
+def detach_qa_partition(conn: Connection, name: str):
+    """Tách partition khỏi qa_requests (chỉ cập nhật catalog, không ghi dữ liệu)."""
+    conn.execute(text(f"ALTER TABLE qa_requests DETACH PARTITION {name}"))
+
+
+def archive_and_drop_partition(conn: Connection, name: str, archive_dir: str) -> Path:
+    """
+    Nén toàn bộ partition đã tách ra file CSV gzip rồi DROP bảng.
+
+    File được ghi vào `.tmp`, fsync rồi đổi tên - DROP chỉ chạy khi file đã an toàn trên đĩa.
+
+    Returns:
+        Đường dẫn file lưu trữ
+    """
+    directory = Path(archive_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    target = directory / f"{name}.csv.gz"
+    temp = directory / f"{name}.csv.gz.tmp"
+
+    copy_sql = f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER true)"
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        with open(temp, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as archive:
+                if hasattr(cursor, "copy_expert"):
+                    # psycopg2
+                    cursor.copy_expert(copy_sql, archive)
+                else:
+                    # psycopg 3
+                    with cursor.copy(copy_sql) as copy:
+                        for chunk in copy:
+                            archive.write(chunk)
+            raw.flush()
+            os.fsync(raw.fileno())
+    finally:
+        cursor.close()
+
+    os.replace(temp, target)
+    conn.execute(text(f"DROP TABLE {name}"))
+    return target
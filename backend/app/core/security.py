@@ -1,6 +1,7 @@
 """
 Tiện ích bảo mật cho xác thực và phân quyền.
 """
+import uuid
 from datetime import datetime, timedelta, timezone
 from jose import jwt
 from passlib.context import CryptContext
@@ -49,11 +50,29 @@ def create_refresh_token(subject: str) -> tuple[str, datetime]:
         "sub": subject,
         "exp": expires,
         "type": "refresh",
+        # Hai token cấp trong cùng một giây phải khác nhau (token_hash là duy nhất)
+        "jti": uuid.uuid4().hex,
     }
     token = jwt.encode(payload, settings.JWT_SECRET, algorithm=settings.JWT_ALGORITHM)
     return token, expires
 
 
+def create_upload_token(subject: str, storage_key: str, content_type: str) -> str:
+    """
+    Tạo token xác nhận upload trực tiếp: gắn storage key với user để bước finalize
+    không nhận key tùy ý từ client.
+    """
+    expires = datetime.now(timezone.utc) + timedelta(seconds=settings.PRESIGNED_UPLOAD_EXPIRES_SECONDS)
+    payload = {
+        "sub": subject,
+        "exp": expires,
+        "type": "upload",
+        "key": storage_key,
+        "content_type": content_type,
+    }
+    return jwt.encode(payload, settings.JWT_SECRET, algorithm=settings.JWT_ALGORITHM)
+
+
 def decode_token(token: str) -> dict:
     """
     Giải mã và kiểm tra tính hợp lệ của JWT token.
@@ -0,0 +1,72 @@
+"""
+Cache ngắn hạn trong tiến trình cho thông tin xác thực của user (id -> is_active, role).
+
+get_current_user chỉ cần biết user còn hoạt động hay không, nên mỗi request không phải
+truy vấn bảng users. Cache bị xóa ngay khi user đổi mật khẩu trong cùng worker; thay đổi
+is_active / role trực tiếp trong database (chưa có API) và các worker khác có độ trễ tối đa
+USER_CACHE_TTL_SECONDS.
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from uuid import UUID
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+
+@dataclass(frozen=True)
+class CurrentUser:
+    """User đã xác thực của request hiện tại."""
+    id: UUID
+    is_active: bool
+    role: str
+
+
+metrics.describe("ainote_user_cache_requests_total", "Tra cứu cache user theo kết quả (hit/miss)")
+
+
+class UserCache:
+    """Cache LRU có TTL, an toàn giữa các thread."""
+
+    def __init__(self, ttl_seconds: float, max_size: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._entries: OrderedDict[UUID, tuple[float, CurrentUser]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: UUID) -> CurrentUser | None:
+        """Lấy user từ cache (None nếu chưa có hoặc đã hết hạn)."""
+        if self.ttl_seconds <= 0:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                metrics.inc("ainote_user_cache_requests_total", result="hit")
+                return entry[1]
+            if entry:
+                del self._entries[user_id]
+        metrics.inc("ainote_user_cache_requests_total", result="miss")
+        return None
+
+    def set(self, user: CurrentUser):
+        """Lưu user vào cache."""
+        if self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._entries[user.id] = (time.monotonic() + self.ttl_seconds, user)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: UUID):
+        """Xóa user khỏi cache (đổi mật khẩu)."""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+# Singleton instance
+user_cache = UserCache(settings.USER_CACHE_TTL_SECONDS, settings.USER_CACHE_MAX_SIZE)
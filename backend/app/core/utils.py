@@ -7,3 +7,12 @@ import hashlib
 def hash_text_sha256(value: str) -> str:
     """Băm văn bản bằng SHA256."""
     return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+def escape_like(value: str, escape_char: str = "\\") -> str:
+    """Escape các ký tự đặc biệt của LIKE (%, _ và ký tự escape)."""
+    return (
+        value.replace(escape_char, escape_char * 2)
+        .replace("%", escape_char + "%")
+        .replace("_", escape_char + "_")
+    )
@@ -1,10 +1,10 @@
 """
 Các thao tác CRUD cho token xác thực.
 """
-from uuid import UUID
+from uuid import UUID, uuid4
 from datetime import datetime, timezone
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import select, insert, update, delete, func, literal
 
 from app.models import AuthRefreshToken
 
@@ -48,3 +48,80 @@ def revoke_refresh_token(
     token.revoked_at = datetime.now(timezone.utc)
     db.add(token)
     return token
+
+
+def rotate_refresh_token(
+    db: Session,
+    token_hash: str,
+    new_token_hash: str,
+    expires_at: datetime,
+) -> UUID | None:
+    """
+    Thu hồi refresh token cũ và tạo token mới trong một câu lệnh (UPDATE ... RETURNING + INSERT).
+
+    Tra cứu theo unique index token_hash; hai request làm mới đồng thời với cùng token
+    chỉ một request thành công vì UPDATE khóa dòng và kiểm tra lại revoked_at.
+
+    Args:
+        db: Phiên cơ sở dữ liệu
+        token_hash: Hash của refresh token cũ
+        new_token_hash: Hash của refresh token mới
+        expires_at: Thời điểm hết hạn của token mới
+
+    Returns:
+        user_id của token, hoặc None nếu token không tồn tại, đã thu hồi hoặc đã hết hạn
+    """
+    tokens = AuthRefreshToken.__table__
+    revoked = (
+        update(tokens)
+        .where(
+            tokens.c.token_hash == token_hash,
+            tokens.c.revoked_at.is_(None),
+            tokens.c.expires_at > func.now(),
+        )
+        .values(revoked_at=func.now())
+        .returning(tokens.c.user_id)
+        .cte("revoked")
+    )
+    stmt = (
+        insert(tokens)
+        .from_select(
+            ["id", "user_id", "token_hash", "expires_at"],
+            select(
+                literal(uuid4(), tokens.c.id.type),
+                revoked.c.user_id,
+                literal(new_token_hash, tokens.c.token_hash.type),
+                literal(expires_at, tokens.c.expires_at.type),
+            ),
+        )
+        .add_cte(revoked)
+        .returning(tokens.c.user_id)
+    )
+    return db.execute(stmt).scalar_one_or_none()
+
+
+def purge_refresh_tokens(db: Session, batch_size: int = 1000) -> int:
+    """
+    Xóa một lô refresh token đã hết hạn hoặc đã thu hồi.
+
+    Mỗi điều kiện dùng partial index riêng; SKIP LOCKED bỏ qua các dòng đang được làm mới.
+    Gọi lặp lại (mỗi lô một transaction) tới khi trả về 0.
+
+    Returns:
+        Số dòng đã xóa
+    """
+    deleted = 0
+    for condition in (
+        AuthRefreshToken.revoked_at.is_(None) & (AuthRefreshToken.expires_at < func.now()),
+        AuthRefreshToken.revoked_at.is_not(None),
+    ):
+        batch = (
+            select(AuthRefreshToken.id)
+            .where(condition)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        result = db.execute(delete(AuthRefreshToken).where(AuthRefreshToken.id.in_(batch)))
+        deleted += result.rowcount or 0
+    return deleted
@@ -1,12 +1,70 @@
 """
 Các thao tác CRUD cho model NoteItem.
 """
+from datetime import datetime, timedelta
 from uuid import UUID
-from sqlalchemy.orm import Session
-from sqlalchemy import select, func
-from typing import List, Optional
+from sqlalchemy.orm import Session, load_only
+from sqlalchemy import select, func, literal, delete, true, false, tuple_, union_all
+from typing import List, Optional, Tuple
 
-from app.models import NoteItem
+from app.core.config import settings
+from app.core.pagination import (
+    DEFAULT_PAGE_SIZE,
+    ChangeTokenExpired,
+    decode_change_token,
+    encode_change_token,
+    keyset_paginate,
+    split_page,
+)
+from app.core.utils import escape_like
+from app.models import NoteItem, NoteTombstone, UserEntityTypeCount
+
+
+# Các cột NoteOut thực sự trả về - danh sách không nạp embedding / tsv_content / cột tìm kiếm
+NOTE_OUT_COLUMNS = (
+    NoteItem.id,
+    NoteItem.user_id,
+    NoteItem.title,
+    NoteItem.content_text,
+    NoteItem.ocr_text,
+    NoteItem.raw_image_url,
+    NoteItem.image_metadata,
+    NoteItem.image_derivatives,
+    NoteItem.semantic_summary,
+    NoteItem.entity_type,
+    NoteItem.entities,
+    NoteItem.is_archived,
+    NoteItem.created_at,
+    NoteItem.updated_at,
+)
+
+SNIPPET_LENGTH = 200
+
+
+def _note_list_query(summary: bool):
+    """
+    Truy vấn gốc cho các danh sách ghi chú.
+
+    Args:
+        summary: True = chỉ chọn các cột của NoteSummaryOut (snippet cắt sẵn trong DB),
+                 False = NoteItem với load_only các cột NoteOut
+    """
+    if summary:
+        snippet = func.substr(
+            func.coalesce(NoteItem.content_text, NoteItem.ocr_text, NoteItem.semantic_summary, ""),
+            1,
+            SNIPPET_LENGTH,
+        )
+        return select(
+            NoteItem.id,
+            NoteItem.title,
+            snippet.label("snippet"),
+            NoteItem.entity_type,
+            NoteItem.image_derivatives,
+            NoteItem.created_at,
+            NoteItem.updated_at,
+        )
+    return select(NoteItem).options(load_only(*NOTE_OUT_COLUMNS))
 
 
 def get_note_by_id(db: Session, note_id: UUID, user_id: UUID) -> NoteItem | None:
@@ -17,22 +75,40 @@ def get_note_by_id(db: Session, note_id: UUID, user_id: UUID) -> NoteItem | None
     ).scalar_one_or_none()
 
 
+def get_note_updated_at(db: Session, note_id: UUID, user_id: UUID) -> datetime | None:
+    """Chỉ đọc updated_at của ghi chú (tính ETag mà không nạp cả dòng)."""
+    return db.execute(
+        select(NoteItem.updated_at)
+        .where(NoteItem.id == note_id, NoteItem.user_id == user_id)
+    ).scalar_one_or_none()
+
+
 def get_user_notes(
     db: Session, 
     user_id: UUID, 
     include_archived: bool = False,
-    limit: int = 100,
-    offset: int = 0
-) -> List[NoteItem]:
-    """Lấy tất cả ghi chú của một người dùng."""
-    query = select(NoteItem).where(NoteItem.user_id == user_id)
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    summary: bool = False
+) -> Tuple[List[NoteItem], Optional[str]]:
+    """
+    Lấy một trang ghi chú của người dùng (keyset theo created_at, id).
+
+    Args:
+        summary: True = trả về dòng rút gọn (id, title, snippet, entity_type, ảnh thu nhỏ, timestamps)
+
+    Returns:
+        Tuple (notes, next_cursor)
+    """
+    query = _note_list_query(summary).where(NoteItem.user_id == user_id)
     
     if not include_archived:
         query = query.where(NoteItem.is_archived == False)
     
-    query = query.order_by(NoteItem.created_at.desc()).limit(limit).offset(offset)
+    query = keyset_paginate(query, NoteItem.created_at, NoteItem.id, cursor, limit)
+    result = db.execute(query)
     
-    return db.execute(query).scalars().all()
+    return split_page(result.all() if summary else result.scalars().all(), limit)
 
 
 def create_note(
@@ -46,7 +122,9 @@ def create_note(
     semantic_summary: str | None = None,
     entity_type: str | None = None,
     embedding: dict | None = None,
-    entities: dict | None = None
+    entities: dict | None = None,
+    processing_stats: dict | None = None,
+    image_derivatives: dict | None = None
 ) -> NoteItem:
     """Tạo ghi chú mới với đầy đủ thông tin."""
     note = NoteItem(
@@ -59,13 +137,33 @@ def create_note(
         semantic_summary=semantic_summary,
         entity_type=entity_type,
         embedding=embedding,
-        entities=entities
+        entities=entities,
+        processing_stats=processing_stats,
+        image_derivatives=image_derivatives
     )
     db.add(note)
     db.flush()
     return note
 
 
+def create_notes(db: Session, user_id: UUID, notes_data: List[dict]) -> List[NoteItem]:
+    """
+    Tạo nhiều ghi chú trong một lần flush (SQLAlchemy gộp thành INSERT nhiều dòng).
+
+    Args:
+        db: Phiên cơ sở dữ liệu
+        user_id: ID người dùng
+        notes_data: Mỗi phần tử là keyword argument của create_note (trừ db / user_id)
+
+    Returns:
+        Danh sách ghi chú theo đúng thứ tự của notes_data
+    """
+    notes = [NoteItem(user_id=user_id, **data) for data in notes_data]
+    db.add_all(notes)
+    db.flush()
+    return notes
+
+
 def update_note(
     db: Session, 
     note: NoteItem, 
@@ -155,30 +253,132 @@ def archive_note(db: Session, note: NoteItem) -> NoteItem:
 
 
 def delete_note(db: Session, note: NoteItem) -> None:
-    """Xóa ghi chú."""
+    """Xóa ghi chú và ghi tombstone cho đồng bộ delta."""
+    db.add(NoteTombstone(note_id=note.id, user_id=note.user_id))
     db.delete(note)
 
 
+def get_note_changes(
+    db: Session,
+    user_id: UUID,
+    since: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE
+) -> Tuple[List[NoteItem], List[UUID], str, bool]:
+    """
+    Lấy các thay đổi (tạo/sửa/lưu trữ/xóa) của người dùng kể từ change token.
+
+    Ghi chú và tombstone được trộn theo (changed_at, id) tăng dần. Token cuối đợt
+    là now() của DB; lần sau lùi SYNC_SAFETY_WINDOW_SECONDS để không sót các giao dịch
+    có updated_at sớm nhưng commit muộn (client upsert theo id nên trùng lặp vô hại).
+    updated_at / deleted_at là clock_timestamp() lúc ghi, và các handler không giữ transaction
+    trong lúc chờ OCR / LLM, nên khoảng từ lúc ghi tới commit nằm trong cửa sổ này.
+
+    Args:
+        since: Change token lần trước (None = đồng bộ lần đầu, bỏ qua ghi chú lưu trữ và tombstone)
+        limit: Số thay đổi tối đa mỗi lần
+
+    Returns:
+        Tuple (notes, deleted_ids, next_token, has_more)
+
+    Raises:
+        ChangeTokenExpired: Token cũ hơn thời gian lưu tombstone
+        ValueError: Token không hợp lệ
+    """
+    now = db.execute(select(func.now())).scalar_one()
+
+    notes_q = select(
+        NoteItem.id.label("id"), NoteItem.updated_at.label("changed_at"), false().label("deleted")
+    ).where(NoteItem.user_id == user_id)
+    tombstones_q = select(
+        NoteTombstone.note_id.label("id"), NoteTombstone.deleted_at.label("changed_at"), true().label("deleted")
+    ).where(NoteTombstone.user_id == user_id)
+
+    if since:
+        changed_at, after_id, issued_at = decode_change_token(since)
+        # Token cuối đợt: tombstone sau changed_at phải còn. Token tiếp trang: changed_at là
+        # updated_at của dòng cuối trang trước (có thể rất cũ) - chỉ xét thời điểm phát hành
+        expires_from = changed_at if after_id is None else (issued_at or now)
+        if expires_from < now - timedelta(days=settings.NOTE_TOMBSTONE_RETENTION_DAYS):
+            raise ChangeTokenExpired("Change token đã hết hạn, cần đồng bộ lại toàn bộ")
+
+        if after_id is None:
+            lower = changed_at - timedelta(seconds=settings.SYNC_SAFETY_WINDOW_SECONDS)
+            notes_q = notes_q.where(NoteItem.updated_at > lower)
+            tombstones_q = tombstones_q.where(NoteTombstone.deleted_at > lower)
+        else:
+            notes_q = notes_q.where(tuple_(NoteItem.updated_at, NoteItem.id) > tuple_(changed_at, after_id))
+            tombstones_q = tombstones_q.where(
+                tuple_(NoteTombstone.deleted_at, NoteTombstone.note_id) > tuple_(changed_at, after_id)
+            )
+        changes = union_all(notes_q, tombstones_q).subquery()
+    else:
+        changes = notes_q.where(NoteItem.is_archived == False).subquery()
+
+    rows = db.execute(
+        select(changes)
+        .order_by(changes.c.changed_at, changes.c.id)
+        .limit(limit + 1)
+    ).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_token = (
+        encode_change_token(rows[-1].changed_at, rows[-1].id, issued_at=now) if has_more
+        else encode_change_token(now)
+    )
+
+    deleted_ids = [row.id for row in rows if row.deleted]
+    note_ids = [row.id for row in rows if not row.deleted]
+    notes = []
+    if note_ids:
+        by_id = {
+            note.id: note
+            for note in db.execute(
+                select(NoteItem)
+                .options(load_only(*NOTE_OUT_COLUMNS))
+                .where(NoteItem.user_id == user_id, NoteItem.id.in_(note_ids))
+            ).scalars()
+        }
+        notes = [by_id[note_id] for note_id in note_ids if note_id in by_id]
+
+    return notes, deleted_ids, next_token, has_more
+
+
+def purge_note_tombstones(db: Session, retention_days: int) -> int:
+    """Xóa tombstone cũ hơn retention_days ngày. Trả về số dòng đã xóa."""
+    result = db.execute(
+        delete(NoteTombstone).where(
+            NoteTombstone.deleted_at < func.now() - timedelta(days=retention_days)
+        )
+    )
+    return result.rowcount or 0
+
+
 def search_notes_by_text(
     db: Session,
     user_id: UUID,
     search_query: str,
     limit: int = 20
 ) -> List[NoteItem]:
-    """Tìm kiếm ghi chú theo văn bản (LIKE search đơn giản)."""
-    pattern = f"%{search_query}%"
+    """
+    Tìm kiếm ghi chú theo văn bản (chuỗi con hoặc gần đúng khi gõ sai).
+
+    Dùng cột search_text (chữ thường) có GIN trigram index, xếp hạng theo word_similarity.
+    """
+    term = search_query.strip().lower()
+    pattern = f"%{escape_like(term)}%"
+    similarity = func.word_similarity(term, NoteItem.search_text)
     query = (
         select(NoteItem)
         .where(
             NoteItem.user_id == user_id,
             NoteItem.is_archived == False,
             (
-                NoteItem.title.ilike(pattern) |
-                NoteItem.content_text.ilike(pattern) |
-                NoteItem.ocr_text.ilike(pattern)
+                NoteItem.search_text.like(pattern) |
+                literal(term).op("<%")(NoteItem.search_text)
             )
         )
-        .order_by(NoteItem.updated_at.desc())
+        .order_by(similarity.desc(), NoteItem.updated_at.desc())
         .limit(limit)
     )
     
@@ -219,36 +419,47 @@ def get_notes_by_entity_type(
     db: Session,
     user_id: UUID,
     entity_type: str,
-    limit: int = 100,
-    offset: int = 0
-) -> List[NoteItem]:
-    """Lấy tất cả ghi chú theo entity_type của một người dùng."""
-    query = (
-        select(NoteItem)
-        .where(
-            NoteItem.user_id == user_id,
-            NoteItem.entity_type == entity_type,
-            NoteItem.is_archived == False
-        )
-        .order_by(NoteItem.created_at.desc())
-        .limit(limit)
-        .offset(offset)
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    summary: bool = False
+) -> Tuple[List[NoteItem], Optional[str]]:
+    """
+    Lấy một trang ghi chú theo entity_type của người dùng (keyset theo created_at, id).
+
+    Args:
+        summary: True = trả về dòng rút gọn (id, title, snippet, entity_type, ảnh thu nhỏ, timestamps)
+
+    Returns:
+        Tuple (notes, next_cursor)
+    """
+    query = _note_list_query(summary).where(
+        NoteItem.user_id == user_id,
+        NoteItem.entity_type == entity_type,
+        NoteItem.is_archived == False
     )
+    query = keyset_paginate(query, NoteItem.created_at, NoteItem.id, cursor, limit)
+    result = db.execute(query)
     
-    return db.execute(query).scalars().all()
+    return split_page(result.all() if summary else result.scalars().all(), limit)
 
 
 def get_all_entity_types(db: Session, user_id: UUID) -> List[str]:
-    """Lấy danh sách tất cả entity_type duy nhất của user."""
+    """Lấy danh sách entity_type của user (tra bảng thống kê theo khóa chính)."""
     result = db.execute(
-        select(NoteItem.entity_type)
-        .where(
-            NoteItem.user_id == user_id,
-            NoteItem.entity_type.isnot(None),
-            NoteItem.is_archived == False
-        )
-        .distinct()
-        .order_by(NoteItem.entity_type)
+        select(UserEntityTypeCount.entity_type)
+        .where(UserEntityTypeCount.user_id == user_id, UserEntityTypeCount.count > 0)
+        .order_by(UserEntityTypeCount.entity_type)
     )
     
     return [row[0] for row in result.fetchall()]
+
+
+def get_entity_type_stats(db: Session, user_id: UUID) -> List[Tuple[str, int]]:
+    """Lấy số ghi chú chưa lưu trữ theo entity_type (bảng do trigger duy trì)."""
+    result = db.execute(
+        select(UserEntityTypeCount.entity_type, UserEntityTypeCount.count)
+        .where(UserEntityTypeCount.user_id == user_id, UserEntityTypeCount.count > 0)
+        .order_by(UserEntityTypeCount.count.desc(), UserEntityTypeCount.entity_type)
+    )
+    
+    return [(row[0], row[1]) for row in result.fetchall()]
@@ -0,0 +1,80 @@
+"""
+Các thao tác CRUD cho cache kết quả OCR.
+"""
+from uuid import UUID
+from sqlalchemy.orm import Session
+from sqlalchemy import BigInteger, Text, select, func, cast, literal
+from sqlalchemy.dialects.postgresql import BIT, insert
+
+from app.models import OcrCache
+
+
+def get_ocr_cache(
+    db: Session,
+    content_sha256: str,
+    provider: str,
+    model: str,
+    prompt_version: str,
+) -> OcrCache | None:
+    """Lấy kết quả OCR đã cache của đúng ảnh này (theo SHA-256)."""
+    return db.get(OcrCache, (content_sha256, provider, model, prompt_version))
+
+
+def find_similar_ocr_cache(
+    db: Session,
+    user_id: UUID,
+    dhash: int,
+    provider: str,
+    model: str,
+    prompt_version: str,
+    max_distance: int,
+) -> OcrCache | None:
+    """
+    Tìm kết quả OCR của ảnh gần giống nhất của user (khoảng cách Hamming giữa dHash <= max_distance).
+
+    Chỉ quét các dòng của user qua index (user_id, provider, model, prompt_version, dhash).
+    """
+    # Đếm số bit khác nhau: XOR rồi đếm ký tự '1' (chạy được trên mọi phiên bản PostgreSQL)
+    xor = OcrCache.dhash.op("#")(literal(dhash, BigInteger))
+    distance = func.length(func.replace(cast(cast(xor, BIT(64)), Text), "0", ""))
+    return db.execute(
+        select(OcrCache)
+        .where(
+            OcrCache.user_id == user_id,
+            OcrCache.provider == provider,
+            OcrCache.model == model,
+            OcrCache.prompt_version == prompt_version,
+            OcrCache.dhash.is_not(None),
+            distance <= max_distance,
+        )
+        .order_by(distance)
+        .limit(1)
+    ).scalar_one_or_none()
+
+
+def save_ocr_cache(
+    db: Session,
+    content_sha256: str,
+    provider: str,
+    model: str,
+    prompt_version: str,
+    text: str,
+    confidence: float | None,
+    user_id: UUID | None = None,
+    dhash: int | None = None,
+) -> None:
+    """Lưu kết quả OCR (bỏ qua nếu đã có - ảnh giống hệt được upload đồng thời)."""
+    db.execute(
+        insert(OcrCache)
+        .values(
+            content_sha256=content_sha256,
+            provider=provider,
+            model=model,
+            prompt_version=prompt_version,
+            user_id=user_id,
+            dhash=dhash,
+            text=text,
+            confidence=confidence,
+        )
+        .on_conflict_do_nothing()
+    )
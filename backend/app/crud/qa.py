@@ -4,8 +4,9 @@ Các thao tác CRUD cho model QARequest (lịch sử chat).
 from uuid import UUID
 from sqlalchemy.orm import Session
 from sqlalchemy import select
-from typing import List
+from typing import List, Optional, Tuple
 
+from app.core.pagination import DEFAULT_PAGE_SIZE, keyset_paginate, split_page
 from app.models import QARequest
 
 
@@ -30,18 +31,18 @@ def create_qa_request(
 def get_user_qa_history(
     db: Session,
     user_id: UUID,
-    limit: int = 50,
-    offset: int = 0
-) -> List[QARequest]:
-    """Lấy lịch sử Q&A của người dùng."""
-    query = (
-        select(QARequest)
-        .where(QARequest.user_id == user_id)
-        .order_by(QARequest.created_at.desc())
-        .limit(limit)
-        .offset(offset)
-    )
-    return db.execute(query).scalars().all()
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None
+) -> Tuple[List[QARequest], Optional[str]]:
+    """
+    Lấy một trang lịch sử Q&A của người dùng (keyset theo created_at, id).
+
+    Returns:
+        Tuple (history, next_cursor)
+    """
+    query = select(QARequest).where(QARequest.user_id == user_id)
+    query = keyset_paginate(query, QARequest.created_at, QARequest.id, cursor, limit)
+    return split_page(db.execute(query).scalars().all(), limit)
 
 
 def get_qa_request_by_id(
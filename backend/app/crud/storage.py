@@ -0,0 +1,201 @@
+"""
+Các thao tác CRUD cho hàng đợi xóa object S3 (storage_pending_deletes),
+bảng đếm tham chiếu object lưu theo nội dung (storage_objects) và
+các upload trực tiếp đã finalize (storage_upload_claims).
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Tuple
+from uuid import UUID
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.models import NoteItem, StorageObject, StoragePendingDelete, StorageUploadClaim
+
+
+def enqueue_storage_deletes(db: Session, storage_keys: Iterable[str]) -> None:
+    """Đưa object vào hàng đợi xóa (trong transaction của caller, bỏ qua key đã có)."""
+    rows = [{"storage_key": key} for key in dict.fromkeys(storage_keys) if key]
+    if rows:
+        db.execute(insert(StoragePendingDelete).values(rows).on_conflict_do_nothing())
+
+
+def pin_storage_object(db: Session, storage_key: str, content_sha256: str | None, size: int | None) -> bool:
+    """
+    Tăng ref_count của object (tạo dòng nếu chưa có) trước khi upload / dùng lại object.
+
+    Job storage_gc không xóa object có ref_count > 0, nên sau khi pin object không thể bị
+    xóa giữa chừng. Khóa dòng được giữ tới khi commit.
+
+    Returns:
+        True nếu object đã được ghi chú khác tham chiếu (chắc chắn tồn tại, bỏ qua upload)
+    """
+    stmt = (
+        insert(StorageObject)
+        .values(storage_key=storage_key, content_sha256=content_sha256, size=size, ref_count=1)
+        .on_conflict_do_update(
+            index_elements=[StorageObject.storage_key],
+            set_={"ref_count": StorageObject.ref_count + 1, "updated_at": func.now()},
+        )
+        .returning(StorageObject.ref_count)
+    )
+    return db.execute(stmt).scalar_one() > 1
+
+
+def release_storage_keys(db: Session, storage_keys: Iterable[str]) -> None:
+    """
+    Bỏ tham chiếu của một ghi chú tới các object của nó (trong transaction của caller).
+
+    Object theo nội dung giảm ref_count và chỉ vào hàng đợi xóa khi về 0; key không có
+    trong storage_objects (key uuid) vào hàng đợi xóa ngay.
+    """
+    storage_keys = list(dict.fromkeys(key for key in storage_keys if key))
+    if not storage_keys:
+        return
+    table = StorageObject.__table__
+    rows = db.execute(
+        update(table)
+        .where(table.c.storage_key.in_(storage_keys))
+        .values(ref_count=func.greatest(table.c.ref_count - 1, 0), updated_at=func.now())
+        .returning(table.c.storage_key, table.c.ref_count)
+    ).all()
+    ref_counts = {row.storage_key: row.ref_count for row in rows}
+    enqueue_storage_deletes(db, [key for key in storage_keys if ref_counts.get(key, 0) == 0])
+
+
+def lock_storage_objects(db: Session, storage_keys: List[str]) -> Dict[str, int]:
+    """Khóa dòng storage_objects của các key (tới hết transaction), trả về key -> ref_count."""
+    if not storage_keys:
+        return {}
+    rows = db.execute(
+        select(StorageObject.storage_key, StorageObject.ref_count)
+        .where(StorageObject.storage_key.in_(storage_keys))
+        .with_for_update()
+    ).all()
+    return {row.storage_key: row.ref_count for row in rows}
+
+
+def delete_storage_objects(db: Session, storage_keys: List[str]) -> None:
+    """Xóa dòng chỉ mục của các object đã xóa trên storage."""
+    if storage_keys:
+        db.execute(delete(StorageObject).where(StorageObject.storage_key.in_(storage_keys)))
+
+
+def iter_storage_pins(db: Session, batch_size: int = 5000) -> Iterator[Tuple[str, int, datetime]]:
+    """Duyệt (key, ref_count, updated_at) của các object theo nội dung đang có tham chiếu (ref_count > 0)."""
+    after_key: str | None = None
+    while True:
+        query = (
+            select(StorageObject.storage_key, StorageObject.ref_count, StorageObject.updated_at)
+            .where(StorageObject.ref_count > 0)
+            .order_by(StorageObject.storage_key)
+            .limit(batch_size)
+        )
+        if after_key is not None:
+            query = query.where(StorageObject.storage_key > after_key)
+        rows = db.execute(query).all()
+        if not rows:
+            return
+        for row in rows:
+            yield row.storage_key, row.ref_count, row.updated_at
+        after_key = rows[-1].storage_key
+
+
+def reset_storage_pin(db: Session, storage_key: str, ref_count: int, pinned_before: datetime) -> bool:
+    """
+    Đặt lại ref_count theo số ghi chú thực sự tham chiếu object (pin bị bỏ lại khi tiến trình
+    dừng giữa lúc pin và commit ghi chú). Bỏ qua nếu object vừa được pin / bỏ pin sau `pinned_before`.
+
+    Returns:
+        True nếu đã đặt lại
+    """
+    result = db.execute(
+        update(StorageObject)
+        .where(StorageObject.storage_key == storage_key, StorageObject.updated_at < pinned_before)
+        .values(ref_count=ref_count, updated_at=func.now())
+    )
+    return bool(result.rowcount)
+
+
+def claim_storage_deletes(db: Session, batch_size: int = 1000) -> List[str]:
+    """
+    Khóa một lô key chờ xóa, ưu tiên key chưa từng lỗi.
+
+    Returns:
+        Danh sách key (giữ khóa dòng tới hết transaction)
+    """
+    return list(db.execute(
+        select(StoragePendingDelete.storage_key)
+        .order_by(StoragePendingDelete.attempts, StoragePendingDelete.created_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).scalars())
+
+
+def finish_storage_deletes(db: Session, deleted_keys: List[str], errors: Dict[str, str]) -> None:
+    """Bỏ các key đã xóa khỏi hàng đợi, tăng số lần thử của các key lỗi."""
+    if deleted_keys:
+        db.execute(delete(StoragePendingDelete).where(StoragePendingDelete.storage_key.in_(deleted_keys)))
+    for key, error in errors.items():
+        db.execute(
+            update(StoragePendingDelete)
+            .where(StoragePendingDelete.storage_key == key)
+            .values(attempts=StoragePendingDelete.attempts + 1, last_error=error[:1000])
+        )
+
+
+def iter_note_images(db: Session, batch_size: int = 5000) -> Iterator[Tuple[str | None, dict | None]]:
+    """
+    Duyệt (raw_image_url, image_derivatives) của mọi ghi chú có ảnh theo keyset id,
+    mỗi lô một truy vấn ngắn.
+    """
+    after_id: UUID | None = None
+    while True:
+        query = (
+            select(NoteItem.id, NoteItem.raw_image_url, NoteItem.image_derivatives)
+            .where(NoteItem.raw_image_url.is_not(None))
+            .order_by(NoteItem.id)
+            .limit(batch_size)
+        )
+        if after_id is not None:
+            query = query.where(NoteItem.id > after_id)
+        rows = db.execute(query).all()
+        if not rows:
+            return
+        for row in rows:
+            yield row.raw_image_url, row.image_derivatives
+        after_id = rows[-1].id
+
+
+def get_upload_claim(db: Session, storage_key: str) -> StorageUploadClaim | None:
+    """Lấy bản ghi finalize của một storage key (None = key chưa được dùng)."""
+    return db.get(StorageUploadClaim, storage_key)
+
+
+def claim_upload(db: Session, storage_key: str, user_id: UUID, note_id: UUID) -> bool:
+    """
+    Ghi nhận storage key đã tạo ghi chú (trong transaction của caller, ngay trước commit).
+
+    Hai request finalize cùng key: request sau chờ khóa unique của request trước rồi nhận False.
+
+    Returns:
+        True nếu key chưa từng được finalize
+    """
+    stmt = (
+        insert(StorageUploadClaim)
+        .values(storage_key=storage_key, user_id=user_id, note_id=note_id)
+        .on_conflict_do_nothing(index_elements=[StorageUploadClaim.storage_key])
+        .returning(StorageUploadClaim.storage_key)
+    )
+    return db.execute(stmt).scalar_one_or_none() is not None
+
+
+def purge_upload_claims(db: Session, older_than_seconds: int) -> int:
+    """Xóa bản ghi finalize cũ hơn thời hạn upload token (token không thể dùng lại nữa)."""
+    result = db.execute(
+        delete(StorageUploadClaim).where(
+            StorageUploadClaim.created_at < func.now() - timedelta(seconds=older_than_seconds)
+        )
+    )
+    return result.rowcount or 0
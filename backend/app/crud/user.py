@@ -3,11 +3,12 @@ Các thao tác CRUD cho model User.
 """
 from uuid import UUID
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import event, select
 
 from app.models import User
 from app.schemas import UserCreate
 from app.core.security import hash_password
+from app.core.user_cache import user_cache
 
 
 def get_user_by_id(db: Session, user_id: UUID) -> User | None:
@@ -15,6 +16,13 @@ def get_user_by_id(db: Session, user_id: UUID) -> User | None:
     return db.get(User, user_id)
 
 
+def get_notes_version(db: Session, user_id: UUID) -> int:
+    """Đọc bộ đếm thay đổi ghi chú mới nhất của user (do trigger duy trì)."""
+    return db.execute(
+        select(User.notes_version).where(User.id == user_id)
+    ).scalar() or 0
+
+
 def get_user_by_email(db: Session, email: str) -> User | None:
     """Lấy người dùng theo email."""
     return db.execute(
@@ -43,8 +51,27 @@ def create_user(db: Session, user_in: UserCreate) -> User:
     return user
 
 
+def _invalidate_cached_users(db: Session):
+    for user_id in db.info.pop("invalidate_users", ()):
+        user_cache.invalidate(user_id)
+
+
+def _invalidate_on_commit(db: Session, user_id: UUID):
+    """
+    Xóa user khỏi cache ngay và lần nữa sau khi caller commit: request khác chạy trong lúc
+    chờ commit vẫn đọc được trạng thái cũ từ database và đưa lại vào cache.
+    """
+    user_cache.invalidate(user_id)
+    pending = db.info.setdefault("invalidate_users", set())
+    if not pending:
+        event.listen(db, "after_commit", _invalidate_cached_users, once=True)
+    pending.add(user_id)
+
+
 def update_user_password(db: Session, user: User, new_password_hash: str) -> User:
     """Cập nhật mật khẩu người dùng."""
     user.password_hash = new_password_hash
     db.add(user)
+    _invalidate_on_commit(db, user.id)
     return user
+
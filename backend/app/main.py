@@ -1,15 +1,20 @@
 """
 Điểm vào chính của ứng dụng FastAPI.
 """
-from fastapi import FastAPI
+import secrets
+
+from fastapi import FastAPI, HTTPException, Request, status
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy import text
-import time
-import random
 
 from app.core.config import settings
-from app.core.database import Base, engine
-from app.core.fts import install_note_items_fts
+from app.core.database import engine
+from app.core.fts import fts_needs_rebuild
+from app.core.metrics import metrics
+from app.core.migrations import current_revision, head_revision, upgrade_database
+from app.core.pagination import NEXT_CURSOR_HEADER
+from app.services.jobs import job_runner
 from app.api.v1.auth import router as auth_router
 from app.api.v1.notes import router as notes_router
 from app.api.v1.entity_types import router as entity_types_router
@@ -17,53 +22,42 @@ from app.api.v1.entity_types import router as entity_types_router
 
 def init_database_safely():
     """
-    Khởi tạo cơ sở dữ liệu an toàn với lock để tránh xung đột giữa các worker.
-    Sử dụng PostgreSQL advisory locks để đảm bảo chỉ một worker khởi tạo cơ sở dữ liệu.
+    Đảm bảo schema cơ sở dữ liệu ở revision Alembic mới nhất trước khi nhận request.
+
+    DB_AUTO_MIGRATE=true: tự chạy `alembic upgrade head`, dùng PostgreSQL advisory lock
+    để chỉ một worker migrate, các worker khác chờ rồi kiểm tra lại.
+
+    Raises:
+        RuntimeError: Nếu database chưa được migrate tới head
     """
-    max_retries = 3
-    wait_time = 2  # giây
-    
-    for attempt in range(max_retries):
-        try:
-            with engine.begin() as conn:
-                # Thử lấy advisory lock
-                lock_result = conn.execute(
-                    text("SELECT pg_try_advisory_lock(123456) as acquired")
-                )
-                acquired = lock_result.scalar()
-                
-                if not acquired:
-                    if attempt < max_retries - 1:
-                        time.sleep(wait_time + random.uniform(0, 1))
-                    continue
-                
-                try:
-                    # Kiểm tra xem các bảng đã tồn tại chưa
-                    table_exists = conn.execute(
-                        text(
-                            "SELECT EXISTS (SELECT FROM information_schema.tables "
-                            "WHERE table_name = 'note_items')"
-                        )
-                    ).scalar()
-                    
-                    if not table_exists:
-                        print("🔄 Đang tạo các bảng cơ sở dữ liệu...")
-                        Base.metadata.create_all(bind=engine)
-                        install_note_items_fts(conn, settings.FTS_CONFIG)
-                        print("✅ Khởi tạo cơ sở dữ liệu thành công")
-                    else:
-                        print("✅ Cơ sở dữ liệu đã được khởi tạo")
-                finally:
-                    # Giải phóng advisory lock
-                    conn.execute(text("SELECT pg_advisory_unlock(123456)"))
-                break
-                
-        except Exception as e:
-            if attempt < max_retries - 1:
-                time.sleep(wait_time)
-            else:
-                print(f"⚠️ Không thể khởi tạo cơ sở dữ liệu sau {max_retries} lần thử")
-                print(f"Lỗi: {str(e)}")
+    if settings.DB_AUTO_MIGRATE:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_conn:
+            lock_conn.execute(text("SELECT pg_advisory_lock(123456)"))
+            try:
+                with engine.connect() as conn:
+                    needs_upgrade = current_revision(conn) != head_revision()
+                if needs_upgrade:
+                    print("🔄 Đang chạy migration cơ sở dữ liệu...")
+                    with engine.connect() as conn:
+                        upgrade_database(conn)
+            finally:
+                # Giải phóng advisory lock
+                lock_conn.execute(text("SELECT pg_advisory_unlock(123456)"))
+
+    with engine.connect() as conn:
+        current, head = current_revision(conn), head_revision()
+        if current != head:
+            raise RuntimeError(
+                f"Cơ sở dữ liệu chưa được migrate (hiện tại: {current}, mới nhất: {head}). "
+                "Chạy: alembic upgrade head"
+            )
+        print(f"✅ Cơ sở dữ liệu ở revision {head}")
+
+        if fts_needs_rebuild(conn):
+            print(
+                "⚠ tsv_content chưa khớp cấu hình FTS hiện tại - "
+                "chạy: python -m app.commands.rebuild_fts"
+            )
 
 
 def create_app() -> FastAPI:
@@ -81,6 +75,7 @@ def create_app() -> FastAPI:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
     )
 
     # Bao gồm routers
@@ -89,9 +84,16 @@ def create_app() -> FastAPI:
     app.include_router(entity_types_router, prefix=settings.API_PREFIX)
 
     @app.on_event("startup")
-    def on_startup():
-        """Khởi tạo cơ sở dữ liệu khi ứng dụng khởi động."""
+    async def on_startup():
+        """Khởi tạo cơ sở dữ liệu và job bảo trì khi ứng dụng khởi động."""
         init_database_safely()
+        if settings.JOBS_ENABLED:
+            job_runner.start()
+
+    @app.on_event("shutdown")
+    async def on_shutdown():
+        """Dừng các job bảo trì."""
+        await job_runner.stop()
 
     @app.get("/")
     def root():
@@ -102,6 +104,23 @@ def create_app() -> FastAPI:
             "docs": "/docs"
         }
 
+    @app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+    def metrics_endpoint(request: Request):
+        """
+        Metrics của worker hiện tại (định dạng Prometheus).
+
+        Cần header "Authorization: Bearer <METRICS_TOKEN>"; khi chưa cấu hình token chỉ
+        nhận request từ localhost (scraper chạy cùng máy / sidecar).
+        """
+        if settings.METRICS_TOKEN:
+            authorization = request.headers.get("authorization", "").encode()
+            allowed = secrets.compare_digest(authorization, f"Bearer {settings.METRICS_TOKEN}".encode())
+        else:
+            allowed = request.client is not None and request.client.host in ("127.0.0.1", "::1")
+        if not allowed:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+        return metrics.render()
+
     @app.get("/health")
     def health_check():
         """Endpoint kiểm tra sức khỏe."""
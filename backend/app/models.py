@@ -6,17 +6,24 @@ import uuid
 from datetime import datetime
 
 from sqlalchemy import (
+    BigInteger,
     Boolean,
     Column,
+    Computed,
     DateTime,
+    Float,
+    Index,
+    Integer,
+    Numeric,
     String,
     Text,
     func,
 )
-from sqlalchemy.dialects.postgresql import UUID, JSONB, TSVECTOR
+from sqlalchemy.dialects.postgresql import UUID, JSONB, TSVECTOR, ARRAY
 from sqlalchemy.orm import Mapped, mapped_column
 
 from app.core.database import Base
+from app.core.fts import SEARCH_TEXT_EXPR
 
 
 class User(Base):
@@ -31,6 +38,7 @@ class User(Base):
     is_verified: Mapped[bool] = mapped_column(Boolean, nullable=False, server_default="false")
     avatar_url: Mapped[str | None] = mapped_column(Text, nullable=True)
     role: Mapped[str] = mapped_column(String, nullable=False, server_default="user")
+    notes_version: Mapped[int] = mapped_column(BigInteger, nullable=False, server_default="0")  # trigger (ETag)
 
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at: Mapped[datetime] = mapped_column(
@@ -50,6 +58,20 @@ class AuthRefreshToken(Base):
     revoked_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
 
 
+Index("ux_auth_refresh_tokens_token_hash", AuthRefreshToken.token_hash, unique=True)
+# Token còn dùng được: job dọn dẹp tìm token hết hạn
+Index(
+    "ix_auth_refresh_tokens_unrevoked_expires",
+    AuthRefreshToken.expires_at,
+    postgresql_where=AuthRefreshToken.revoked_at.is_(None),
+)
+Index(
+    "ix_auth_refresh_tokens_revoked",
+    AuthRefreshToken.revoked_at,
+    postgresql_where=AuthRefreshToken.revoked_at.is_not(None),
+)
+
+
 class NoteItem(Base):
     """
     Bảng gộp tất cả dữ liệu note (text, OCR, summary, entity)
@@ -66,6 +88,8 @@ class NoteItem(Base):
     ocr_text: Mapped[str | None] = mapped_column(Text, nullable=True)       # text từ OCR
     raw_image_url: Mapped[str | None] = mapped_column(Text, nullable=True)  # hình ảnh
     image_metadata: Mapped[dict | None] = mapped_column(JSONB, nullable=True)
+    processing_stats = Column(JSONB, nullable=True)    # trạng thái + thời gian từng bước xử lý ảnh
+    image_derivatives = Column(JSONB, nullable=True)   # ảnh thu nhỏ WebP: tên -> {key, url, width, height}
 
     # Semantic summary – Tóm tắt ý nghĩa để phân loại + embedding tốt hơn
     semantic_summary: Mapped[str | None] = mapped_column(Text, nullable=True)
@@ -73,21 +97,151 @@ class NoteItem(Base):
     # Entity
     entity_type: Mapped[str | None] = mapped_column(String, index=True, nullable=True)
     entities = Column(JSONB, nullable=True)            # dữ liệu entity có cấu trúc
+    entities_text = Column(Text, Computed("lower(entities::text)", persisted=True))  # entity chuẩn hóa (trigram)
+    entity_phones = Column(ARRAY(Text), nullable=True)      # số điện thoại chuẩn hóa (trigger)
+    entity_emails = Column(ARRAY(Text), nullable=True)      # email chuẩn hóa (trigger)
+    entity_prices = Column(ARRAY(Numeric), nullable=True)   # giá tiền chuẩn hóa (trigger)
 
     # RAG
     tsv_content = Column(TSVECTOR, nullable=True)      # full-text search
+    search_text = Column(Text, Computed(SEARCH_TEXT_EXPR, persisted=True))  # tìm kiếm trigram
     embedding = Column(JSONB, nullable=True)           # embedding chung cho toàn bộ note
 
     # Trạng thái
     is_archived: Mapped[bool] = mapped_column(Boolean, nullable=False, server_default="false")
+    # clock_timestamp(): thời điểm ghi, không phải lúc transaction bắt đầu - đồng bộ delta
+    # (GET /notes/changes) dựa vào khoảng cách ngắn giữa mốc này và lúc commit
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.clock_timestamp(), nullable=False
+    )
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.clock_timestamp(), onupdate=func.clock_timestamp(), nullable=False
+    )
+
+
+# Index cho phân trang keyset (created_at DESC, id DESC) - mỗi trang là một index range scan
+Index(
+    "ix_note_items_user_archived_created",
+    NoteItem.user_id, NoteItem.is_archived, NoteItem.created_at.desc(), NoteItem.id.desc(),
+)
+Index(
+    "ix_note_items_user_entity_type_created",
+    NoteItem.user_id, NoteItem.entity_type, NoteItem.is_archived,
+    NoteItem.created_at.desc(), NoteItem.id.desc(),
+)
+
+
+# Index cho đồng bộ delta (GET /notes/changes)
+Index("ix_note_items_user_updated", NoteItem.user_id, NoteItem.updated_at, NoteItem.id)
+
+
+class NoteTombstone(Base):
+    """
+    Dấu vết ghi chú đã xóa để client đồng bộ delta biết cần xóa bản sao cục bộ.
+    Được dọn sau NOTE_TOMBSTONE_RETENTION_DAYS ngày.
+    """
+    __tablename__ = "note_tombstones"
+
+    note_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True)
+    user_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), nullable=False)
+    deleted_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.clock_timestamp(), nullable=False
+    )
+
+
+Index("ix_note_tombstones_user_deleted", NoteTombstone.user_id, NoteTombstone.deleted_at, NoteTombstone.note_id)
+
+
+class UserEntityTypeCount(Base):
+    """
+    Số ghi chú (chưa lưu trữ) theo entity_type của mỗi user - duy trì bằng trigger
+    (app/core/counters.py), đối soát bằng `python -m app.commands.reconcile_entity_counts`.
+    """
+    __tablename__ = "user_entity_type_counts"
+
+    user_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True)
+    entity_type: Mapped[str] = mapped_column(String, primary_key=True)
+    count: Mapped[int] = mapped_column(BigInteger, nullable=False, server_default="0")
+
+
+class OcrCache(Base):
+    """
+    Kết quả OCR theo SHA-256 của ảnh gốc + provider / model / phiên bản prompt.
+
+    dhash (perceptual hash 64 bit) dùng để nhận ra ảnh gần giống (nén lại, đổi kích thước)
+    của cùng user.
+    """
+    __tablename__ = "ocr_cache"
+
+    content_sha256: Mapped[str] = mapped_column(String(64), primary_key=True)
+    provider: Mapped[str] = mapped_column(String, primary_key=True)
+    model: Mapped[str] = mapped_column(String, primary_key=True)
+    prompt_version: Mapped[str] = mapped_column(String, primary_key=True)
+
+    user_id: Mapped[uuid.UUID | None] = mapped_column(UUID(as_uuid=True), nullable=True)
+    dhash: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    text: Mapped[str] = mapped_column(Text, nullable=False)
+    confidence: Mapped[float | None] = mapped_column(Float, nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+Index(
+    "ix_ocr_cache_user_dhash",
+    OcrCache.user_id, OcrCache.provider, OcrCache.model, OcrCache.prompt_version, OcrCache.dhash,
+)
+
+
+class StoragePendingDelete(Base):
+    """
+    Object S3 chờ xóa - ghi cùng transaction với thao tác làm mất tham chiếu (xóa ghi chú),
+    job storage_gc xóa theo lô DeleteObjects và giữ lại các key xóa lỗi để thử lại.
+    """
+    __tablename__ = "storage_pending_deletes"
+
+    storage_key: Mapped[str] = mapped_column(Text, primary_key=True)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+class StorageObject(Base):
+    """
+    Object lưu theo nội dung (STORAGE_CONTENT_ADDRESSED): một object dùng chung cho mọi ghi chú
+    có cùng ảnh. ref_count là số ghi chú (kể cả upload đang xử lý) tham chiếu object; object chỉ
+    bị xóa khi ref_count về 0. Key không có dòng ở đây (key uuid cũ) thuộc về đúng một ghi chú.
+    """
+    __tablename__ = "storage_objects"
+
+    storage_key: Mapped[str] = mapped_column(Text, primary_key=True)
+    content_sha256: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    size: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    ref_count: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False
     )
 
 
+class StorageUploadClaim(Base):
+    """
+    Upload trực tiếp đã finalize: mỗi storage key chỉ tạo được một ghi chú, nên gửi lại cùng
+    upload token (client retry, replay) trả về ghi chú đã có thay vì tạo bản sao.
+    Ghi cùng transaction với ghi chú; xóa khi token chắc chắn đã hết hạn.
+    """
+    __tablename__ = "storage_upload_claims"
+
+    storage_key: Mapped[str] = mapped_column(Text, primary_key=True)
+    user_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), nullable=False)
+    note_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
 class QARequest(Base):
     __tablename__ = "qa_requests"
+    # Partition theo tháng (xem app/core/qa_partitions.py); khóa chính trong database là
+    # (id, created_at) vì phải chứa khóa partition, ORM vẫn định danh bản ghi theo id
+    __table_args__ = {"postgresql_partition_by": "RANGE (created_at)"}
 
     id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), nullable=True)
@@ -99,6 +253,9 @@ class QARequest(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
 
+Index("ix_qa_requests_user_created", QARequest.user_id, QARequest.created_at.desc(), QARequest.id.desc())
+
+
 class AuditLog(Base):
     __tablename__ = "audit_logs"
 
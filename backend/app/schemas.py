@@ -2,9 +2,10 @@
 Các schema Pydantic để xác thực request/response.
 """
 from datetime import datetime
+from typing import Literal
 from uuid import UUID
 
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, computed_field
 
 
 # Người dùng
@@ -41,6 +42,39 @@ class TokenRefreshIn(BaseModel):
     refresh_token: str
 
 
+# Upload trực tiếp lên storage
+class PresignedUploadIn(BaseModel):
+    filename: str
+    content_type: str
+
+
+class PresignedUploadOut(BaseModel):
+    upload_url: str
+    upload_token: str
+    storage_key: str
+    expires_in: int
+    headers: dict[str, str]
+
+
+class FinalizeUploadIn(BaseModel):
+    upload_token: str
+    title: str | None = None
+
+
+# Upload nhiều ảnh
+class BatchUploadItemOut(BaseModel):
+    filename: str
+    status: Literal["ok", "error"]
+    note_id: UUID | None = None
+    error: str | None = None
+
+
+class BatchUploadOut(BaseModel):
+    items: list[BatchUploadItemOut]
+    succeeded: int
+    failed: int
+
+
 # Ghi chú
 class NoteCreate(BaseModel):
     title: str | None = None
@@ -52,6 +86,11 @@ class NoteUpdate(BaseModel):
     content_text: str | None = None
 
 
+def _derivative_url(image_derivatives: dict | None, name: str) -> str | None:
+    """URL ảnh thu nhỏ `name` (xem IMAGE_DERIVATIVES), None nếu ghi chú chưa có."""
+    return ((image_derivatives or {}).get(name) or {}).get("url")
+
+
 class NoteOut(BaseModel):
     id: UUID
     user_id: UUID
@@ -66,11 +105,62 @@ class NoteOut(BaseModel):
     is_archived: bool
     created_at: datetime
     updated_at: datetime
+    image_derivatives: dict | None = Field(default=None, exclude=True)
+
+    @computed_field
+    @property
+    def thumbnail_url(self) -> str | None:
+        """Ảnh WebP cạnh dài 128px."""
+        return _derivative_url(self.image_derivatives, "thumbnail")
+
+    @computed_field
+    @property
+    def medium_url(self) -> str | None:
+        """Ảnh WebP cạnh dài 512px."""
+        return _derivative_url(self.image_derivatives, "medium")
+
+    @computed_field
+    @property
+    def large_url(self) -> str | None:
+        """Ảnh WebP cạnh dài 1280px."""
+        return _derivative_url(self.image_derivatives, "large")
+
+    class Config:
+        from_attributes = True
+
+
+# Dạng trả về của các endpoint danh sách ghi chú
+NoteListView = Literal["full", "summary"]
+
+
+class NoteSummaryOut(BaseModel):
+    """Dạng rút gọn cho màn hình danh sách (view=summary)."""
+    id: UUID
+    title: str | None
+    snippet: str | None
+    entity_type: str | None
+    created_at: datetime
+    updated_at: datetime
+    image_derivatives: dict | None = Field(default=None, exclude=True)
+
+    @computed_field
+    @property
+    def thumbnail_url(self) -> str | None:
+        """Ảnh WebP cạnh dài 128px."""
+        return _derivative_url(self.image_derivatives, "thumbnail")
 
     class Config:
         from_attributes = True
 
 
+class NoteChangesOut(BaseModel):
+    """Kết quả đồng bộ delta: ghi chú đã tạo/sửa/lưu trữ và id đã xóa kể từ token."""
+    notes: list[NoteOut] = []
+    deleted_ids: list[UUID] = []
+    next_token: str
+    has_more: bool = False
+
+
 # Q&A
 class QuestionIn(BaseModel):
     question: str = Field(min_length=1, max_length=1000)
@@ -289,6 +289,165 @@ class EmbeddingService:
             print(f"❌ Lỗi Gemini embedding: {e}")
             return None
     
+    async def create_api_embeddings(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Tạo embedding vector cho nhiều văn bản trong một request tới provider.
+
+        Args:
+            texts: Danh sách văn bản (không rỗng)
+
+        Returns:
+            Danh sách vector theo đúng thứ tự của texts (None nếu thất bại)
+        """
+        if not texts:
+            return []
+
+        provider_name = getattr(settings, "API_EXTRACT_EMBEDDING_NAME", "") or  ""
+        provider, config = get_provider_and_config(provider_name, is_chat=False)
+
+        model_extract_embedding = getattr(settings, "MODEL_EXTRACT_EMBEDDING", None)
+        if model_extract_embedding:
+            config["model"] = model_extract_embedding
+
+        try:
+            if provider == LLMProvider.GPT and config.get("api_key"):
+                vectors = await self._call_openai_embeddings(
+                    api_key=config["api_key"],
+                    model=config.get("model", "text-embedding-3-small"),
+                    texts=texts
+                )
+            elif provider == LLMProvider.GEMINI and config.get("api_key"):
+                vectors = await self._call_gemini_embeddings(
+                    api_key=config["api_key"],
+                    model=config.get("model", "models/text-embedding-004"),
+                    texts=texts
+                )
+            else:
+                # Provider không có batch API: gọi từng văn bản
+                return [await self.create_api_embedding(text) for text in texts]
+        except Exception as e:
+            print(f"❌ Lỗi khi tạo API embedding theo lô: {e}")
+            vectors = None
+
+        if vectors is None or len(vectors) != len(texts):
+            return [None] * len(texts)
+        return vectors
+
+    async def _call_openai_embeddings(
+        self,
+        api_key: str,
+        model: str,
+        texts: List[str]
+    ) -> Optional[List[Optional[List[float]]]]:
+        """Gọi OpenAI Embedding API với input là danh sách văn bản."""
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+        payload = {
+            "model": model,
+            "input": [text[:8000] for text in texts],
+            "encoding_format": "float"
+        }
+
+        async with httpx.AsyncClient(timeout=60.0) as client:
+            resp = await client.post(
+                "https://api.openai.com/v1/embeddings",
+                headers=headers,
+                json=payload
+            )
+
+        if resp.status_code != 200:
+            print(f"❌ Lỗi OpenAI Embedding API {resp.status_code}: {resp.text}")
+            return None
+
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        for item in resp.json().get("data", []):
+            index = item.get("index")
+            if isinstance(index, int) and 0 <= index < len(texts):
+                vectors[index] = item.get("embedding")
+        print(f"✓ Đã tạo {sum(v is not None for v in vectors)} OpenAI embedding trong một request")
+        return vectors
+
+    async def _call_gemini_embeddings(
+        self,
+        api_key: str,
+        model: str,
+        texts: List[str]
+    ) -> Optional[List[Optional[List[float]]]]:
+        """Gọi Google Gemini batchEmbedContents."""
+        if not model.startswith("models/"):
+            model = f"models/{model}"
+
+        url = f"https://generativelanguage.googleapis.com/v1beta/{model}:batchEmbedContents?key={api_key}"
+        payload = {
+            "requests": [
+                {"model": model, "content": {"parts": [{"text": text[:10000]}]}}
+                for text in texts
+            ]
+        }
+
+        async with httpx.AsyncClient(timeout=60.0) as client:
+            resp = await client.post(url, json=payload)
+
+        if resp.status_code != 200:
+            print(f"❌ Lỗi Gemini Embedding API {resp.status_code}: {resp.text}")
+            return None
+
+        vectors = [item.get("values") for item in resp.json().get("embeddings", [])]
+        print(f"✓ Đã tạo {len(vectors)} Gemini embedding trong một request")
+        return vectors
+
+    def _use_ner(self, text: str) -> bool:
+        """Văn bản ngắn dùng NER features nếu spaCy khả dụng."""
+        return len(text) < self.NER_TEXT_LENGTH_THRESHOLD and self.nlp is not None
+
+    @staticmethod
+    def _vector_embedding(vector: List[float], text: str) -> dict:
+        return {
+            "type": "api_vector",
+            "vector": vector,
+            "dimension": len(vector),
+            "text_length": len(text)
+        }
+
+    async def create_embeddings(self, texts: List[Optional[str]]) -> List[Optional[dict]]:
+        """
+        Tạo embedding cho nhiều văn bản - cùng chiến lược với create_embedding, nhưng
+        các văn bản cần API embedding được gửi trong một request.
+
+        Args:
+            texts: Danh sách văn bản (phần tử rỗng / None cho kết quả None)
+
+        Returns:
+            Danh sách embedding theo đúng thứ tự của texts
+        """
+        embeddings: List[Optional[dict]] = [None] * len(texts)
+        api_indexes: List[int] = []
+
+        for i, text in enumerate(texts):
+            if not text or not text.strip():
+                continue
+            text = text.strip()
+            if self._use_ner(text):
+                ner_embedding = self.create_ner_embedding(text)
+                if ner_embedding and ner_embedding.get("keywords"):
+                    embeddings[i] = ner_embedding
+                    continue
+            api_indexes.append(i)
+
+        if api_indexes:
+            api_texts = [texts[i].strip() for i in api_indexes]
+            print(f"ℹ Sử dụng API embedding theo lô ({len(api_texts)} văn bản)")
+            vectors = await self.create_api_embeddings(api_texts)
+            for i, text, vector in zip(api_indexes, api_texts, vectors):
+                if vector:
+                    embeddings[i] = self._vector_embedding(vector, text)
+                else:
+                    embeddings[i] = self._create_keyword_embedding(text)
+
+        return embeddings
+
     async def create_embedding(self, text: str) -> Optional[dict]:
         """
         Tạo embedding cho văn bản - tự động chọn phương pháp phù hợp.
@@ -310,12 +469,7 @@ class EmbeddingService:
         text_length = len(text)
         
         # Quyết định phương pháp embedding
-        use_ner = (
-            text_length < self.NER_TEXT_LENGTH_THRESHOLD 
-            and self.nlp is not None
-        )
-        
-        if use_ner:
+        if self._use_ner(text):
             print(f"ℹ Sử dụng NER embedding (text_length={text_length})")
             ner_embedding = self.create_ner_embedding(text)
             
@@ -330,12 +484,7 @@ class EmbeddingService:
         vector = await self.create_api_embedding(text)
         
         if vector:
-            return {
-                "type": "api_vector",
-                "vector": vector,
-                "dimension": len(vector),
-                "text_length": text_length
-            }
+            return self._vector_embedding(vector, text)
         
         # Fallback cuối cùng: tạo embedding đơn giản dựa trên keywords
         print("⚠ API embedding thất bại, sử dụng keyword fallback")
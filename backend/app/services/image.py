@@ -1,15 +1,36 @@
 """
 Dịch vụ xử lý hình ảnh để trích xuất siêu dữ liệu và dữ liệu EXIF.
 """
-from PIL import Image
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from PIL import Image, ImageOps
 from PIL.ExifTags import TAGS, GPSTAGS
 from io import BytesIO
 from datetime import datetime
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, List, Optional, Tuple
+
+from app.core.config import settings
+
+
+# Định dạng mã hóa lại ảnh trước khi gửi OCR
+_OCR_FORMATS = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+# Ảnh thu nhỏ (WebP) tạo cho mỗi ảnh gốc: tên -> cạnh dài tối đa (pixel).
+# Tên khớp với các trường {tên}_url của NoteOut.
+IMAGE_DERIVATIVES = {"thumbnail": 128, "medium": 512, "large": 1280}
 
 
 class ImageService:
     """Dịch vụ xử lý hình ảnh và trích xuất siêu dữ liệu."""
+
+    def __init__(self):
+        # Worker pool cho các thao tác Pillow tốn CPU (resize, mã hóa lại)
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            thread_name_prefix="image",
+        )
     
     @staticmethod
     def extract_exif_data(image_data: bytes) -> Dict[str, Any]:
@@ -132,28 +153,281 @@ class ImageService:
             return 0.0
 
     @staticmethod
-    def preprocess_for_ocr(image_data: bytes) -> bytes:
+    def detect_mime(image_data: bytes, default: str = "image/jpeg") -> str:
+        """Loại MIME theo nội dung ảnh (chỉ đọc header)."""
+        try:
+            with Image.open(BytesIO(image_data)) as image:
+                return Image.MIME.get(image.format, default)
+        except Exception:
+            return default
+
+    @staticmethod
+    def dhash(image_data: bytes, hash_size: int = 8) -> int | None:
         """
-        Tiền xử lý hình ảnh để có kết quả OCR tốt hơn.
-        
+        Perceptual hash (dHash) 64 bit: so sánh độ sáng các điểm ảnh kề nhau trên ảnh xám thu nhỏ.
+
+        Ảnh nén lại hoặc đổi kích thước cho hash gần giống (khoảng cách Hamming nhỏ).
+
+        Returns:
+            Số nguyên có dấu 64 bit (lưu được vào BIGINT), None nếu không đọc được ảnh
+        """
+        try:
+            with Image.open(BytesIO(image_data)) as image:
+                # draft: giải mã JPEG ở độ phân giải thấp, nhanh hơn nhiều so với ảnh đầy đủ
+                image.draft('L', (hash_size * 16, hash_size * 16))
+                small = ImageOps.exif_transpose(image).convert('L').resize(
+                    (hash_size + 1, hash_size), Image.Resampling.LANCZOS
+                )
+            pixels = list(small.getdata())
+            value = 0
+            for row in range(hash_size):
+                for col in range(hash_size):
+                    left = pixels[row * (hash_size + 1) + col]
+                    right = pixels[row * (hash_size + 1) + col + 1]
+                    value = (value << 1) | (left > right)
+            return value - (1 << 64) if value >= (1 << 63) else value
+        except Exception as e:
+            print(f"Lỗi khi tính dHash: {str(e)}")
+            return None
+
+    async def dhash_async(self, image_data: bytes) -> int | None:
+        """Tính dHash trên worker pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.dhash, image_data)
+
+    @staticmethod
+    def _prepare_for_encoding(image: Image.Image, grayscale: bool, autocontrast: bool) -> Image.Image:
+        """Chuyển chế độ màu để mã hóa JPEG/WebP, tùy chọn grayscale / tăng tương phản."""
+        if grayscale:
+            image = image.convert('L')
+        elif image.mode not in ('RGB', 'L'):
+            # JPEG không có kênh alpha: ghép lên nền trắng
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            rgba = image.convert('RGBA')
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            image = background
+        if autocontrast:
+            image = ImageOps.autocontrast(image)
+        return image
+
+    @staticmethod
+    def _encode(image: Image.Image, image_format: str, quality: int) -> bytes:
+        output = BytesIO()
+        image.save(output, format=image_format, quality=quality, optimize=True)
+        return output.getvalue()
+
+    @staticmethod
+    def preprocess_for_ocr(
+        image_data: bytes,
+        max_edge: int = 2048,
+        image_format: str = "JPEG",
+        quality: int = 85,
+        grayscale: bool = False,
+        autocontrast: bool = False,
+    ) -> Tuple[bytes, str]:
+        """
+        Chuẩn bị ảnh cho OCR bằng model vision: xoay theo EXIF, thu nhỏ cạnh dài về
+        `max_edge`, tùy chọn grayscale / tăng tương phản, mã hóa lại JPEG hoặc WebP.
+
+        Provider đều tự thu nhỏ ảnh lớn, nên gửi ảnh gốc 12MP chỉ làm payload lớn hơn.
+        Nếu kết quả không nhỏ hơn ảnh gốc (ảnh đã nhỏ và nén tốt) thì giữ nguyên ảnh gốc.
+
         Args:
             image_data: Dữ liệu hình ảnh nhị phân
-            
+            max_edge: Cạnh dài tối đa (pixel)
+            image_format: "JPEG" hoặc "WEBP"
+            quality: Chất lượng nén (1-100)
+            grayscale: Chuyển sang ảnh xám
+            autocontrast: Tự động kéo giãn tương phản
+
         Returns:
-            Dữ liệu hình ảnh đã tiền xử lý
+            Tuple của (dữ liệu ảnh, loại MIME)
         """
+        image_format = image_format.upper()
+        if image_format not in _OCR_FORMATS:
+            raise ValueError(f"Định dạng OCR không hỗ trợ: {image_format}")
+
         try:
-            image = Image.open(BytesIO(image_data))
-            
-            if image.mode not in ('RGB', 'L'):
-                image = image.convert('RGB')
-            
-            output = BytesIO()
-            image.save(output, format='PNG')
-            return output.getvalue()
+            with Image.open(BytesIO(image_data)) as original:
+                original_mime = Image.MIME.get(original.format, "image/jpeg")
+                rotated = original.getexif().get(0x0112, 1) != 1  # EXIF Orientation
+                oriented = ImageOps.exif_transpose(original)
+                resized = max(oriented.size) > max_edge
+                if resized:
+                    oriented.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+                image = ImageService._prepare_for_encoding(oriented, grayscale, autocontrast)
+                processed = ImageService._encode(image, image_format, quality)
+
+            changed = rotated or resized or grayscale or autocontrast
+            if not changed and len(processed) >= len(image_data):
+                return image_data, original_mime
+            return processed, _OCR_FORMATS[image_format]
         except Exception as e:
             print(f"Lỗi khi tiền xử lý hình ảnh: {str(e)}")
-            return image_data
+            return image_data, ImageService.detect_mime(image_data)
+
+    async def preprocess_for_ocr_async(self, image_data: bytes) -> Tuple[bytes, str]:
+        """Tiền xử lý ảnh theo cấu hình OCR_* trên worker pool (Pillow nhả GIL khi resize/encode)."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            partial(
+                self.preprocess_for_ocr,
+                image_data,
+                max_edge=settings.OCR_MAX_EDGE,
+                image_format=settings.OCR_IMAGE_FORMAT,
+                quality=settings.OCR_IMAGE_QUALITY,
+                grayscale=settings.OCR_GRAYSCALE,
+                autocontrast=settings.OCR_AUTOCONTRAST,
+            ),
+        )
+
+
+    @staticmethod
+    def prepare_for_tesseract(image_data: bytes, max_edge: int = 4000) -> bytes:
+        """
+        Chuẩn bị ảnh cho Tesseract: xoay theo EXIF, chuyển ảnh xám, giới hạn cạnh dài,
+        mã hóa PNG (không mất dữ liệu, Tesseract đọc được qua stdin).
+
+        Args:
+            image_data: Dữ liệu hình ảnh nhị phân
+            max_edge: Cạnh dài tối đa (pixel) - Tesseract cần độ phân giải cao hơn model vision
+
+        Returns:
+            Ảnh PNG
+        """
+        with Image.open(BytesIO(image_data)) as original:
+            image = ImageOps.exif_transpose(original).convert('L')
+            if max(image.size) > max_edge:
+                image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+            output = BytesIO()
+            image.save(output, format="PNG")
+            return output.getvalue()
+
+    async def prepare_for_tesseract_async(self, image_data: bytes) -> bytes:
+        """Phiên bản chạy trên worker pool của prepare_for_tesseract."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            partial(self.prepare_for_tesseract, image_data, max_edge=settings.OCR_LOCAL_MAX_EDGE),
+        )
+
+    @staticmethod
+    def split_for_ocr(
+        image_data: bytes,
+        threshold: int = 2400,
+        tile_height: int = 1600,
+        overlap: int = 160,
+        max_width: int = 2048,
+        image_format: str = "JPEG",
+        quality: int = 85,
+        grayscale: bool = False,
+        autocontrast: bool = False,
+    ) -> List[Tuple[bytes, str]]:
+        """
+        Cắt ảnh dài (screenshot dài, tài liệu cả trang, hóa đơn) thành các dải ngang chồng lấn.
+
+        Ảnh được xoay theo EXIF và thu nhỏ về chiều rộng `max_width` trước; chỉ cắt khi chiều
+        cao sau đó vượt `threshold`. Các dải theo thứ tự đọc (trên xuống dưới), hai dải kề
+        nhau chung `overlap` pixel để không mất dòng chữ nằm ở đường cắt.
+
+        Returns:
+            Danh sách (dữ liệu ảnh, loại MIME) của từng tile; rỗng nếu không cần cắt
+        """
+        image_format = image_format.upper()
+        if image_format not in _OCR_FORMATS:
+            raise ValueError(f"Định dạng OCR không hỗ trợ: {image_format}")
+        if overlap >= tile_height:
+            raise ValueError("overlap phải nhỏ hơn tile_height")
+
+        with Image.open(BytesIO(image_data)) as original:
+            image = ImageOps.exif_transpose(original)
+            if image.width > max_width:
+                height = round(image.height * max_width / image.width)
+                image = image.resize((max_width, height), Image.Resampling.LANCZOS)
+            if image.height <= threshold:
+                return []
+
+            image = ImageService._prepare_for_encoding(image, grayscale, autocontrast)
+            tiles = []
+            top = 0
+            while True:
+                bottom = min(top + tile_height, image.height)
+                tile = image.crop((0, top, image.width, bottom))
+                tiles.append((ImageService._encode(tile, image_format, quality), _OCR_FORMATS[image_format]))
+                if bottom >= image.height:
+                    break
+                top = bottom - overlap
+            return tiles
+
+    async def split_for_ocr_async(self, image_data: bytes) -> List[Tuple[bytes, str]]:
+        """Cắt tile theo cấu hình OCR_* trên worker pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            partial(
+                self.split_for_ocr,
+                image_data,
+                threshold=settings.OCR_TILE_THRESHOLD,
+                tile_height=settings.OCR_TILE_HEIGHT,
+                overlap=settings.OCR_TILE_OVERLAP,
+                max_width=settings.OCR_MAX_EDGE,
+                image_format=settings.OCR_IMAGE_FORMAT,
+                quality=settings.OCR_IMAGE_QUALITY,
+                grayscale=settings.OCR_GRAYSCALE,
+                autocontrast=settings.OCR_AUTOCONTRAST,
+            ),
+        )
+
+    @staticmethod
+    def create_derivatives(
+        image_data: bytes,
+        sizes: Dict[str, int],
+        quality: int = 80,
+    ) -> Dict[str, Tuple[bytes, int, int]]:
+        """
+        Tạo các ảnh thu nhỏ WebP: xoay theo EXIF, thu nhỏ cạnh dài về từng kích thước.
+
+        Ảnh chỉ được giải mã một lần; các kích thước được tạo từ lớn đến nhỏ, mỗi ảnh
+        thu nhỏ từ ảnh trước đó. Ảnh gốc nhỏ hơn kích thước yêu cầu không bị phóng to.
+
+        Args:
+            image_data: Dữ liệu hình ảnh nhị phân
+            sizes: Tên -> cạnh dài tối đa (pixel)
+            quality: Chất lượng WebP (1-100)
+
+        Returns:
+            Tên -> (dữ liệu WebP, chiều rộng, chiều cao)
+        """
+        derivatives = {}
+        with Image.open(BytesIO(image_data)) as original:
+            # draft: giải mã JPEG ở độ phân giải thấp hơn nhưng vẫn đủ cho kích thước lớn nhất
+            largest = max(sizes.values())
+            original.draft('RGB', (largest, largest))
+            image = ImageOps.exif_transpose(original)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+            for name, size in sorted(sizes.items(), key=lambda item: item[1], reverse=True):
+                image.thumbnail((size, size), Image.Resampling.LANCZOS)
+                output = BytesIO()
+                image.save(output, format="WEBP", quality=quality, method=4)
+                derivatives[name] = (output.getvalue(), image.width, image.height)
+        return derivatives
+
+    async def create_derivatives_async(self, image_data: bytes) -> Dict[str, Tuple[bytes, int, int]]:
+        """Tạo IMAGE_DERIVATIVES trên worker pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            partial(
+                self.create_derivatives,
+                image_data,
+                IMAGE_DERIVATIVES,
+                quality=settings.IMAGE_DERIVATIVE_QUALITY,
+            ),
+        )
 
 
 # Instance singleton
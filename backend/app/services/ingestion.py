@@ -0,0 +1,507 @@
+"""
+Dịch vụ xử lý ảnh thành ghi chú, chạy theo pipeline DAG (app/services/pipeline.py):
+
+    upload ──────────┬───────────────────┐
+    resize ──────────┴── derivatives ────┤
+    exif ────────────────────────────────┤
+    ocr ──┬── embedding ─────────────────┼── tạo ghi chú
+          ├── entities ──────────────────┤
+          └── summary ───────────────────┘
+
+upload, resize (tạo ảnh thu nhỏ WebP), exif và ocr chạy song song; ảnh thu nhỏ được upload
+khi đã có storage key của ảnh gốc, ba bước làm giàu văn bản chỉ chờ OCR. Thời gian tạo
+ghi chú xấp xỉ max(upload, resize, exif, ocr) + max(embedding, entities, summary, derivatives).
+
+Dùng chung cho upload qua API (/notes/upload-image), upload trực tiếp lên S3
+bằng presigned URL (/notes/uploads/finalize) và upload nhiều ảnh (/notes/upload-images).
+Với nhiều ảnh, embedding được tách khỏi pipeline để gửi theo lô.
+"""
+import asyncio
+import hashlib
+import time
+from dataclasses import dataclass
+from itertools import islice
+from typing import Awaitable, BinaryIO, Callable, Dict, Iterable, List, Tuple
+from uuid import UUID
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.metrics import metrics
+from app.crud.note import create_note, create_notes
+from app.crud.storage import pin_storage_object, release_storage_keys
+from app.models import NoteItem
+from app.services.embedding import embedding_service
+from app.services.image import IMAGE_DERIVATIVES, image_service
+from app.services.llm import llm_service
+from app.services.ocr import ocr_service
+from app.services.pipeline import STATUS_ERROR, STATUS_OK, Pipeline, PipelineResult, Stage
+from app.services.storage import storage_service
+
+
+metrics.describe("ainote_storage_dedup_total", "Upload theo nội dung: dùng lại object (index/head) hoặc upload mới (uploaded)")
+
+
+DEFAULT_IMAGE_NOTE_TITLE = "Ghi chú hình ảnh"
+
+# Ảnh thu nhỏ có key cố định theo ảnh gốc và không bao giờ bị ghi đè
+DERIVATIVE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@dataclass
+class BatchImage:
+    """
+    Một ảnh trong lô upload. Nội dung chỉ được đọc khi tới lượt xử lý.
+
+    Attributes:
+        filename: Tên file (trả về trong trạng thái từng file)
+        read: Coroutine factory đọc nội dung ảnh
+        upload: Coroutine factory upload ảnh (nhận nội dung đã đọc), trả về (public_url, storage_key)
+    """
+    filename: str
+    read: Callable[[], Awaitable[bytes]]
+    upload: Callable[[bytes], Awaitable[Tuple[str, str]]]
+
+
+@dataclass
+class BatchItemResult:
+    """Kết quả của một ảnh trong lô: note_id nếu thành công, error nếu thất bại."""
+    filename: str
+    note_id: UUID | None = None
+    error: str | None = None
+
+
+class IngestionService:
+    """Tạo ghi chú từ ảnh đã upload."""
+
+    def __init__(self):
+        # Giới hạn số request entities / summary đồng thời của cả worker
+        self._llm_semaphore = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+        # Upload theo nội dung đang chạy trong worker: cùng ảnh (ví dụ trong một lô) chờ chung một lần upload
+        self._inflight_puts: Dict[str, asyncio.Future] = {}
+
+    async def _extract_metadata(self, image_data: bytes) -> dict:
+        # Pillow chạy đồng bộ - đưa sang thread để không chặn các stage khác
+        exif_data = await asyncio.to_thread(image_service.extract_exif_data, image_data)
+        if not exif_data:
+            return {}
+        image_metadata = image_service.parse_metadata(exif_data)
+        print(f"✓ Đã trích xuất EXIF metadata")
+        return image_metadata
+
+    @staticmethod
+    def _pin(storage_key: str, content_sha256: str | None, size: int) -> bool:
+        # Transaction riêng, commit ngay: tham chiếu phải có hiệu lực trước khi dùng lại object
+        db = SessionLocal()
+        try:
+            referenced = pin_storage_object(db, storage_key, content_sha256, size)
+            db.commit()
+            return referenced
+        finally:
+            db.close()
+
+    @staticmethod
+    def _unpin(storage_key: str):
+        db = SessionLocal()
+        try:
+            release_storage_keys(db, [storage_key])
+            db.commit()
+        finally:
+            db.close()
+
+    async def _pin_and_store(
+        self,
+        storage_key: str,
+        data: bytes,
+        content_type: str,
+        content_sha256: str | None,
+        cache_control: str | None,
+    ) -> str:
+        if await asyncio.to_thread(self._pin, storage_key, content_sha256, len(data)):
+            return "index"
+        try:
+            if await storage_service.get_object_size_async(storage_key) is not None:
+                return "head"
+            await storage_service.put_object_async(storage_key, data, content_type, cache_control)
+            return "uploaded"
+        except Exception:
+            # Không để lại tham chiếu tới object chưa tồn tại
+            await asyncio.to_thread(self._unpin, storage_key)
+            raise
+
+    async def _put_deduplicated(
+        self,
+        storage_key: str,
+        data: bytes,
+        content_type: str,
+        content_sha256: str | None = None,
+        cache_control: str | None = None,
+    ) -> str:
+        """
+        Ghi object theo nội dung nếu chưa có: pin (ref_count + 1) rồi bỏ qua upload khi
+        object đang được ghi chú khác dùng (chỉ mục) hoặc đã tồn tại trên storage (HEAD).
+        Cùng key đang được xử lý trong worker thì chỉ pin và chờ lần xử lý đó.
+
+        Returns:
+            URL công khai
+        """
+        inflight = self._inflight_puts.get(storage_key)
+        if inflight is None:
+            inflight = asyncio.ensure_future(
+                self._pin_and_store(storage_key, data, content_type, content_sha256, cache_control)
+            )
+            self._inflight_puts[storage_key] = inflight
+            inflight.add_done_callback(lambda _future: self._inflight_puts.pop(storage_key, None))
+            result = await asyncio.shield(inflight)
+        else:
+            await asyncio.to_thread(self._pin, storage_key, content_sha256, len(data))
+            try:
+                await asyncio.shield(inflight)
+            except Exception:
+                await asyncio.to_thread(self._unpin, storage_key)
+                raise
+            result = "index"
+        metrics.inc("ainote_storage_dedup_total", result=result)
+        return storage_service.public_url(storage_key)
+
+    async def upload_image(
+        self,
+        image_data: bytes,
+        filename: str,
+        content_type: str,
+        fileobj: BinaryIO | None = None,
+    ) -> Tuple[str, str]:
+        """
+        Upload ảnh gốc của ghi chú.
+
+        Với STORAGE_CONTENT_ADDRESSED, key là SHA-256 của ảnh và ảnh trùng không được upload lại;
+        ngược lại key uuid, upload theo luồng từ `fileobj` nếu có.
+
+        Args:
+            image_data: Nội dung ảnh
+            filename: Tên file gốc
+            content_type: Loại MIME
+            fileobj: File tạm chứa cùng nội dung (upload multipart theo luồng)
+
+        Returns:
+            Tuple của (public_url, storage_key)
+        """
+        if settings.STORAGE_CONTENT_ADDRESSED:
+            content_sha256 = hashlib.sha256(image_data).hexdigest()
+            storage_key = storage_service.content_key(content_sha256, content_type)
+            url = await self._put_deduplicated(storage_key, image_data, content_type, content_sha256)
+            return url, storage_key
+        if fileobj is not None:
+            return await storage_service.upload_fileobj_async(fileobj, filename, content_type)
+        return await storage_service.upload_image_async(image_data, filename, content_type)
+
+    @staticmethod
+    async def _resize(image_data: bytes) -> dict:
+        return await image_service.create_derivatives_async(image_data)
+
+    async def _upload_derivatives(self, storage_key: str, images: dict) -> dict:
+        """Upload ảnh thu nhỏ song song, trả về tên -> {key, url, width, height}."""
+        keys = {name: storage_service.derivative_key(storage_key, IMAGE_DERIVATIVES[name]) for name in images}
+        # Ảnh gốc theo nội dung thì ảnh thu nhỏ cũng dùng chung và được đếm tham chiếu
+        put = self._put_deduplicated if settings.STORAGE_CONTENT_ADDRESSED else storage_service.put_object_async
+        urls = await asyncio.gather(*(
+            put(keys[name], data, "image/webp", cache_control=DERIVATIVE_CACHE_CONTROL)
+            for name, (data, _width, _height) in images.items()
+        ), return_exceptions=True)
+        errors = [url for url in urls if isinstance(url, BaseException)]
+        if errors:
+            # Ghi chú sẽ không tham chiếu ảnh thu nhỏ nào: bỏ pin (theo nội dung) hoặc đưa vào
+            # hàng đợi xóa (key uuid) các ảnh đã upload thành công
+            uploaded = [keys[name] for name, url in zip(images, urls) if not isinstance(url, BaseException)]
+            for key in uploaded:
+                try:
+                    await asyncio.to_thread(self._unpin, key)
+                except Exception as e:
+                    print(f"⚠ Không thể bỏ tham chiếu {key}: {e}")
+            raise errors[0]
+        derivatives = {
+            name: {"key": keys[name], "url": url, "width": width, "height": height}
+            for (name, (_data, width, height)), url in zip(images.items(), urls)
+        }
+        print(f"✓ Đã tạo {len(derivatives)} ảnh thu nhỏ")
+        return derivatives
+
+    async def _extract_text(self, user_id: UUID, image_data: bytes) -> str | None:
+        # Cache OCR dùng phiên database riêng - không đụng tới transaction của request
+        ocr_text, ocr_confidence = await ocr_service.extract_text_cached(
+            user_id,
+            image_data,
+            lang='vie+eng'
+        )
+        if ocr_text:
+            print(f"✓ OCR đã trích xuất {len(ocr_text)} ký tự")
+        return ocr_text
+
+    @staticmethod
+    async def _create_embedding(ocr: str | None) -> dict | None:
+        if not ocr:
+            return None
+        print(f"ℹ Tạo embedding cho OCR text (length={len(ocr)})")
+        embedding = await embedding_service.create_embedding(ocr)
+        if embedding:
+            print(f"✓ Đã tạo embedding type={embedding.get('type')}")
+        return embedding
+
+    async def _extract_entities(self, ocr: str | None) -> dict | None:
+        if not ocr:
+            return None
+        async with self._llm_semaphore:
+            entities_json = await llm_service.extract_entities(ocr)
+        if entities_json and isinstance(entities_json, dict):
+            print(f"✓ Đã trích xuất entities type={entities_json.get('entity_type')}")
+            return entities_json
+        return None
+
+    async def _generate_summary(self, ocr: str | None) -> str | None:
+        if not ocr:
+            return None
+        async with self._llm_semaphore:
+            semantic_summary = await llm_service.generate_semantic_summary(ocr)
+        if semantic_summary:
+            print(f"✓ Đã tạo semantic summary ({len(semantic_summary)} ký tự)")
+        return semantic_summary
+
+    async def _run_pipeline(
+        self,
+        user_id: UUID,
+        image_data: bytes,
+        upload: Callable[[], Awaitable[Tuple[str, str]]] | None,
+        storage_key: str | None = None,
+        embed: bool = True,
+    ) -> PipelineResult:
+        stages = [
+            Stage("exif", lambda: self._extract_metadata(image_data)),
+            Stage("ocr", lambda: self._extract_text(user_id, image_data)),
+            Stage("entities", self._extract_entities, deps=("ocr",)),
+            Stage("summary", self._generate_summary, deps=("ocr",)),
+        ]
+        if embed:
+            stages.append(Stage("embedding", self._create_embedding, deps=("ocr",)))
+        if upload is not None:
+            stages.insert(0, Stage("upload", upload))
+        if settings.IMAGE_DERIVATIVES_ENABLED:
+            stages.append(Stage("resize", lambda: self._resize(image_data)))
+            if upload is not None:
+                stages.append(Stage(
+                    "derivatives",
+                    lambda upload, resize: self._upload_derivatives(upload[1], resize),
+                    deps=("upload", "resize"),
+                ))
+            else:
+                stages.append(Stage(
+                    "derivatives",
+                    lambda resize: self._upload_derivatives(storage_key, resize),
+                    deps=("resize",),
+                ))
+
+        result = await Pipeline(stages).run()
+
+        for name, error in result.errors.items():
+            print(f"⚠ Bước {name} thất bại: {error}")
+        if "upload" in result.errors:
+            raise result.errors["upload"]
+        return result
+
+    @staticmethod
+    def _note_data(result: PipelineResult, title: str | None, image_url: str, embedding: dict | None) -> dict:
+        entities = result.get("entities")
+        return dict(
+            title=title or DEFAULT_IMAGE_NOTE_TITLE,
+            ocr_text=result.get("ocr"),
+            raw_image_url=image_url,
+            image_metadata=result.get("exif") or {},
+            semantic_summary=result.get("summary"),
+            # Lấy entity_type từ JSON và lưu vào cột riêng
+            entity_type=entities.get('entity_type') if entities else None,
+            embedding=embedding,
+            entities=entities,
+            processing_stats=result.stats(),
+            image_derivatives=result.get("derivatives"),
+        )
+
+    @staticmethod
+    def discard_images(db: Session, notes: Iterable[NoteItem | dict]) -> None:
+        """
+        Bỏ tham chiếu tới ảnh (gốc + thu nhỏ) của các ghi chú không lưu được: object theo nội dung
+        giảm ref_count, object không còn ai dùng vào hàng đợi xóa.
+
+        Gọi sau khi đã rollback; lỗi chỉ được ghi log - job storage_reconcile sẽ dọn sau.
+        """
+        keys = []
+        for note in notes:
+            if isinstance(note, dict):
+                keys.extend(storage_service.note_storage_keys(note.get("raw_image_url"), note.get("image_derivatives")))
+            else:
+                keys.extend(storage_service.note_storage_keys(note.raw_image_url, note.image_derivatives))
+        if not keys:
+            return
+        try:
+            release_storage_keys(db, keys)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"⚠ Không thể bỏ tham chiếu {len(keys)} object: {e}")
+
+    async def create_image_note(
+        self,
+        db: Session,
+        user_id: UUID,
+        image_data: bytes,
+        title: str | None = None,
+        image_url: str | None = None,
+        storage_key: str | None = None,
+        upload: Callable[[], Awaitable[Tuple[str, str]]] | None = None,
+    ) -> NoteItem:
+        """
+        Trích xuất thông tin từ ảnh và tạo ghi chú (chưa commit).
+
+        Lỗi ở từng bước làm giàu (EXIF, OCR, embedding, entities, summary) chỉ được ghi log,
+        ghi chú vẫn được tạo với các trường còn lại. Trạng thái và thời gian từng bước
+        được lưu vào note.processing_stats.
+
+        Args:
+            db: Phiên cơ sở dữ liệu
+            user_id: ID người dùng
+            image_data: Nội dung ảnh
+            title: Tiêu đề (mặc định "Ghi chú hình ảnh")
+            image_url: URL công khai nếu ảnh đã nằm trên storage
+            storage_key: Storage key tương ứng với image_url (đặt tên ảnh thu nhỏ)
+            upload: Coroutine factory upload ảnh, trả về (public_url, storage_key) -
+                    chạy song song với EXIF / OCR khi chưa có image_url
+
+        Returns:
+            Ghi chú vừa tạo
+
+        Raises:
+            Exception: Lỗi của bước upload (không thể tạo ghi chú khi không có ảnh)
+        """
+        if (image_url is None or storage_key is None) and upload is None:
+            raise ValueError("Cần image_url + storage_key hoặc upload")
+
+        result = await self._run_pipeline(
+            user_id, image_data,
+            upload=upload if image_url is None else None,
+            storage_key=storage_key,
+        )
+        if image_url is None:
+            image_url, _storage_key = result.get("upload")
+
+        return create_note(
+            db,
+            user_id=user_id,
+            **self._note_data(result, title, image_url, result.get("embedding")),
+        )
+
+    async def create_image_notes(
+        self,
+        db: Session,
+        user_id: UUID,
+        images: Iterable[BatchImage],
+        title: str | None = None,
+    ) -> List[BatchItemResult]:
+        """
+        Tạo ghi chú cho nhiều ảnh, chia thành các lô BATCH_UPLOAD_CHUNK_SIZE ảnh.
+
+        Trong mỗi lô: tối đa BATCH_UPLOAD_CONCURRENCY ảnh được đọc và xử lý đồng thời
+        (S3, OCR, LLM còn bị giới hạn bởi pool / semaphore riêng của từng service),
+        embedding của cả lô gửi trong một request, ghi chú được insert và commit trong
+        một transaction. Ảnh lỗi không ảnh hưởng các ảnh khác; lô commit lỗi thì mọi ảnh
+        trong lô được báo lỗi.
+
+        Args:
+            db: Phiên cơ sở dữ liệu (được commit sau mỗi lô)
+            user_id: ID người dùng
+            images: Các ảnh cần xử lý (duyệt lần lượt, không cần nạp trước vào RAM)
+            title: Tiêu đề chung (mặc định "Ghi chú hình ảnh")
+
+        Returns:
+            Kết quả từng ảnh theo đúng thứ tự đầu vào
+        """
+        images = iter(images)
+        results: List[BatchItemResult] = []
+        while chunk := list(islice(images, settings.BATCH_UPLOAD_CHUNK_SIZE)):
+            results.extend(await self._create_chunk(db, user_id, chunk, title))
+        return results
+
+    async def _create_chunk(
+        self,
+        db: Session,
+        user_id: UUID,
+        chunk: List[BatchImage],
+        title: str | None,
+    ) -> List[BatchItemResult]:
+        semaphore = asyncio.Semaphore(settings.BATCH_UPLOAD_CONCURRENCY)
+
+        async def process(image: BatchImage) -> PipelineResult:
+            async with semaphore:
+                # Nội dung ảnh chỉ nằm trong RAM khi đang xử lý
+                image_data = await image.read()
+                return await self._run_pipeline(
+                    user_id, image_data, upload=lambda: image.upload(image_data), embed=False
+                )
+
+        outcomes = await asyncio.gather(*(process(image) for image in chunk), return_exceptions=True)
+        results = [
+            BatchItemResult(filename=image.filename, error=str(outcome) or type(outcome).__name__)
+            if isinstance(outcome, BaseException)
+            else BatchItemResult(filename=image.filename)
+            for image, outcome in zip(chunk, outcomes)
+        ]
+        processed = [
+            (item, outcome)
+            for item, outcome in zip(results, outcomes)
+            if not isinstance(outcome, BaseException)
+        ]
+        if not processed:
+            return results
+
+        # Embedding của cả lô trong một request tới provider
+        started = time.perf_counter()
+        try:
+            embeddings = await embedding_service.create_embeddings(
+                [outcome.get("ocr") for _item, outcome in processed]
+            )
+            embedding_status = STATUS_OK
+        except Exception as e:
+            print(f"⚠ Bước embedding (theo lô) thất bại: {e}")
+            embeddings = [None] * len(processed)
+            embedding_status = STATUS_ERROR
+        embedding_ms = round((time.perf_counter() - started) * 1000, 1)
+
+        notes_data = []
+        for (_item, outcome), embedding in zip(processed, embeddings):
+            image_url, _storage_key = outcome.get("upload")
+            data = self._note_data(outcome, title, image_url, embedding)
+            data["processing_stats"]["stages"]["embedding"] = {
+                "status": embedding_status,
+                "ms": embedding_ms,
+                "batch_size": len(processed),
+            }
+            notes_data.append(data)
+
+        try:
+            notes = create_notes(db, user_id, notes_data)
+            note_ids = [note.id for note in notes]
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"❌ Lưu lô {len(processed)} ghi chú thất bại: {e}")
+            self.discard_images(db, notes_data)
+            for item, _outcome in processed:
+                item.error = f"Lưu ghi chú thất bại: {e}"
+            return results
+
+        for (item, _outcome), note_id in zip(processed, note_ids):
+            item.note_id = note_id
+        print(f"✓ Đã tạo {len(note_ids)}/{len(chunk)} ghi chú trong một transaction")
+        return results
+
+
+# Singleton instance
+ingestion_service = IngestionService()
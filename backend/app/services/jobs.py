@@ -0,0 +1,306 @@
+"""
+Service chạy các job bảo trì định kỳ trong tiến trình ứng dụng.
+
+Mỗi lần chạy một job được bảo vệ bằng PostgreSQL advisory lock theo tên job,
+nên khi chạy nhiều worker uvicorn chỉ một worker thực thi tại một thời điểm.
+Phần việc với database chạy trong thread (asyncio.to_thread) để không chặn event loop.
+"""
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from collections import Counter
+from itertools import islice
+from typing import Callable, Dict, List
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.database import SessionLocal, engine
+from app.core.qa_partitions import (
+    archive_and_drop_partition,
+    create_default_partition,
+    detach_qa_partition,
+    ensure_qa_partitions,
+    expired_qa_partitions,
+    list_detached_qa_partitions,
+)
+from app.core.metrics import metrics
+from app.crud.auth import purge_refresh_tokens
+from app.crud.note import purge_note_tombstones
+from app.crud.storage import (
+    claim_storage_deletes,
+    delete_storage_objects,
+    enqueue_storage_deletes,
+    finish_storage_deletes,
+    iter_note_images,
+    iter_storage_pins,
+    lock_storage_objects,
+    purge_upload_claims,
+    reset_storage_pin,
+)
+from app.services.storage import storage_service
+
+
+metrics.describe("ainote_storage_gc_deleted_total", "Số object S3 đã xóa bởi job storage_gc")
+metrics.describe("ainote_storage_gc_failed_total", "Số lần xóa object S3 thất bại (sẽ thử lại)")
+metrics.describe("ainote_storage_orphans_total", "Số object S3 không có ghi chú tham chiếu tìm thấy khi đối soát")
+
+
+@dataclass
+class Job:
+    """Một job định kỳ."""
+    name: str
+    interval_seconds: float
+    func: Callable[[], None]
+
+
+class JobRunner:
+    """Bộ lập lịch đơn giản cho các job định kỳ."""
+
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def register(self, name: str, interval_seconds: float, func: Callable[[], None]):
+        """Đăng ký job chạy mỗi `interval_seconds` giây."""
+        self._jobs[name] = Job(name=name, interval_seconds=interval_seconds, func=func)
+
+    def run_once(self, name: str) -> bool:
+        """
+        Chạy job một lần nếu lấy được advisory lock.
+
+        Returns:
+            True nếu job đã chạy, False nếu worker khác đang giữ lock
+        """
+        job = self._jobs[name]
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_conn:
+            acquired = lock_conn.execute(
+                text("SELECT pg_try_advisory_lock(hashtext(:name))"), {"name": f"job:{name}"}
+            ).scalar()
+            if not acquired:
+                return False
+            try:
+                started = time.perf_counter()
+                job.func()
+                print(f"✓ Job {name} hoàn tất trong {time.perf_counter() - started:.1f}s")
+            finally:
+                lock_conn.execute(
+                    text("SELECT pg_advisory_unlock(hashtext(:name))"), {"name": f"job:{name}"}
+                )
+        return True
+
+    async def _loop(self, job: Job):
+        # Lệch pha ngẫu nhiên để các worker không cùng tranh lock ngay khi khởi động
+        await asyncio.sleep(random.uniform(0, min(job.interval_seconds, 30)))
+        while True:
+            try:
+                await asyncio.to_thread(self.run_once, job.name)
+            except Exception as e:
+                print(f"❌ Job {job.name} lỗi: {e}")
+            await asyncio.sleep(job.interval_seconds)
+
+    def start(self):
+        """Khởi động vòng lặp cho tất cả job đã đăng ký (gọi trong event loop)."""
+        for job in self._jobs.values():
+            self._tasks.append(asyncio.create_task(self._loop(job)))
+
+    async def stop(self):
+        """Dừng tất cả job."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+
+def maintain_qa_partitions():
+    """Tạo trước partition tháng tới, tách và lưu trữ các partition quá hạn."""
+    with engine.begin() as conn:
+        # Database đã migrate trước khi có DEFAULT partition
+        create_default_partition(conn)
+        ensure_qa_partitions(conn, months_ahead=settings.QA_PARTITION_MONTHS_AHEAD)
+
+    with engine.begin() as conn:
+        expired = expired_qa_partitions(conn, settings.QA_RETENTION_MONTHS)
+    for name in expired:
+        with engine.begin() as conn:
+            detach_qa_partition(conn, name)
+        print(f"ℹ Đã tách partition {name}")
+
+    # Bao gồm cả partition đã tách ở lần chạy trước nhưng chưa lưu trữ xong
+    with engine.begin() as conn:
+        detached = list_detached_qa_partitions(conn)
+    for name in detached:
+        with engine.begin() as conn:
+            path = archive_and_drop_partition(conn, name, settings.QA_ARCHIVE_DIR)
+        print(f"✓ Đã lưu trữ {name} -> {path}")
+
+
+def purge_expired_tombstones():
+    """Xóa tombstone cũ hơn thời gian giữ của đồng bộ delta."""
+    db = SessionLocal()
+    try:
+        deleted = purge_note_tombstones(db, settings.NOTE_TOMBSTONE_RETENTION_DAYS)
+        db.commit()
+        if deleted:
+            print(f"✓ Đã xóa {deleted} tombstone hết hạn")
+    finally:
+        db.close()
+
+
+def purge_stale_refresh_tokens(batch_size: int = 1000):
+    """Xóa refresh token hết hạn / đã thu hồi theo lô, mỗi lô một transaction ngắn."""
+    total = 0
+    while True:
+        db = SessionLocal()
+        try:
+            deleted = purge_refresh_tokens(db, batch_size)
+            db.commit()
+        finally:
+            db.close()
+        if not deleted:
+            break
+        total += deleted
+    if total:
+        print(f"✓ Đã xóa {total} refresh token hết hạn/đã thu hồi")
+
+
+def purge_expired_upload_claims():
+    """Xóa bản ghi finalize upload trực tiếp khi upload token tương ứng chắc chắn đã hết hạn."""
+    db = SessionLocal()
+    try:
+        deleted = purge_upload_claims(db, settings.PRESIGNED_UPLOAD_EXPIRES_SECONDS)
+        db.commit()
+        if deleted:
+            print(f"✓ Đã xóa {deleted} bản ghi finalize upload hết hạn")
+    finally:
+        db.close()
+
+
+def drain_storage_deletes(batch_size: int = 1000):
+    """
+    Xóa các object trong storage_pending_deletes bằng DeleteObjects, mỗi lô (<= 1000 key)
+    một transaction. Key lỗi được giữ lại với attempts + 1; dừng khi một lô không xóa được gì.
+
+    Object theo nội dung được pin lại (ref_count > 0) sau khi vào hàng đợi thì chỉ bị bỏ khỏi
+    hàng đợi. Dòng storage_objects bị khóa trong lúc xóa, nên upload đồng thời của cùng ảnh
+    chờ tới khi xóa xong rồi mới pin (và upload lại).
+    """
+    batch_size = min(batch_size, 1000)
+    total = 0
+    while True:
+        db = SessionLocal()
+        try:
+            keys = claim_storage_deletes(db, batch_size)
+            if not keys:
+                break
+            ref_counts = lock_storage_objects(db, keys)
+            to_delete = [key for key in keys if ref_counts.get(key, 0) == 0]
+            errors = storage_service.delete_keys(to_delete) if to_delete else {}
+            deleted = [key for key in to_delete if key not in errors]
+            delete_storage_objects(db, [key for key in deleted if key in ref_counts])
+            finish_storage_deletes(db, [key for key in keys if key not in errors], errors)
+            db.commit()
+        finally:
+            db.close()
+
+        total += len(deleted)
+        metrics.inc("ainote_storage_gc_deleted_total", len(deleted))
+        if errors:
+            metrics.inc("ainote_storage_gc_failed_total", len(errors))
+            key, error = next(iter(errors.items()))
+            print(f"⚠ Không thể xóa {len(errors)} object, ví dụ {key}: {error}")
+        # Không bỏ được key nào khỏi hàng đợi (storage lỗi): thử lại ở lần chạy sau
+        if len(errors) == len(keys) or len(keys) < batch_size:
+            break
+    if total:
+        print(f"✓ Đã xóa {total} object trên storage")
+
+
+def _is_managed_key(storage_key: str) -> bool:
+    """Key do ứng dụng tạo: ảnh gốc ở gốc bucket (<uuid | sha256>.<ext>) hoặc ảnh thu nhỏ trong derivatives/."""
+    return "/" not in storage_key or storage_key.startswith("derivatives/")
+
+
+def reconcile_storage_orphans(dry_run: bool = False) -> int:
+    """
+    Tìm object trong bucket không còn ghi chú nào tham chiếu (raw_image_url / image_derivatives)
+    và đưa vào hàng đợi xóa.
+
+    Object mới hơn STORAGE_ORPHAN_GRACE_HOURS bị bỏ qua (upload đang xử lý, presigned upload
+    chưa finalize). Pin trong storage_objects chỉ giữ object khi được cập nhật trong khoảng ân hạn;
+    pin cũ hơn có ref_count khác số ghi chú thực sự tham chiếu (tiến trình dừng giữa lúc pin và
+    commit ghi chú) được đặt lại theo số đó. Tập key được tham chiếu nạp trước khi liệt kê bucket,
+    nên ghi chú tạo trong lúc đối soát chỉ có thể trỏ tới object mới (nằm trong khoảng ân hạn).
+
+    Args:
+        dry_run: Chỉ đếm, không đặt lại pin và không đưa vào hàng đợi xóa
+
+    Returns:
+        Số object mồ côi
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=settings.STORAGE_ORPHAN_GRACE_HOURS)
+
+    db = SessionLocal()
+    try:
+        note_refs = Counter()
+        for raw_image_url, image_derivatives in iter_note_images(db):
+            note_refs.update(storage_service.note_storage_keys(raw_image_url, image_derivatives))
+        referenced = set(note_refs)
+        stale_pins = []
+        for key, ref_count, updated_at in iter_storage_pins(db):
+            if updated_at >= cutoff:
+                # Upload đang xử lý, ghi chú chưa commit
+                referenced.add(key)
+            elif ref_count != note_refs[key]:
+                stale_pins.append(key)
+    finally:
+        db.close()
+
+    reset = 0
+    if stale_pins and not dry_run:
+        for batch in (stale_pins[i:i + 1000] for i in range(0, len(stale_pins), 1000)):
+            db = SessionLocal()
+            try:
+                reset += sum(reset_storage_pin(db, key, note_refs[key], cutoff) for key in batch)
+                db.commit()
+            finally:
+                db.close()
+    if stale_pins:
+        action = "tìm thấy " if dry_run else f"đã đặt lại {reset}/"
+        print(f"⚠ Đối soát storage: {action}{len(stale_pins)} object có ref_count lệch so với ghi chú")
+
+    orphans = (
+        key
+        for key, last_modified in storage_service.iter_objects()
+        if last_modified < cutoff and _is_managed_key(key) and key not in referenced
+    )
+    total = 0
+    while batch := list(islice(orphans, 1000)):
+        total += len(batch)
+        if dry_run:
+            continue
+        db = SessionLocal()
+        try:
+            enqueue_storage_deletes(db, batch)
+            db.commit()
+        finally:
+            db.close()
+
+    metrics.inc("ainote_storage_orphans_total", total)
+    if total:
+        action = "tìm thấy" if dry_run else "đưa vào hàng đợi xóa"
+        print(f"ℹ Đối soát storage: {action} {total} object mồ côi ({len(referenced)} object đang được dùng)")
+    return total
+
+
+# Singleton instance
+job_runner = JobRunner()
+job_runner.register("qa_partitions", 6 * 3600, maintain_qa_partitions)
+job_runner.register("note_tombstones", 24 * 3600, purge_expired_tombstones)
+job_runner.register("refresh_tokens", 3600, purge_stale_refresh_tokens)
+job_runner.register("upload_claims", 3600, purge_expired_upload_claims)
+job_runner.register("storage_gc", 300, drain_storage_deletes)
+if settings.STORAGE_RECONCILE_ENABLED:
+    job_runner.register("storage_reconcile", 24 * 3600, reconcile_storage_orphans)
@@ -9,6 +9,14 @@ import httpx
 from app.core.config import settings
 from app.core.llm_providers import LLMProvider, APIClient, get_provider_and_config
 
+# Các entity_type mà prompt trích xuất yêu cầu model sử dụng
+ENTITY_TYPES = (
+    "work_tasks", "personal_tasks", "study_schedule", "shopping_list", "health_care",
+    "finance_records", "social_events", "travel_plans", "business_contacts",
+    "personal_contacts", "ideas_notes", "reminders", "receipts_bills",
+    "project_plans", "daily_routine",
+)
+
 ENTITY_EXTRACTION_PROMPT = (
     "Bạn là một trợ lý AI trích xuất thông tin có cấu trúc từ ghi chú hoặc tài liệu của người dùng.\n\n"
     "1. Xác định loại tài liệu theo lĩnh vực thực tế. Các loại có thể:\n"
@@ -1,128 +1,449 @@
 """
 Dịch vụ OCR để trích xuất văn bản từ hình ảnh.
 """
+import asyncio
 import base64
-from typing import Optional, Tuple
+import difflib
+import hashlib
+import time
+from typing import List, Optional, Tuple
+from uuid import UUID
 import httpx
 
 from app.core.config import settings
+from app.core.database import SessionLocal
 from app.core.llm_providers import LLMProvider, APIClient, get_provider_and_config
+from app.core.metrics import metrics
+from app.crud.ocr_cache import find_similar_ocr_cache, get_ocr_cache, save_ocr_cache
+from app.services.image import image_service
+from app.services.tesseract import LocalOCRResult, tesseract_service
+
+
+metrics.describe("ainote_ocr_payload_bytes", "Kích thước ảnh OCR: gốc (original) và thực gửi (sent)")
+metrics.describe("ainote_ocr_seconds", "Thời gian gọi model vision cho OCR (giây)")
+metrics.describe("ainote_ocr_local_seconds", "Thời gian OCR cục bộ bằng Tesseract (giây)")
+metrics.describe("ainote_ocr_engine_total", "Số ảnh OCR theo engine cho kết quả cuối (tesseract/llm)")
+metrics.describe("ainote_ocr_escalations_total", "Số ảnh chuyển từ Tesseract sang model vision theo lý do")
+metrics.describe(
+    "ainote_ocr_latency_saved_seconds_total",
+    "Thời gian ước tính tiết kiệm được khi không phải gọi model vision (giây)",
+)
+metrics.describe("ainote_ocr_tiled_total", "Số ảnh được OCR theo tile")
+metrics.describe("ainote_ocr_cache_requests_total", "Tra cứu cache OCR theo kết quả (exact/perceptual/miss)")
+
+
+OCR_PROMPT = (
+    "Bạn là một công cụ OCR chuyên nghiệp, cực kỳ giỏi nhận diện cấu trúc. "
+    "Nhiệm vụ của bạn: Trích xuất TOÀN BỘ văn bản có trong hình ảnh một cách CHÍNH XÁC NHẤT, "
+    "giữ nguyên hoàn toàn định dạng và cấu trúc như trong ảnh.\n\n"
+
+    "Yêu cầu cụ thể:\n"
+    "- Giữ nguyên ngắt dòng, khoảng trắng, dấu câu, dấu tiếng Việt (ă, â, ê, ô, ơ, ư, đ...)\n"
+    "- Nếu có bảng (table), hãy xuất đúng dạng bảng bằng markdown, giữ nguyên các cột thẳng hàng, "
+    "không gộp ô, không bỏ dòng trống trong bảng\n"
+    "- Nếu có form, hóa đơn, biên lai: giữ nguyên thứ tự từ trên xuống dưới, từ trái sang phải\n"
+    "- Không thêm bất kỳ từ nào của bạn\n"
+    "- Không dịch, không tóm tắt, không giải thích, không đánh số\n"
+    "- Không bỏ bất kỳ chữ nào dù nhỏ, mờ hay bị cắt\n"
+    "- Chỉ trả về văn bản đã trích xuất (không có ngoặc, không có dấu đầu dòng thừa)\n\n"
+
+    "Ví dụ nếu ảnh có bảng:\n"
+    "| Tên sản phẩm     | Số lượng | Đơn giá   | Thành tiền |\n"
+    "|------------------|----------|-----------|------------|\n"
+    "| Gạo tám thơm     | 2        | 25.000    | 50.000     |\n"
+    "thì bạn phải xuất y hệt như vậy."
+)
+
+# Tăng khi đổi prompt OCR để không dùng lại kết quả cache cũ
+OCR_PROMPT_VERSION = "v1"
+
+
+def merge_tile_texts(texts: List[Optional[str]], max_overlap_lines: int = 12) -> str:
+    """
+    Ghép văn bản OCR của các tile theo thứ tự đọc, bỏ phần trùng ở vùng chồng lấn.
+
+    Với mỗi cặp tile kề nhau, tìm số dòng k lớn nhất sao cho k dòng cuối của tile trước
+    gần giống k dòng đầu của tile sau (so khớp mờ vì dòng ở đường cắt có thể bị đọc thiếu),
+    rồi chỉ giữ một bản của k dòng đó.
+    """
+    def normalize(line: str) -> str:
+        return " ".join(line.split()).lower()
+
+    def similar(a: str, b: str) -> bool:
+        a, b = normalize(a), normalize(b)
+        if a == b:
+            return True
+        if not a or not b:
+            return False
+        # Dòng ở đường cắt thường chỉ đọc được một phần ở một trong hai tile
+        shorter, longer = sorted((a, b), key=len)
+        if shorter in longer and len(shorter) >= len(longer) / 2:
+            return True
+        return difflib.SequenceMatcher(None, a, b).ratio() >= 0.8
+
+    merged: List[str] = []
+    for text in texts:
+        if not text:
+            continue
+        lines = text.strip("\n").splitlines()
+        overlap = 0
+        for k in range(min(max_overlap_lines, len(merged), len(lines)), 0, -1):
+            if all(similar(x, y) for x, y in zip(merged[-k:], lines[:k])):
+                overlap = k
+                break
+        # Trong vùng chồng lấn giữ bản đọc đầy đủ hơn của mỗi dòng
+        for offset in range(overlap):
+            index = len(merged) - overlap + offset
+            if len(lines[offset]) > len(merged[index]):
+                merged[index] = lines[offset]
+        merged.extend(lines[overlap:])
+    return "\n".join(merged)
 
 
 class OCRService:
     """Dịch vụ trích xuất văn bản OCR từ hình ảnh."""
+
+    def __init__(self):
+        # Giới hạn số request OCR đồng thời tới provider (cả ảnh nguyên và từng tile)
+        self._semaphore = asyncio.Semaphore(settings.OCR_MAX_CONCURRENCY)
+        # Thời gian OCR bằng model vision trung bình (trượt) - để ước tính thời gian tiết kiệm
+        self._llm_seconds_avg: Optional[float] = None
     
     @staticmethod
     def encode_image(image_data: bytes) -> str:
         """Mã hóa dữ liệu hình ảnh sang base64."""
         return base64.b64encode(image_data).decode('utf-8')
 
-    @staticmethod
-    async def extract_text(
-        image_data: bytes, 
-        lang: str = 'vie+eng'
-    ) -> Tuple[Optional[str], Optional[float]]:
+    async def _call_provider(self, image_data: bytes, image_mime: str) -> Optional[str]:
         """
-        Trích xuất văn bản từ hình ảnh bằng model vision.
-        
-        Args:
-            image_data: Dữ liệu hình ảnh nhị phân
-            lang: Mã ngôn ngữ (không được sử dụng với một số provider nhưng giữ lại để tương thích)
-            
+        Gửi một ảnh cho model vision đã cấu hình (API_EXTRACT_NAME).
+
         Returns:
-            Tuple của (extracted_text, confidence_score)
+            Văn bản trích xuất, None nếu provider chưa được cấu hình hoặc không trả về gì
         """
-        try:
-            image_base64 = OCRService.encode_image(image_data)
-            
-            ocr_prompt = (
-                "Bạn là một công cụ OCR chuyên nghiệp, cực kỳ giỏi nhận diện cấu trúc. "
-                "Nhiệm vụ của bạn: Trích xuất TOÀN BỘ văn bản có trong hình ảnh một cách CHÍNH XÁC NHẤT, "
-                "giữ nguyên hoàn toàn định dạng và cấu trúc như trong ảnh.\n\n"
-
-                "Yêu cầu cụ thể:\n"
-                "- Giữ nguyên ngắt dòng, khoảng trắng, dấu câu, dấu tiếng Việt (ă, â, ê, ô, ơ, ư, đ...)\n"
-                "- Nếu có bảng (table), hãy xuất đúng dạng bảng bằng markdown, giữ nguyên các cột thẳng hàng, "
-                "không gộp ô, không bỏ dòng trống trong bảng\n"
-                "- Nếu có form, hóa đơn, biên lai: giữ nguyên thứ tự từ trên xuống dưới, từ trái sang phải\n"
-                "- Không thêm bất kỳ từ nào của bạn\n"
-                "- Không dịch, không tóm tắt, không giải thích, không đánh số\n"
-                "- Không bỏ bất kỳ chữ nào dù nhỏ, mờ hay bị cắt\n"
-                "- Chỉ trả về văn bản đã trích xuất (không có ngoặc, không có dấu đầu dòng thừa)\n\n"
-
-                "Ví dụ nếu ảnh có bảng:\n"
-                "| Tên sản phẩm     | Số lượng | Đơn giá   | Thành tiền |\n"
-                "|------------------|----------|-----------|------------|\n"
-                "| Gạo tám thơm     | 2        | 25.000    | 50.000     |\n"
-                "thì bạn phải xuất y hệt như vậy."
-            )
-            
-            provider, config = get_provider_and_config(settings.API_EXTRACT_NAME, is_chat=False)
-            
-            print(f"ℹ Đang gửi yêu cầu OCR với provider={settings.API_EXTRACT_NAME or 'LOCAL'}")
-            
+        image_base64 = OCRService.encode_image(image_data)
+        provider, config = get_provider_and_config(settings.API_EXTRACT_NAME, is_chat=False)
+
+        async with self._semaphore:
+            started = time.perf_counter()
             text = None
-            
+
             if provider == LLMProvider.LOCAL:
                 if not config.get("base_url") or not config.get("model"):
                     print("⚠ OCR chưa được cấu hình - thiếu API_EXTRACT_TEXT hoặc MODEL_EXTRACT_TEXT")
-                    return None, None
-                
+                    return None
+            
                 text = await APIClient.call_ollama(
                     base_url=config["base_url"],
                     model=config["model"],
-                    prompt=ocr_prompt,
+                    prompt=OCR_PROMPT,
                     image_base64=image_base64
                 )
-            
+        
             elif provider == LLMProvider.GPT:
                 if not config.get("api_key"):
                     print("⚠ Thiếu OPENAI_API_KEY")
-                    return None, None
-                
+                    return None
+            
                 text = await APIClient.call_openai(
                     api_key=config["api_key"],
                     model=config.get("model", "gpt-4o-mini"),
-                    prompt=ocr_prompt,
-                    image_base64=image_base64
+                    prompt=OCR_PROMPT,
+                    image_base64=image_base64,
+                    image_mime=image_mime
                 )
-            
+        
             elif provider == LLMProvider.GEMINI:
                 if not config.get("api_key"):
                     print("⚠ Thiếu GEMINI_API_KEY")
-                    return None, None
-                
+                    return None
+            
                 text = await APIClient.call_gemini(
                     api_key=config["api_key"],
                     model=config.get("model", "gemini-1.5-flash"),
-                    prompt=ocr_prompt,
-                    image_base64=image_base64
+                    prompt=OCR_PROMPT,
+                    image_base64=image_base64,
+                    image_mime=image_mime
                 )
-            
+        
             elif provider == LLMProvider.CLAUDE:
                 if not config.get("api_key"):
                     print("⚠ Thiếu ANTHROPIC_API_KEY")
-                    return None, None
-                
+                    return None
+            
                 text = await APIClient.call_claude(
                     api_key=config["api_key"],
                     model=config.get("model", "claude-3-5-sonnet-20241022"),
-                    prompt=ocr_prompt,
-                    image_base64=image_base64
+                    prompt=OCR_PROMPT,
+                    image_base64=image_base64,
+                    image_mime=image_mime
                 )
-            
+        
             else:
                 print(f"⚠ Provider {provider} không hỗ trợ OCR/Vision")
-                return None, None
-            
-            if not text:
-                return None, None
+                return None
+
+            metrics.observe(
+                "ainote_ocr_seconds",
+                time.perf_counter() - started,
+                provider=str(settings.API_EXTRACT_NAME or 'LOCAL'),
+                preprocessed=str(settings.OCR_PREPROCESS_ENABLED).lower(),
+            )
+        return text
+
+    async def _extract_tiles(self, tiles: List[Tuple[bytes, str]]) -> Optional[str]:
+        """OCR các tile song song (trong giới hạn OCR_MAX_CONCURRENCY) rồi ghép theo thứ tự đọc."""
+        results = await asyncio.gather(
+            *(self._call_provider(data, mime) for data, mime in tiles),
+            return_exceptions=True,
+        )
+        texts = []
+        for index, result in enumerate(results, 1):
+            if isinstance(result, BaseException) or not result:
+                print(f"⚠ OCR tile {index}/{len(tiles)} thất bại: {result}")
+                texts.append(None)
+            else:
+                texts.append(result)
+        return merge_tile_texts(texts) or None
+
+    @staticmethod
+    def _escalation_reason(result: LocalOCRResult) -> Optional[str]:
+        """
+        Lý do cần gửi ảnh cho model vision, None nếu kết quả Tesseract đủ tốt.
+
+        - few_words: gần như không đọc được chữ (ảnh chụp, chữ viết tay, chữ trên nền phức tạp)
+        - low_confidence: độ tin cậy trung bình thấp
+        - low_confidence_words: nhiều từ riêng lẻ có độ tin cậy thấp (ảnh mờ, một phần bị lỗi)
+        - layout: bảng / nhiều cột - model vision giữ được cấu trúc (markdown), Tesseract thì không
+        """
+        if len(result.words) < settings.OCR_LOCAL_MIN_WORDS:
+            return "few_words"
+        if result.mean_confidence < settings.OCR_LOCAL_MIN_CONFIDENCE:
+            return "low_confidence"
+        if result.low_confidence_ratio(settings.OCR_LOCAL_WORD_CONFIDENCE) > settings.OCR_LOCAL_MAX_LOW_CONF_RATIO:
+            return "low_confidence_words"
+        if result.column_line_ratio() > settings.OCR_LOCAL_MAX_COLUMN_LINE_RATIO:
+            return "layout"
+        return None
+
+    async def _extract_local(self, image_data: bytes, lang: str) -> Tuple[Optional[LocalOCRResult], float]:
+        """OCR bằng Tesseract; trả về (kết quả hoặc None nếu lỗi, thời gian chạy)."""
+        started = time.perf_counter()
+        try:
+            prepared = await image_service.prepare_for_tesseract_async(image_data)
+            result = await tesseract_service.recognize(prepared, lang=lang)
+        except Exception as e:
+            print(f"⚠ OCR cục bộ thất bại: {e}")
+            result = None
+        elapsed = time.perf_counter() - started
+        metrics.observe("ainote_ocr_local_seconds", elapsed)
+        return result, elapsed
+
+    async def _extract_with_llm(self, image_data: bytes) -> Optional[str]:
+        """
+        Trích xuất văn bản bằng model vision.
+
+        Ảnh cao hơn OCR_TILE_THRESHOLD được cắt thành tile chồng lấn và OCR song song.
+        """
+        started = time.perf_counter()
+        original_size = len(image_data)
+        print(f"ℹ Đang gửi yêu cầu OCR với provider={settings.API_EXTRACT_NAME or 'LOCAL'}")
+
+        tiles = []
+        if settings.OCR_TILING_ENABLED:
+            tiles = await image_service.split_for_ocr_async(image_data)
+
+        if tiles:
+            print(f"ℹ OCR theo {len(tiles)} tile")
+            metrics.inc("ainote_ocr_tiled_total")
+            metrics.observe("ainote_ocr_payload_bytes", original_size, stage="original")
+            metrics.observe("ainote_ocr_payload_bytes", sum(len(data) for data, _ in tiles), stage="sent")
+            text = await self._extract_tiles(tiles)
+        else:
+            if settings.OCR_PREPROCESS_ENABLED:
+                image_data, image_mime = await image_service.preprocess_for_ocr_async(image_data)
+            else:
+                image_mime = image_service.detect_mime(image_data)
+            metrics.observe("ainote_ocr_payload_bytes", original_size, stage="original")
+            metrics.observe("ainote_ocr_payload_bytes", len(image_data), stage="sent")
+            text = await self._call_provider(image_data, image_mime)
+
+        if text:
+            elapsed = time.perf_counter() - started
+            previous = self._llm_seconds_avg
+            self._llm_seconds_avg = elapsed if previous is None else 0.9 * previous + 0.1 * elapsed
+        return text
+
+    async def extract_text(
+        self,
+        image_data: bytes, 
+        lang: str = 'vie+eng'
+    ) -> Tuple[Optional[str], Optional[float], bool]:
+        """
+        Trích xuất văn bản từ hình ảnh: Tesseract trước, model vision khi kết quả cục bộ kém.
+
+        Khi OCR_LOCAL_ENABLED và có lệnh tesseract, ảnh được OCR cục bộ với gói ngôn ngữ `lang`;
+        chỉ khi _escalation_reason báo kết quả kém mới gọi model vision. Nếu model vision
+        không trả về gì thì dùng lại kết quả Tesseract (nếu có) nhưng đánh dấu chưa được chấp nhận.
+        
+        Args:
+            image_data: Dữ liệu hình ảnh nhị phân
+            lang: Gói ngôn ngữ Tesseract (model vision tự nhận diện ngôn ngữ)
             
-            return text, 85.0
+        Returns:
+            Tuple của (extracted_text, confidence_score, accepted) - độ tin cậy (0-100) là trung bình
+            từng từ của Tesseract; None khi văn bản đến từ model vision (không có độ tin cậy).
+            accepted=False khi văn bản là kết quả Tesseract đã bị đánh giá kém (model vision lỗi) -
+            dùng được cho ghi chú nhưng không được lưu cache
+        """
+        try:
+            local = None
+            if settings.OCR_LOCAL_ENABLED and tesseract_service.available:
+                local, local_seconds = await self._extract_local(image_data, lang)
+                reason = self._escalation_reason(local) if local else "error"
+                if reason is None:
+                    metrics.inc("ainote_ocr_engine_total", engine="tesseract")
+                    if self._llm_seconds_avg is not None:
+                        metrics.inc(
+                            "ainote_ocr_latency_saved_seconds_total",
+                            max(self._llm_seconds_avg - local_seconds, 0.0),
+                        )
+                    print(f"✓ OCR cục bộ (độ tin cậy {local.mean_confidence:.1f})")
+                    return local.text, round(local.mean_confidence, 1), True
+                print(f"ℹ Chuyển OCR sang model vision (lý do: {reason})")
+                metrics.inc("ainote_ocr_escalations_total", reason=reason)
+
+            text = await self._extract_with_llm(image_data)
+            if text:
+                metrics.inc("ainote_ocr_engine_total", engine="llm")
+                return text, None, True
+
+            if local and local.text:
+                metrics.inc("ainote_ocr_engine_total", engine="tesseract")
+                return local.text, round(local.mean_confidence, 1), False
+            return None, None, False
 
         except Exception as e:
             print(f"❌ Lỗi OCR: {str(e)}")
+            return None, None, False
+
+    @staticmethod
+    def cache_identity() -> Tuple[str, str]:
+        """(provider, model) OCR hiện tại - một phần của khóa cache."""
+        provider, config = get_provider_and_config(settings.API_EXTRACT_NAME, is_chat=False)
+        provider_name = str(settings.API_EXTRACT_NAME or 'LOCAL')
+        if settings.OCR_LOCAL_ENABLED:
+            # Kết quả có thể đến từ Tesseract - không dùng chung cache với cấu hình chỉ model vision
+            provider_name = f"tesseract+{provider_name}"
+        return provider_name, str(config.get("model") or "")
+
+    @staticmethod
+    def _cache_lookup(
+        content_sha256: str,
+        user_id: UUID,
+        dhash: Optional[int],
+        provider: str,
+        model: str,
+    ) -> Tuple[Optional[str], Optional[Tuple[str, Optional[float]]]]:
+        """
+        Tra cache trong phiên riêng (đóng ngay): không giữ transaction của request.
+
+        Returns:
+            (loại hit "exact" / "perceptual" / None, (text, confidence) nếu hit)
+        """
+        db = SessionLocal()
+        try:
+            cached = get_ocr_cache(db, content_sha256, provider, model, OCR_PROMPT_VERSION)
+            if cached:
+                return "exact", (cached.text, cached.confidence)
+            if dhash is not None:
+                similar = find_similar_ocr_cache(
+                    db, user_id, dhash, provider, model, OCR_PROMPT_VERSION,
+                    max_distance=settings.OCR_CACHE_MAX_HAMMING,
+                )
+                if similar:
+                    return "perceptual", (similar.text, similar.confidence)
             return None, None
+        finally:
+            db.close()
+
+    @staticmethod
+    def _cache_save(
+        content_sha256: str,
+        provider: str,
+        model: str,
+        text: str,
+        confidence: Optional[float],
+        user_id: UUID,
+        dhash: Optional[int],
+    ):
+        """Lưu cache trong transaction riêng, commit ngay (không giữ khóa unique tới hết request)."""
+        db = SessionLocal()
+        try:
+            save_ocr_cache(
+                db, content_sha256, provider, model, OCR_PROMPT_VERSION,
+                text=text, confidence=confidence,
+                user_id=user_id, dhash=dhash,
+            )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"⚠ Không thể lưu cache OCR: {e}")
+        finally:
+            db.close()
+
+    async def extract_text_cached(
+        self,
+        user_id: UUID,
+        image_data: bytes,
+        lang: str = 'vie+eng'
+    ) -> Tuple[Optional[str], Optional[float]]:
+        """
+        Trích xuất văn bản, dùng lại kết quả cache nếu có.
+
+        Thứ tự: SHA-256 của ảnh gốc (mọi user) -> dHash gần giống trong ảnh của user
+        (OCR_CACHE_MAX_HAMMING) -> gọi provider và lưu kết quả được chấp nhận. Tra cứu và ghi cache dùng
+        phiên database riêng trong thread, commit ngay - không dùng Session của request.
+
+        Args:
+            user_id: ID người dùng
+            image_data: Dữ liệu hình ảnh gốc
+            lang: Mã ngôn ngữ
+
+        Returns:
+            Tuple của (extracted_text, confidence_score)
+        """
+        if not settings.OCR_CACHE_ENABLED:
+            text, confidence, _accepted = await self.extract_text(image_data, lang=lang)
+            return text, confidence
+
+        provider, model = self.cache_identity()
+        content_sha256 = hashlib.sha256(image_data).hexdigest()
+        dhash = None
+        if settings.OCR_CACHE_PERCEPTUAL:
+            dhash = await image_service.dhash_async(image_data)
+
+        hit, cached = await asyncio.to_thread(
+            self._cache_lookup, content_sha256, user_id, dhash, provider, model
+        )
+        if hit:
+            metrics.inc("ainote_ocr_cache_requests_total", result=hit)
+            print(f"✓ OCR cache hit ({'SHA-256' if hit == 'exact' else 'dHash'})")
+            text, confidence = cached
+            if hit == "perceptual":
+                await asyncio.to_thread(
+                    self._cache_save, content_sha256, provider, model, text, confidence, user_id, dhash
+                )
+            return text, confidence
+
+        metrics.inc("ainote_ocr_cache_requests_total", result="miss")
+        text, confidence, accepted = await self.extract_text(image_data, lang=lang)
+        # Khóa SHA-256 dùng chung mọi user: không ghim kết quả dự phòng khi model vision lỗi
+        if text and accepted:
+            await asyncio.to_thread(
+                self._cache_save, content_sha256, provider, model, text, confidence, user_id, dhash
+            )
+        return text, confidence
 
 
 # Instance singleton
@@ -0,0 +1,105 @@
+"""
+Bộ chạy pipeline dạng DAG nhỏ cho các bước xử lý bất đồng bộ.
+
+Mỗi stage chạy ngay khi các stage phụ thuộc hoàn tất, các nhánh độc lập chạy song song.
+Lỗi ở một stage chỉ làm bỏ qua các stage phụ thuộc vào nó, không hủy nhánh khác.
+"""
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Sequence
+
+
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+STATUS_SKIPPED = "skipped"
+
+
+@dataclass
+class Stage:
+    """
+    Một bước trong pipeline.
+
+    `func` nhận kết quả của các stage trong `deps` dưới dạng keyword argument (theo tên stage).
+    """
+    name: str
+    func: Callable[..., Awaitable[Any]]
+    deps: Sequence[str] = ()
+
+
+class StageSkipped(Exception):
+    """Stage không chạy vì một stage phụ thuộc bị lỗi."""
+
+
+@dataclass
+class PipelineResult:
+    """Kết quả, lỗi và thời gian của từng stage."""
+    results: Dict[str, Any] = field(default_factory=dict)
+    errors: Dict[str, BaseException] = field(default_factory=dict)
+    timings_ms: Dict[str, float] = field(default_factory=dict)
+    total_ms: float = 0.0
+
+    def get(self, name: str, default: Any = None) -> Any:
+        """Kết quả của stage, `default` nếu stage lỗi hoặc bị bỏ qua."""
+        return self.results.get(name, default)
+
+    def status(self, name: str) -> str:
+        error = self.errors.get(name)
+        if error is None:
+            return STATUS_OK
+        return STATUS_SKIPPED if isinstance(error, StageSkipped) else STATUS_ERROR
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê dạng JSON (lưu vào note_items.processing_stats)."""
+        return {
+            "total_ms": round(self.total_ms, 1),
+            "stages": {
+                name: {"status": self.status(name), "ms": round(ms, 1)}
+                for name, ms in self.timings_ms.items()
+            },
+        }
+
+
+class Pipeline:
+    """Đồ thị các stage, chạy với mức song song tối đa."""
+
+    def __init__(self, stages: Sequence[Stage]):
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"Stage {stage.name} phụ thuộc stage không tồn tại: {dep}")
+
+    async def run(self) -> PipelineResult:
+        """Chạy toàn bộ pipeline; không raise lỗi của stage (xem PipelineResult.errors)."""
+        result = PipelineResult()
+        tasks: Dict[str, asyncio.Task] = {}
+        started = time.perf_counter()
+
+        async def run_stage(stage: Stage):
+            kwargs = {}
+            for dep in stage.deps:
+                try:
+                    kwargs[dep] = await tasks[dep]
+                except BaseException:
+                    error = StageSkipped(f"{dep} thất bại")
+                    result.errors[stage.name] = error
+                    result.timings_ms[stage.name] = 0.0
+                    raise error
+            stage_started = time.perf_counter()
+            try:
+                value = await stage.func(**kwargs)
+            except Exception as e:
+                result.errors[stage.name] = e
+                raise
+            finally:
+                result.timings_ms[stage.name] = (time.perf_counter() - stage_started) * 1000
+            result.results[stage.name] = value
+            return value
+
+        for stage in self.stages.values():
+            tasks[stage.name] = asyncio.create_task(run_stage(stage))
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+        result.total_ms = (time.perf_counter() - started) * 1000
+        return result
@@ -1,79 +1,455 @@
 """
 Dịch vụ Smart Retrieval cho tìm kiếm ghi chú thông minh với RAG.
 """
+import json
+import math
+import re
 import uuid
 from typing import List, Dict, Any, Tuple
 from sqlalchemy.orm import Session
-from sqlalchemy import text, func
+from sqlalchemy import text, func, select, column, Float
 import asyncio
 
+from app.core.config import settings
+from app.core.fts import TSQUERY_SQL, tsquery_params
+from app.core.utils import escape_like
 from app.models import NoteItem
 from app.services.embedding import embedding_service
+from app.services.llm import ENTITY_TYPES
+
+
+# Trọng số (fts, vector, entity) cho từng loại câu hỏi
+FUSION_WEIGHTS: Dict[str, Tuple[float, float, float]] = {
+    "keyword": (0.6, 0.3, 0.1),
+    "semantic": (0.2, 0.6, 0.2),
+    "structured": (0.3, 0.2, 0.5),
+    "hybrid": (0.4, 0.4, 0.2),
+}
+
+STOP_WORDS = {'của', 'là', 'có', 'và', 'trong', 'với', 'được', 'này', 'đó', 'các'}
+FTS_STOP_WORDS = STOP_WORDS | {'cho', 'về'}
+IMPORTANT_ENTITY_WORDS = ['điện', 'thoại', 'số', 'địa', 'chỉ', 'email', 'tên', 'giá']
+
+PHONE_QUESTION_MARKERS = ('điện thoại', 'sdt', 'phone')
+
+# Các cột nặng/nội bộ không bao giờ được trả về client - không nạp trong truy vấn hybrid
+_HEAVY_NOTE_COLUMNS = {
+    "embedding", "tsv_content", "search_text", "entities_text",
+    "entity_phones", "entity_emails", "entity_prices",
+}
+
+_PHONE_RE = re.compile(r"\+?\d[\d .-]{7,}\d")
+_EMAIL_RE = re.compile(r"[a-z0-9._%+-]+@[a-z0-9.-]+\.[a-z]{2,}")
+_PRICE_RE = re.compile(r"(\d{1,3}(?:[.,]\d{3})+|\d+)\s*(k|đ|₫|vnd|vnđ|đồng)?")
+
+# Điểm entity cho các note ứng viên. Bộ lọc {entity_filter} chỉ dùng các toán tử có index
+# (LIKE trên trigram entities_text, @> jsonb_path_ops, && trên cột giá trị chuẩn hóa),
+# nên chỉ các note ứng viên được đọc và chấm điểm.
+ENTITY_SCORES_SQL = """
+    SELECT n.id,
+        (CASE
+            WHEN coalesce(n.entities->>'entity_type', '') <> ''
+                AND strpos(:question_lower, lower(n.entities->>'entity_type')) > 0
+            THEN 0.3 ELSE 0
+        END)
+        + LEAST(0.7 * m.matches / GREATEST(:word_count, 1), 0.7)
+        + (CASE
+            WHEN :phone_question
+                AND (cardinality(n.entity_phones) > 0 OR strpos(n.entities_text, 'phone') > 0)
+            THEN 0.4 ELSE 0
+        END)
+        + (CASE
+            WHEN n.entity_phones && CAST(:phones AS text[])
+                OR n.entity_emails && CAST(:emails AS text[])
+                OR n.entity_prices && CAST(:prices AS numeric[])
+            THEN 0.5 ELSE 0
+        END)
+        + (CASE
+            WHEN jsonb_typeof(n.entities->'data') = 'object' THEN
+                CASE WHEN (SELECT count(*) FROM jsonb_object_keys(n.entities->'data')) > 3
+                     THEN 0.1 ELSE 0 END
+            ELSE 0
+        END) AS score
+    FROM note_items n
+    CROSS JOIN LATERAL (
+        SELECT coalesce(sum(CASE WHEN w = ANY(CAST(:important_words AS text[])) THEN 1.5 ELSE 1 END), 0) AS matches
+        FROM unnest(CAST(:entity_words AS text[])) AS w
+        WHERE strpos(n.entities_text, w) > 0
+    ) m
+    WHERE n.user_id = :user_id
+        AND n.is_archived = false
+        AND n.entities IS NOT NULL
+        AND ({entity_filter})
+"""
+
+# Điểm từng tín hiệu + điểm cuối cùng trả về từ truy vấn hybrid
+_SIGNAL_COLUMNS = (
+    column("fts_score", Float),
+    column("vector_score", Float),
+    column("entity_score", Float),
+    column("final_score", Float),
+)
+
+# Một truy vấn duy nhất: mỗi tín hiệu là một CTE, fusion + rerank ngay trong PostgreSQL,
+# chỉ top-k note cuối cùng được JOIN lại để nạp nội dung.
+HYBRID_RETRIEVAL_SQL = """
+WITH fts_hits AS (
+    SELECT n.id, ts_rank(n.tsv_content, q.query) AS score
+    FROM note_items n, (SELECT {tsquery} AS query) AS q
+    WHERE n.user_id = :user_id
+        AND n.is_archived = false
+        AND :fts_prefix <> ''
+        AND n.tsv_content @@ q.query
+    ORDER BY score DESC
+    LIMIT :pool
+),
+fts_fallback AS (
+    SELECT n.id,
+        0.5 * GREATEST(
+            word_similarity(:fallback_word, n.search_text),
+            CASE WHEN n.search_text LIKE :fallback_pattern THEN 1 ELSE 0 END
+        )::float8 AS score
+    FROM note_items n
+    WHERE n.user_id = :user_id
+        AND n.is_archived = false
+        AND :fallback_word <> ''
+        AND NOT EXISTS (SELECT 1 FROM fts_hits)
+        AND (
+            n.search_text LIKE :fallback_pattern
+            OR :fallback_word <% n.search_text
+        )
+    ORDER BY score DESC, n.updated_at DESC
+    LIMIT :pool
+),
+fts AS (
+    SELECT id, score, row_number() OVER (ORDER BY score DESC) AS rnk
+    FROM (SELECT id, score FROM fts_hits UNION ALL SELECT id, score FROM fts_fallback) s
+),
+ent_scores AS (
+{entity_scores}
+),
+ent AS (
+    SELECT id, score, row_number() OVER (ORDER BY score DESC) AS rnk
+    FROM (SELECT id, score FROM ent_scores WHERE score > 0 ORDER BY score DESC LIMIT :pool) s
+),
+vec_candidates AS (
+    -- Chấm điểm vector (O(số note x số chiều) trên JSONB) chỉ trong tập ứng viên: các note sửa
+    -- gần nhất + note đã khớp FTS / entity. Tìm ngữ nghĩa trên toàn bộ note cần pgvector + ANN index.
+    SELECT id FROM (
+        SELECT n.id FROM note_items n
+        WHERE n.user_id = :user_id
+            AND n.is_archived = false
+            AND n.embedding IS NOT NULL
+        ORDER BY n.updated_at DESC
+        LIMIT :vector_candidates
+    ) recent
+    UNION
+    SELECT id FROM fts
+    UNION
+    SELECT id FROM ent
+),
+vec_scores AS (
+    SELECT n.id,
+        CASE
+            WHEN :query_is_vector THEN
+                CASE
+                    WHEN n.embedding->>'type' = 'api_vector'
+                        AND jsonb_typeof(n.embedding->'vector') = 'array'
+                        AND jsonb_array_length(n.embedding->'vector') = :query_dim
+                    THEN (
+                        SELECT coalesce(
+                            sum(nv.x::float8 * qv.x)
+                                / NULLIF(sqrt(sum(nv.x::float8 * nv.x::float8)) * :query_norm, 0),
+                            0
+                        )
+                        FROM jsonb_array_elements_text(n.embedding->'vector') WITH ORDINALITY AS nv(x, i)
+                        JOIN unnest(CAST(:query_vector AS float8[])) WITH ORDINALITY AS qv(x, i)
+                            ON qv.i = nv.i
+                    )
+                    ELSE 0
+                END
+            WHEN jsonb_typeof(n.embedding->'keywords') = 'array' THEN (
+                SELECT CASE
+                    WHEN count(*) = 0 THEN 0
+                    ELSE count(*) FILTER (WHERE kw.k = ANY(CAST(:query_keywords AS text[])))::float8
+                        / (count(*) + cardinality(CAST(:query_keywords AS text[]))
+                           - count(*) FILTER (WHERE kw.k = ANY(CAST(:query_keywords AS text[]))))
+                END
+                FROM (SELECT DISTINCT k FROM jsonb_array_elements_text(n.embedding->'keywords') AS k) kw
+            )
+            ELSE 0
+        END AS score
+    FROM vec_candidates c
+    JOIN note_items n ON n.id = c.id
+    WHERE n.embedding IS NOT NULL
+),
+vec AS (
+    SELECT id, score, row_number() OVER (ORDER BY score DESC) AS rnk
+    FROM (SELECT id, score FROM vec_scores WHERE score > 0 ORDER BY score DESC LIMIT :pool) s
+),
+fused AS (
+    SELECT
+        coalesce(fts.id, vec.id, ent.id) AS id,
+        fts.score AS fts_score,
+        vec.score AS vector_score,
+        ent.score AS entity_score,
+        CASE WHEN :fusion = 'rrf' THEN
+            coalesce(:w_fts / (:rrf_k + fts.rnk), 0)
+            + coalesce(:w_vec / (:rrf_k + vec.rnk), 0)
+            + coalesce(:w_ent / (:rrf_k + ent.rnk), 0)
+        ELSE
+            coalesce(:w_fts * fts.score, 0)
+            + coalesce(:w_vec * vec.score, 0)
+            + coalesce(:w_ent * ent.score, 0)
+        END AS score
+    FROM fts
+    FULL OUTER JOIN vec ON vec.id = fts.id
+    FULL OUTER JOIN ent ON ent.id = coalesce(fts.id, vec.id)
+),
+top AS (
+    SELECT * FROM fused ORDER BY score DESC LIMIT :rerank_pool
+)
+SELECT {note_columns},
+    top.fts_score,
+    top.vector_score,
+    top.entity_score,
+    top.score
+        * (CASE
+            WHEN n.title IS NOT NULL AND EXISTS (
+                SELECT 1 FROM unnest(CAST(:question_words AS text[])) AS w
+                WHERE strpos(lower(n.title), w) > 0
+            ) THEN 1.2 ELSE 1
+        END)
+        * (CASE WHEN now() - n.updated_at < interval '7 days' THEN 1.1 ELSE 1 END)
+        * (CASE
+            WHEN jsonb_typeof(n.entities->'data') = 'object' THEN
+                CASE WHEN (SELECT count(*) FROM jsonb_object_keys(n.entities->'data')) > 5
+                     THEN 1.05 ELSE 1 END
+            ELSE 1
+        END) AS final_score
+FROM top
+JOIN note_items n ON n.id = top.id
+ORDER BY final_score DESC
+LIMIT :limit
+"""
 
 
 class SmartRetrieval:
     """Dịch vụ retrieval thông minh - kết hợp nhiều phương pháp tìm kiếm."""
-    
+
     def __init__(self, db: Session):
         self.db = db
-    
+
     async def retrieve_relevant_notes(
-        self, 
-        question: str, 
+        self,
+        question: str,
         user_id: uuid.UUID,
         limit: int = 10
     ) -> List[Tuple[NoteItem, float]]:
         """
         Retrieval thông minh - kết hợp FTS, vector similarity và entity matching.
-        
+
         Args:
             question: Câu hỏi của người dùng
             user_id: ID người dùng
             limit: Số lượng kết quả tối đa
-            
+
         Returns:
             Danh sách tuple (NoteItem, score) được sắp xếp theo độ liên quan
         """
+        if settings.RETRIEVAL_MODE == "sql":
+            hits = await self.hybrid_sql_retrieval(question, user_id, limit)
+            return [(note, score) for note, score, _ in hits]
+
         # Phân tích loại câu hỏi
         query_type = self.analyze_query_type(question)
-        
+
         # Khởi chạy retrieval song song
         fts_results, vector_results, entity_results = await asyncio.gather(
             self.fts_retrieval(question, user_id, limit),
             self.vector_retrieval(question, user_id, limit),
             self.entity_retrieval(question, user_id, limit)
         )
-        
+
         # Fusion và reranking theo loại câu hỏi
-        if query_type == "keyword":
-            weighted_results = self.weighted_fusion(
-                fts_results, 0.6,
-                vector_results, 0.3, 
-                entity_results, 0.1
-            )
-        elif query_type == "semantic":
-            weighted_results = self.weighted_fusion(
-                vector_results, 0.6,
-                fts_results, 0.2,
-                entity_results, 0.2
-            )
-        elif query_type == "structured":
-            weighted_results = self.weighted_fusion(
-                entity_results, 0.5,
-                fts_results, 0.3,
-                vector_results, 0.2
-            )
-        else:  # hybrid
-            weighted_results = self.weighted_fusion(
-                fts_results, 0.4,
-                vector_results, 0.4,
-                entity_results, 0.2
-            )
-        
+        w_fts, w_vec, w_ent = FUSION_WEIGHTS.get(query_type, FUSION_WEIGHTS["hybrid"])
+        weighted_results = self.weighted_fusion(
+            fts_results, w_fts,
+            vector_results, w_vec,
+            entity_results, w_ent
+        )
+
         # Rerank và giới hạn kết quả
         final_results = self.rerank(weighted_results, question, limit)
         return final_results
-    
+
+    async def hybrid_sql_retrieval(
+        self,
+        question: str,
+        user_id: uuid.UUID,
+        limit: int = 10,
+        fusion: str | None = None
+    ) -> List[Tuple[NoteItem, float, Dict[str, float | None]]]:
+        """
+        Hybrid retrieval trong một câu SQL duy nhất (CTE cho FTS, vector, entity).
+
+        Fusion (weighted hoặc RRF) và rerank được thực hiện trong PostgreSQL,
+        chỉ top-k note cuối cùng được nạp thành ORM object (không nạp embedding/tsv).
+        Điểm vector chỉ được tính cho tối đa RETRIEVAL_VECTOR_CANDIDATES note sửa gần nhất
+        cộng các note đã khớp FTS / entity - note cũ hơn chỉ tìm thấy qua FTS / entity.
+
+        Args:
+            question: Câu hỏi của người dùng
+            user_id: ID người dùng
+            limit: Số lượng kết quả tối đa
+            fusion: "weighted" hoặc "rrf" (mặc định theo settings.RETRIEVAL_FUSION)
+
+        Returns:
+            Danh sách tuple (NoteItem, final_score, điểm từng tín hiệu)
+        """
+        try:
+            query_type = self.analyze_query_type(question)
+            w_fts, w_vec, w_ent = FUSION_WEIGHTS.get(query_type, FUSION_WEIGHTS["hybrid"])
+            fusion = fusion or settings.RETRIEVAL_FUSION
+
+            question_lower = question.lower()
+            tokens = self._tokenize(question_lower)
+            meaningful_words = [w for w in tokens if w not in FTS_STOP_WORDS and len(w) > 1] or tokens
+            important_words = [w for w in meaningful_words if len(w) > 3]
+            entity_filter, entity_params = self._entity_search(question_lower)
+
+            # Embedding câu hỏi vẫn được tạo ở Python (gọi provider), phần so khớp chạy trong DB
+            question_embedding = await embedding_service.create_embedding(question) or {}
+            query_vector = []
+            if question_embedding.get("type") == "api_vector":
+                query_vector = [float(x) for x in question_embedding.get("vector") or []]
+            query_keywords = sorted(set(question_embedding.get("keywords") or []))
+
+            params = {
+                "user_id": user_id,
+                "limit": limit,
+                "pool": limit,
+                "rerank_pool": limit * 2,
+                **tsquery_params(question, meaningful_words, settings.FTS_CONFIG),
+                "fallback_word": important_words[0] if important_words else "",
+                "fallback_pattern": f"%{escape_like(important_words[0])}%" if important_words else "",
+                "vector_candidates": settings.RETRIEVAL_VECTOR_CANDIDATES,
+                "query_is_vector": bool(query_vector),
+                "query_vector": query_vector,
+                "query_dim": len(query_vector),
+                "query_norm": math.sqrt(sum(x * x for x in query_vector)) or 1.0,
+                "query_keywords": query_keywords,
+                "question_words": question_lower.split(),
+                **entity_params,
+                "fusion": fusion,
+                "rrf_k": float(settings.RETRIEVAL_RRF_K),
+                "w_fts": w_fts,
+                "w_vec": w_vec,
+                "w_ent": w_ent,
+            }
+
+            note_columns = [c for c in NoteItem.__table__.c if c.key not in _HEAVY_NOTE_COLUMNS]
+            textual = text(
+                HYBRID_RETRIEVAL_SQL.format(
+                    note_columns=", ".join(f"n.{c.name}" for c in note_columns),
+                    tsquery=TSQUERY_SQL,
+                    entity_scores=ENTITY_SCORES_SQL.format(entity_filter=entity_filter),
+                )
+            ).columns(*note_columns, *_SIGNAL_COLUMNS)
+            stmt = select(NoteItem, *_SIGNAL_COLUMNS).from_statement(textual)
+
+            results = []
+            for note, fts_score, vector_score, entity_score, final_score in self.db.execute(stmt, params):
+                signals = {
+                    "fts": fts_score,
+                    "vector": vector_score,
+                    "entity": entity_score,
+                }
+                results.append((note, float(final_score or 0.0), signals))
+            return results
+
+        except Exception as e:
+            print(f"Hybrid SQL retrieval error: {e}")
+            import traceback
+            traceback.print_exc()
+            self.db.rollback()
+            return []
+
+    @staticmethod
+    def _entity_search(question_lower: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        Dựng bộ lọc ứng viên (chỉ dùng toán tử có index) và tham số cho ENTITY_SCORES_SQL.
+
+        Returns:
+            Tuple (biểu thức SQL lọc ứng viên, dict tham số)
+        """
+        question_words = {w for w in question_lower.split() if w not in STOP_WORDS}
+        entity_words = [w for w in question_words if len(w) > 2]
+        phone_question = any(k in question_lower for k in PHONE_QUESTION_MARKERS)
+
+        # Giá trị chuẩn hóa giống hệt trigger note_items_entity_values_trigger
+        phones = set()
+        for match in _PHONE_RE.findall(question_lower):
+            digits = re.sub(r"\D", "", match)
+            digits = re.sub(r"^84(\d{9,10})$", r"0\1", digits)
+            if re.fullmatch(r"0\d{8,10}", digits):
+                phones.add(digits)
+        emails = set(_EMAIL_RE.findall(question_lower))
+        prices = set()
+        for amount, unit in _PRICE_RE.findall(question_lower):
+            if unit or "." in amount or "," in amount:
+                value = int(re.sub(r"[.,]", "", amount))
+                prices.add(value * 1000 if unit == "k" else value)
+
+        patterns = [f"%{escape_like(w)}%" for w in entity_words]
+        if phone_question:
+            patterns.extend(f"%{k}%" for k in PHONE_QUESTION_MARKERS)
+        entity_types = [t for t in ENTITY_TYPES if t in question_lower]
+
+        params: Dict[str, Any] = {
+            "question_lower": question_lower,
+            "entity_words": entity_words,
+            "word_count": len(question_words),
+            "important_words": IMPORTANT_ENTITY_WORDS,
+            "phone_question": phone_question,
+            "phones": sorted(phones),
+            "emails": sorted(emails),
+            "prices": sorted(prices),
+        }
+        clauses = []
+        for i, pattern in enumerate(patterns):
+            params[f"entity_pattern_{i}"] = pattern
+            clauses.append(f"n.entities_text LIKE :entity_pattern_{i}")
+        for i, entity_type in enumerate(entity_types):
+            params[f"entity_type_doc_{i}"] = json.dumps({"entity_type": entity_type})
+            clauses.append(f"n.entities @> CAST(:entity_type_doc_{i} AS jsonb)")
+        if phones:
+            clauses.append("n.entity_phones && CAST(:phones AS text[])")
+        if emails:
+            clauses.append("n.entity_emails && CAST(:emails AS text[])")
+        if prices:
+            clauses.append("n.entity_prices && CAST(:prices AS numeric[])")
+
+        return (" OR ".join(clauses) or "false"), params
+
+    @staticmethod
+    def _tokenize(text_value: str) -> List[str]:
+        """Tách từ an toàn cho to_tsquery (chỉ giữ ký tự chữ/số, hỗ trợ tiếng Việt)."""
+        return re.findall(r"\w+", text_value)
+
+    def _load_notes(self, note_ids: List[uuid.UUID], user_id: uuid.UUID) -> Dict[uuid.UUID, NoteItem]:
+        """
+        Nạp nhiều note trong một truy vấn (tránh N+1 với db.get từng dòng).
+
+        Lọc thêm user_id để PostgreSQL chỉ quét một partition khi note_items được chia hash.
+        """
+        if not note_ids:
+            return {}
+        notes = self.db.execute(
+            select(NoteItem).where(NoteItem.user_id == user_id, NoteItem.id.in_(note_ids))
+        ).scalars().all()
+        return {note.id: note for note in notes}
+
     def analyze_query_type(self, question: str) -> str:
         """
         Phân loại câu hỏi để chọn chiến lược retrieval.
@@ -126,71 +502,80 @@ class SmartRetrieval:
         """
         try:
             # Chuẩn bị query từ câu hỏi - loại bỏ stop words
-            words = question.lower().split()
-            stop_words = {'của', 'là', 'có', 'và', 'trong', 'với', 'được', 'này', 'đó', 'các', 'cho', 'về'}
-            meaningful_words = [w for w in words if w not in stop_words and len(w) > 1]
+            words = self._tokenize(question.lower())
+            meaningful_words = [w for w in words if w not in FTS_STOP_WORDS and len(w) > 1]
             
             if not meaningful_words:
                 meaningful_words = words  # Fallback nếu tất cả là stop words
             
-            # Tạo query với OR operator để linh hoạt hơn
-            search_query = ' | '.join(meaningful_words)
-            
-            # Tìm kiếm trong note_items
-            query = text("""
-                SELECT id, user_id, title, content_text, ocr_text, raw_image_url,
-                       image_metadata, entities, is_archived, created_at, updated_at,
-                       ts_rank(tsv_content, to_tsquery('simple', :query)) as rank
-                FROM note_items
-                WHERE user_id = :user_id 
-                    AND is_archived = false
-                    AND tsv_content @@ to_tsquery('simple', :query)
+            # websearch_to_tsquery + so khớp tiền tố (OR) với cấu hình FTS hiện tại
+            query = text(f"""
+                SELECT n.id, ts_rank(n.tsv_content, q.query) as rank
+                FROM note_items n, (SELECT {TSQUERY_SQL} AS query) AS q
+                WHERE n.user_id = :user_id 
+                    AND n.is_archived = false
+                    AND n.tsv_content @@ q.query
                 ORDER BY rank DESC
                 LIMIT :limit
             """)
             
             result = self.db.execute(
                 query, 
-                {"query": search_query, "user_id": user_id, "limit": limit}
+                {
+                    **tsquery_params(question, meaningful_words, settings.FTS_CONFIG),
+                    "user_id": user_id,
+                    "limit": limit,
+                }
             )
             
-            notes_with_scores = []
-            for row in result:
-                note = self.db.get(NoteItem, row.id)
-                if note:
-                    notes_with_scores.append((note, float(row.rank)))
+            rows = result.all()
+            notes_by_id = self._load_notes([row.id for row in rows], user_id)
+            notes_with_scores = [
+                (notes_by_id[row.id], float(row.rank))
+                for row in rows
+                if row.id in notes_by_id
+            ]
             
-            # Nếu không tìm thấy kết quả với FTS, thử tìm kiếm đơn giản với LIKE
+            # Nếu không tìm thấy kết quả với FTS, tìm chuỗi con / gần đúng qua GIN trigram
             if not notes_with_scores:
                 fallback_query = text("""
-                    SELECT id, user_id, title, content_text, ocr_text, raw_image_url,
-                           image_metadata, entities, is_archived, created_at, updated_at,
-                           1.0 as rank
+                    SELECT id,
+                           GREATEST(
+                               word_similarity(:word, search_text),
+                               CASE WHEN search_text LIKE :pattern THEN 1 ELSE 0 END
+                           ) as rank
                     FROM note_items
                     WHERE user_id = :user_id 
                         AND is_archived = false
                         AND (
-                            LOWER(title) LIKE :pattern
-                            OR LOWER(content_text) LIKE :pattern
-                            OR LOWER(ocr_text) LIKE :pattern
+                            search_text LIKE :pattern
+                            OR :word <% search_text
                         )
-                    ORDER BY updated_at DESC
+                    ORDER BY rank DESC, updated_at DESC
                     LIMIT :limit
                 """)
                 
                 # Tìm kiếm với từ quan trọng nhất
                 important_words = [w for w in meaningful_words if len(w) > 3]
                 if important_words:
-                    pattern = f"%{important_words[0]}%"
+                    word = important_words[0]
                     result = self.db.execute(
                         fallback_query,
-                        {"user_id": user_id, "pattern": pattern, "limit": limit}
+                        {
+                            "user_id": user_id,
+                            "word": word,
+                            "pattern": f"%{escape_like(word)}%",
+                            "limit": limit,
+                        }
                     )
                     
-                    for row in result:
-                        note = self.db.get(NoteItem, row.id)
-                        if note:
-                            notes_with_scores.append((note, 0.5))
+                    rows = result.all()
+                    notes_by_id = self._load_notes([row.id for row in rows], user_id)
+                    notes_with_scores.extend(
+                        (notes_by_id[row.id], 0.5 * float(row.rank))
+                        for row in rows
+                        if row.id in notes_by_id
+                    )
             
             return notes_with_scores
             
@@ -325,74 +710,30 @@ class SmartRetrieval:
     ) -> List[Tuple[NoteItem, float]]:
         """
         Tìm kiếm dựa trên extracted entities trong note_items.
+
+        Lọc ứng viên và chấm điểm chạy hoàn toàn trong PostgreSQL (GIN jsonb_path_ops,
+        trigram trên entities_text, cột giá trị chuẩn hóa); chỉ top-k note được nạp.
         
         Returns:
             Danh sách tuple (NoteItem, relevance_score)
         """
         try:
-            question_lower = question.lower()
-            question_words = set(question_lower.split())
-            
-            # Loại bỏ stop words
-            stop_words = {'của', 'là', 'có', 'và', 'trong', 'với', 'được', 'này', 'đó', 'các'}
-            question_words = question_words - stop_words
-            
-            # Tìm notes có entities
-            notes = self.db.query(NoteItem).filter(
-                NoteItem.user_id == user_id,
-                NoteItem.is_archived == False,
-                NoteItem.entities.isnot(None)
+            entity_filter, params = self._entity_search(question.lower())
+            query = text(
+                "SELECT s.id, s.score FROM ("
+                + ENTITY_SCORES_SQL.format(entity_filter=entity_filter)
+                + ") s WHERE s.score > 0 ORDER BY s.score DESC LIMIT :limit"
+            )
+            rows = self.db.execute(
+                query, {**params, "user_id": user_id, "limit": limit}
             ).all()
             
-            notes_with_scores = []
-            
-            for note in notes:
-                if not note.entities:
-                    continue
-                
-                # Chuyển đổi entities thành chuỗi để tìm kiếm
-                import json
-                if isinstance(note.entities, dict):
-                    entities_str = json.dumps(note.entities, ensure_ascii=False).lower()
-                else:
-                    entities_str = str(note.entities).lower()
-                
-                score = 0.0
-                
-                # Khớp entity_type với câu hỏi
-                entity_type = note.entities.get("entity_type", "").lower()
-                if entity_type and entity_type in question_lower:
-                    score += 0.3
-                
-                # Khớp entity data với câu hỏi
-                matches = 0
-                for word in question_words:
-                    if len(word) > 2 and word in entities_str:
-                        matches += 1
-                        # Bonus cho từ khóa quan trọng
-                        if word in ['điện', 'thoại', 'số', 'địa', 'chỉ', 'email', 'tên', 'giá']:
-                            matches += 0.5
-                
-                if matches > 0:
-                    score += min(0.7 * (matches / len(question_words)), 0.7)
-                
-                # Bonus nếu entity chứa số điện thoại và câu hỏi hỏi về số điện thoại
-                if 'điện thoại' in question_lower or 'sdt' in question_lower or 'phone' in question_lower:
-                    if 'phone' in entities_str or any(char.isdigit() for char in entities_str):
-                        score += 0.4
-                
-                # Bonus cho entity có nhiều thông tin
-                if isinstance(note.entities, dict):
-                    entity_data = note.entities.get("data", {})
-                    if isinstance(entity_data, dict) and len(entity_data) > 3:
-                        score += 0.1
-                
-                if score > 0:
-                    notes_with_scores.append((note, score))
-            
-            # Sắp xếp theo điểm
-            notes_with_scores.sort(key=lambda x: x[1], reverse=True)
-            return notes_with_scores[:limit]
+            notes_by_id = self._load_notes([row.id for row in rows], user_id)
+            return [
+                (notes_by_id[row.id], float(row.score))
+                for row in rows
+                if row.id in notes_by_id
+            ]
             
         except Exception as e:
             print(f"Entity retrieval error: {e}")
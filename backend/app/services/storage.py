@@ -1,12 +1,30 @@
 """
 Dịch vụ lưu trữ để quản lý tải lên và xóa file.
+
+boto3 là thư viện đồng bộ: các phương thức `*_async` chạy lời gọi S3 trên một thread pool
+giới hạn (S3_MAX_CONCURRENCY) để không chặn event loop; phương thức đồng bộ dùng cho job nền.
 """
+import asyncio
+import io
+import mimetypes
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from datetime import datetime
+from typing import BinaryIO, Dict, Iterator, List, Tuple
+
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
-from typing import Tuple
 
 from app.core.config import settings
+from app.core.metrics import metrics
+
+
+metrics.describe("ainote_s3_upload_bytes", "Số byte đã upload lên S3")
+metrics.describe("ainote_s3_upload_seconds", "Thời gian upload lên S3 (giây)")
+metrics.describe("ainote_s3_errors_total", "Lỗi khi gọi S3 theo thao tác")
 
 
 class StorageService:
@@ -19,11 +37,154 @@ class StorageService:
             aws_access_key_id=settings.S3_ACCESS_KEY_ID,
             aws_secret_access_key=settings.S3_SECRET_ACCESS_KEY,
             region_name=settings.S3_REGION,
-            config=boto3.session.Config(signature_version='s3v4')
+            config=boto3.session.Config(
+                signature_version='s3v4',
+                # Mỗi upload multipart dùng tối đa S3_MULTIPART_CONCURRENCY kết nối
+                max_pool_connections=settings.S3_MAX_CONCURRENCY * settings.S3_MULTIPART_CONCURRENCY,
+            )
         )
         self.bucket_name = settings.S3_BUCKET_NAME
         self.base_url = settings.SUPABASE_URL if settings.SUPABASE_URL else settings.S3_ENDPOINT_URL.split('/storage/v1/s3')[0]
 
+        part_size = settings.S3_MULTIPART_PART_SIZE_MB * 1024 * 1024
+        self.transfer_config = TransferConfig(
+            multipart_threshold=part_size,
+            multipart_chunksize=part_size,
+            max_concurrency=settings.S3_MULTIPART_CONCURRENCY,
+        )
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.S3_MAX_CONCURRENCY,
+            thread_name_prefix="s3",
+        )
+
+    async def _run(self, func, *args, **kwargs):
+        """Chạy lời gọi boto3 đồng bộ trên thread pool của storage."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    def new_storage_key(self, filename: str) -> str:
+        """Sinh storage key duy nhất, giữ phần mở rộng của tên file gốc."""
+        file_extension = filename.split('.')[-1] if '.' in filename else 'jpg'
+        return f"{uuid.uuid4()}.{file_extension}"
+
+    @staticmethod
+    def content_key(content_sha256: str, content_type: str) -> str:
+        """Storage key theo nội dung: <sha256>.<đuôi theo loại MIME> - cùng ảnh luôn cùng key."""
+        extension = mimetypes.guess_extension(content_type or "") or ".jpg"
+        return f"{content_sha256}{extension}"
+
+    def public_url(self, storage_key: str) -> str:
+        """URL công khai của object."""
+        return f"{self.base_url}/storage/v1/object/public/{self.bucket_name}/{storage_key}"
+
+    def key_from_url(self, image_url: str) -> str | None:
+        """Storage key từ URL công khai (giữ nguyên các thư mục trong key), None nếu không phải URL của bucket."""
+        marker = f"/object/public/{self.bucket_name}/"
+        if marker not in image_url:
+            return None
+        return image_url.split(marker, 1)[1] or None
+
+    def note_storage_keys(self, raw_image_url: str | None, image_derivatives: dict | None) -> List[str]:
+        """Tất cả object của ảnh một ghi chú: ảnh gốc và các ảnh thu nhỏ."""
+        keys = []
+        if raw_image_url:
+            key = self.key_from_url(raw_image_url)
+            if key:
+                keys.append(key)
+        keys.extend(d["key"] for d in (image_derivatives or {}).values() if d.get("key"))
+        return keys
+
+    @staticmethod
+    def derivative_key(storage_key: str, size: int) -> str:
+        """Key của ảnh thu nhỏ WebP: derivatives/<key ảnh gốc không có phần mở rộng>/<size>.webp"""
+        stem = storage_key.rsplit('.', 1)[0]
+        return f"derivatives/{stem}/{size}.webp"
+
+    def put_object(
+        self,
+        storage_key: str,
+        data: bytes,
+        content_type: str,
+        cache_control: str | None = None
+    ) -> str:
+        """
+        Ghi object với key cho trước (ví dụ ảnh thu nhỏ).
+
+        Returns:
+            URL công khai
+        """
+        extra_args = {'ContentType': content_type}
+        if cache_control:
+            extra_args['CacheControl'] = cache_control
+        started = time.perf_counter()
+        try:
+            self.s3_client.put_object(
+                Bucket=self.bucket_name,
+                Key=storage_key,
+                Body=data,
+                **extra_args,
+            )
+        except ClientError as e:
+            metrics.inc("ainote_s3_errors_total", operation="upload")
+            raise Exception(f"Tải lên hình ảnh thất bại: {str(e)}")
+        metrics.observe("ainote_s3_upload_bytes", len(data))
+        metrics.observe("ainote_s3_upload_seconds", time.perf_counter() - started)
+        return self.public_url(storage_key)
+
+    async def put_object_async(
+        self,
+        storage_key: str,
+        data: bytes,
+        content_type: str,
+        cache_control: str | None = None
+    ) -> str:
+        """Phiên bản bất đồng bộ của put_object."""
+        return await self._run(self.put_object, storage_key, data, content_type, cache_control)
+
+    def upload_fileobj(
+        self,
+        fileobj: BinaryIO,
+        filename: str,
+        content_type: str = "image/jpeg"
+    ) -> Tuple[str, str]:
+        """
+        Tải file lên kho lưu trữ theo luồng (multipart khi vượt S3_MULTIPART_PART_SIZE_MB).
+
+        Chỉ giữ trong bộ nhớ tối đa S3_MULTIPART_CONCURRENCY phần cùng lúc, không đọc cả file.
+
+        Args:
+            fileobj: File đọc được (ví dụ UploadFile.file - SpooledTemporaryFile)
+            filename: Tên file gốc
+            content_type: Loại MIME của file
+
+        Returns:
+            Tuple của (public_url, storage_key)
+        """
+        unique_filename = self.new_storage_key(filename)
+        uploaded = 0
+
+        def on_progress(byte_count: int):
+            nonlocal uploaded
+            uploaded += byte_count
+
+        started = time.perf_counter()
+        try:
+            self.s3_client.upload_fileobj(
+                fileobj,
+                self.bucket_name,
+                unique_filename,
+                ExtraArgs={'ContentType': content_type},
+                Config=self.transfer_config,
+                Callback=on_progress,
+            )
+        except ClientError as e:
+            metrics.inc("ainote_s3_errors_total", operation="upload")
+            raise Exception(f"Tải lên hình ảnh thất bại: {str(e)}")
+
+        metrics.observe("ainote_s3_upload_bytes", uploaded)
+        metrics.observe("ainote_s3_upload_seconds", time.perf_counter() - started)
+        return self.public_url(unique_filename), unique_filename
+
     def upload_image(
         self, 
         file_data: bytes, 
@@ -41,22 +202,97 @@ class StorageService:
         Returns:
             Tuple của (public_url, storage_key)
         """
+        return self.upload_fileobj(io.BytesIO(file_data), filename, content_type)
+
+    async def upload_fileobj_async(
+        self,
+        fileobj: BinaryIO,
+        filename: str,
+        content_type: str = "image/jpeg"
+    ) -> Tuple[str, str]:
+        """Phiên bản bất đồng bộ của upload_fileobj."""
+        return await self._run(self.upload_fileobj, fileobj, filename, content_type)
+
+    async def upload_image_async(
+        self,
+        file_data: bytes,
+        filename: str,
+        content_type: str = "image/jpeg"
+    ) -> Tuple[str, str]:
+        """Phiên bản bất đồng bộ của upload_image."""
+        return await self._run(self.upload_image, file_data, filename, content_type)
+
+    def create_presigned_upload(
+        self,
+        filename: str,
+        content_type: str,
+        expires_in: int,
+    ) -> Tuple[str, str]:
+        """
+        Tạo presigned PUT URL để client tải ảnh thẳng lên storage.
+
+        Client phải gửi header Content-Type đúng giá trị đã ký.
+
+        Args:
+            filename: Tên file gốc (lấy phần mở rộng)
+            content_type: Loại MIME của file
+            expires_in: Thời hạn URL (giây)
+
+        Returns:
+            Tuple của (upload_url, storage_key)
+        """
+        storage_key = self.new_storage_key(filename)
         try:
-            file_extension = filename.split('.')[-1] if '.' in filename else 'jpg'
-            unique_filename = f"{uuid.uuid4()}.{file_extension}"
-            
-            self.s3_client.put_object(
-                Bucket=self.bucket_name,
-                Key=unique_filename,
-                Body=file_data,
-                ContentType=content_type
+            upload_url = self.s3_client.generate_presigned_url(
+                'put_object',
+                Params={
+                    'Bucket': self.bucket_name,
+                    'Key': storage_key,
+                    'ContentType': content_type,
+                },
+                ExpiresIn=expires_in,
             )
-            
-            public_url = f"{self.base_url}/storage/v1/object/public/{self.bucket_name}/{unique_filename}"
-            return public_url, unique_filename
-            
         except ClientError as e:
-            raise Exception(f"Tải lên hình ảnh thất bại: {str(e)}")
+            raise Exception(f"Không thể tạo presigned URL: {str(e)}")
+        return upload_url, storage_key
+
+    def get_object_size(self, storage_key: str) -> int | None:
+        """
+        Kích thước object (HEAD), None nếu object không tồn tại.
+        """
+        try:
+            response = self.s3_client.head_object(Bucket=self.bucket_name, Key=storage_key)
+            return response['ContentLength']
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            metrics.inc("ainote_s3_errors_total", operation="head")
+            raise Exception(f"Không thể đọc thông tin object: {str(e)}")
+
+    async def get_object_size_async(self, storage_key: str) -> int | None:
+        """Phiên bản bất đồng bộ của get_object_size."""
+        return await self._run(self.get_object_size, storage_key)
+
+    def download_image(self, storage_key: str) -> bytes:
+        """
+        Tải nội dung object từ storage.
+
+        Args:
+            storage_key: Khóa của file trong kho lưu trữ
+
+        Returns:
+            Dữ liệu nhị phân của file
+        """
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=storage_key)
+            return response['Body'].read()
+        except ClientError as e:
+            metrics.inc("ainote_s3_errors_total", operation="download")
+            raise Exception(f"Tải xuống hình ảnh thất bại: {str(e)}")
+
+    async def download_image_async(self, storage_key: str) -> bytes:
+        """Phiên bản bất đồng bộ của download_image."""
+        return await self._run(self.download_image, storage_key)
 
     def delete_image_by_key(self, storage_key: str) -> bool:
         """
@@ -75,9 +311,51 @@ class StorageService:
             )
             return True
         except Exception as e:
+            metrics.inc("ainote_s3_errors_total", operation="delete")
             print(f"Không thể xóa hình ảnh: {str(e)}")
             return False
 
+    def delete_keys(self, storage_keys: List[str]) -> Dict[str, str]:
+        """
+        Xóa nhiều object bằng DeleteObjects (tối đa 1000 key mỗi request).
+
+        Key không tồn tại được S3 coi là xóa thành công.
+
+        Args:
+            storage_keys: Danh sách key cần xóa
+
+        Returns:
+            Các key xóa thất bại -> thông báo lỗi (rỗng nếu xóa hết)
+        """
+        failed: Dict[str, str] = {}
+        for start in range(0, len(storage_keys), 1000):
+            batch = storage_keys[start:start + 1000]
+            try:
+                resp = self.s3_client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True},
+                )
+            except Exception as e:
+                metrics.inc("ainote_s3_errors_total", operation="delete")
+                failed.update((key, str(e)) for key in batch)
+                continue
+            errors = resp.get('Errors', [])
+            if errors:
+                metrics.inc("ainote_s3_errors_total", len(errors), operation="delete")
+                failed.update((error.get('Key'), error.get('Message') or error.get('Code', '')) for error in errors)
+        return failed
+
+    def iter_objects(self, prefix: str = "") -> Iterator[Tuple[str, datetime]]:
+        """Duyệt toàn bộ object trong bucket (ListObjectsV2 theo trang 1000 key): (key, last_modified)."""
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            for item in page.get('Contents', []):
+                yield item['Key'], item['LastModified']
+
+    async def delete_image_by_key_async(self, storage_key: str) -> bool:
+        """Phiên bản bất đồng bộ của delete_image_by_key."""
+        return await self._run(self.delete_image_by_key, storage_key)
+
     def delete_image(self, image_url: str) -> bool:
         """
         Xóa hình ảnh từ kho lưu trữ bằng URL hình ảnh.
@@ -89,8 +367,8 @@ class StorageService:
             True nếu xóa thành công
         """
         try:
-            if f"/object/public/{self.bucket_name}/" in image_url:
-                key = image_url.split(f"/object/public/{self.bucket_name}/")[-1]
+            key = self.key_from_url(image_url)
+            if key:
                 return self.delete_image_by_key(key)
             return False
         except Exception as e:
@@ -0,0 +1,175 @@
+"""
+OCR cục bộ bằng Tesseract (gọi tiến trình `tesseract`, xuất TSV có độ tin cậy từng từ).
+
+Dùng làm lượt OCR đầu tiên trong OCRService: văn bản in rõ ràng được đọc cục bộ, chỉ ảnh
+khó (độ tin cậy thấp, bảng / nhiều cột) mới được gửi cho model vision.
+Cài đặt: `apt-get install tesseract-ocr tesseract-ocr-vie`.
+"""
+import asyncio
+import csv
+import os
+import shutil
+import statistics
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from app.core.config import settings
+
+
+@dataclass
+class OCRWord:
+    """Một từ Tesseract đọc được, kèm độ tin cậy (0-100) và vị trí."""
+    text: str
+    confidence: float
+    left: int
+    top: int
+    width: int
+    height: int
+
+
+@dataclass
+class LocalOCRResult:
+    """Kết quả Tesseract: văn bản theo thứ tự đọc, từng từ và các dòng."""
+    text: str
+    words: List[OCRWord] = field(default_factory=list)
+    lines: List[List[OCRWord]] = field(default_factory=list)
+
+    @property
+    def mean_confidence(self) -> float:
+        """Độ tin cậy trung bình, trọng số theo độ dài từ (từ ngắn như dấu câu ít ảnh hưởng)."""
+        total = sum(len(word.text) for word in self.words)
+        if not total:
+            return 0.0
+        return sum(word.confidence * len(word.text) for word in self.words) / total
+
+    def low_confidence_ratio(self, threshold: float) -> float:
+        """Tỷ lệ từ có độ tin cậy dưới `threshold`."""
+        if not self.words:
+            return 1.0
+        return sum(word.confidence < threshold for word in self.words) / len(self.words)
+
+    def column_line_ratio(self, gap_factor: float = 2.5) -> float:
+        """
+        Tỷ lệ dòng có khoảng trống ngang lớn giữa hai từ (gấp `gap_factor` lần chiều cao dòng) -
+        dấu hiệu của bảng hoặc bố cục nhiều cột mà Tesseract đọc thành văn bản liền.
+        """
+        multi_word_lines = [line for line in self.lines if len(line) >= 2]
+        if not multi_word_lines:
+            return 0.0
+        column_lines = 0
+        for line in multi_word_lines:
+            height = statistics.median(word.height for word in line) or 1
+            gaps = (
+                right.left - (left.left + left.width)
+                for left, right in zip(line, line[1:])
+            )
+            if any(gap > gap_factor * height for gap in gaps):
+                column_lines += 1
+        return column_lines / len(multi_word_lines)
+
+
+def parse_tsv(tsv: str) -> LocalOCRResult:
+    """
+    Chuyển TSV của Tesseract (level 5 = từ) thành LocalOCRResult.
+
+    Dòng giữ thứ tự (block, paragraph, line); các block cách nhau một dòng trống.
+    """
+    lines: List[List[OCRWord]] = []
+    line_keys: List[Tuple[int, int, int]] = []
+    current_key = None
+
+    for row in csv.DictReader(tsv.splitlines(), delimiter="\t", quoting=csv.QUOTE_NONE):
+        if row.get("level") != "5":
+            continue
+        text = (row.get("text") or "").strip()
+        confidence = float(row.get("conf") or -1)
+        if not text or confidence < 0:
+            continue
+        key = (int(row["block_num"]), int(row["par_num"]), int(row["line_num"]))
+        if key != current_key:
+            lines.append([])
+            line_keys.append(key)
+            current_key = key
+        lines[-1].append(OCRWord(
+            text=text,
+            confidence=confidence,
+            left=int(row["left"]),
+            top=int(row["top"]),
+            width=int(row["width"]),
+            height=int(row["height"]),
+        ))
+
+    text_lines: List[str] = []
+    previous_block = None
+    for key, line in zip(line_keys, lines):
+        if previous_block is not None and key[0] != previous_block:
+            text_lines.append("")
+        text_lines.append(" ".join(word.text for word in line))
+        previous_block = key[0]
+
+    return LocalOCRResult(
+        text="\n".join(text_lines),
+        words=[word for line in lines for word in line],
+        lines=lines,
+    )
+
+
+class TesseractService:
+    """Chạy Tesseract trong tiến trình con với số tiến trình đồng thời giới hạn."""
+
+    def __init__(self):
+        self._semaphore = asyncio.Semaphore(settings.OCR_LOCAL_MAX_CONCURRENCY)
+        self._available: Optional[bool] = None
+
+    @property
+    def available(self) -> bool:
+        """Có tìm thấy lệnh tesseract hay không (kiểm tra một lần)."""
+        if self._available is None:
+            self._available = shutil.which(settings.TESSERACT_CMD) is not None
+            if not self._available:
+                print(f"⚠ Không tìm thấy {settings.TESSERACT_CMD} - OCR cục bộ bị tắt")
+        return self._available
+
+    async def recognize(self, image_data: bytes, lang: str = "vie+eng") -> LocalOCRResult:
+        """
+        OCR ảnh bằng Tesseract.
+
+        Args:
+            image_data: Ảnh đã mã hóa (PNG / JPEG...), truyền qua stdin
+            lang: Gói ngôn ngữ Tesseract (ví dụ "vie+eng")
+
+        Returns:
+            Kết quả có độ tin cậy từng từ
+
+        Raises:
+            RuntimeError: Tesseract lỗi (thiếu gói ngôn ngữ, ảnh không đọc được) hoặc quá thời gian
+        """
+        async with self._semaphore:
+            process = await asyncio.create_subprocess_exec(
+                settings.TESSERACT_CMD, "stdin", "stdout",
+                "-l", lang,
+                "--psm", str(settings.OCR_LOCAL_PSM),
+                "tsv",
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                # Mỗi tiến trình một thread - song song do OCR_LOCAL_MAX_CONCURRENCY quyết định
+                env={**os.environ, "OMP_THREAD_LIMIT": "1"},
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(
+                    process.communicate(image_data),
+                    timeout=settings.OCR_LOCAL_TIMEOUT_SECONDS,
+                )
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                raise RuntimeError(f"Tesseract quá {settings.OCR_LOCAL_TIMEOUT_SECONDS}s")
+
+        if process.returncode != 0:
+            raise RuntimeError(f"Tesseract lỗi ({process.returncode}): {stderr.decode(errors='replace').strip()}")
+        return parse_tsv(stdout.decode("utf-8", errors="replace"))
+
+
+# Singleton instance
+tesseract_service = TesseractService()
@@ -0,0 +1,123 @@
+"""Schema gốc: users, auth_refresh_tokens, note_items, qa_requests, audit_logs + trigger FTS
+
+Tương ứng với database được tạo bởi `Base.metadata.create_all` + `install_note_items_fts`
+trước khi có Alembic. Database cũ đã có schema này chỉ cần:
+
+    alembic stamp 0001_baseline && alembic upgrade head
+
+Revision ID: 0001_baseline
+Revises:
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "0001_baseline"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "users",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("email", sa.String(), nullable=False),
+        sa.Column("username", sa.String(), nullable=True),
+        sa.Column("password_hash", sa.String(), nullable=False),
+        sa.Column("is_active", sa.Boolean(), server_default="true", nullable=False),
+        sa.Column("is_verified", sa.Boolean(), server_default="false", nullable=False),
+        sa.Column("avatar_url", sa.Text(), nullable=True),
+        sa.Column("role", sa.String(), server_default="user", nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    )
+    op.create_index("ix_users_email", "users", ["email"], unique=True)
+
+    op.create_table(
+        "auth_refresh_tokens",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("user_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("token_hash", sa.Text(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("revoked_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    op.create_index("ix_auth_refresh_tokens_user_id", "auth_refresh_tokens", ["user_id"])
+
+    op.create_table(
+        "note_items",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("user_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("title", sa.Text(), nullable=True),
+        sa.Column("content_text", sa.Text(), nullable=True),
+        sa.Column("ocr_text", sa.Text(), nullable=True),
+        sa.Column("raw_image_url", sa.Text(), nullable=True),
+        sa.Column("image_metadata", postgresql.JSONB(), nullable=True),
+        sa.Column("semantic_summary", sa.Text(), nullable=True),
+        sa.Column("entity_type", sa.String(), nullable=True),
+        sa.Column("entities", postgresql.JSONB(), nullable=True),
+        sa.Column("tsv_content", postgresql.TSVECTOR(), nullable=True),
+        sa.Column("embedding", postgresql.JSONB(), nullable=True),
+        sa.Column("is_archived", sa.Boolean(), server_default="false", nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    )
+    op.create_index("ix_note_items_user_id", "note_items", ["user_id"])
+    op.create_index("ix_note_items_entity_type", "note_items", ["entity_type"])
+
+    op.create_table(
+        "qa_requests",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("user_id", postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column("question", sa.Text(), nullable=False),
+        sa.Column("context", postgresql.JSONB(), nullable=True),
+        sa.Column("response", postgresql.JSONB(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    )
+
+    op.create_table(
+        "audit_logs",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("action", sa.String(), nullable=False),
+        sa.Column("meta", postgresql.JSONB(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    )
+
+    # Trigger FTS phiên bản đầu (revision sau thay bằng tsvector có trọng số)
+    op.execute(
+        """
+CREATE OR REPLACE FUNCTION note_items_tsv_trigger() RETURNS trigger AS $fn$
+BEGIN
+    NEW.tsv_content := to_tsvector(
+        'simple',
+        coalesce(NEW.title,'') || ' ' ||
+        coalesce(NEW.content_text,'') || ' ' ||
+        coalesce(NEW.ocr_text,'') || ' ' ||
+        coalesce(NEW.image_metadata::text,'')
+    );
+    RETURN NEW;
+END
+$fn$ LANGUAGE plpgsql;
+"""
+    )
+    op.execute(
+        """
+CREATE TRIGGER note_items_tsv_content_trigger
+BEFORE INSERT OR UPDATE OF title, content_text, ocr_text, image_metadata
+ON note_items
+FOR EACH ROW EXECUTE FUNCTION note_items_tsv_trigger();
+"""
+    )
+    op.execute("CREATE INDEX idx_note_items_tsv_content ON note_items USING GIN (tsv_content)")
+
+
+def downgrade() -> None:
+    op.drop_table("audit_logs")
+    op.drop_table("qa_requests")
+    op.drop_table("note_items")
+    op.execute("DROP FUNCTION IF EXISTS note_items_tsv_trigger()")
+    op.drop_table("auth_refresh_tokens")
+    op.drop_table("users")
@@ -0,0 +1,279 @@
+"""Tìm kiếm (FTS có trọng số, trigram, entity), đồng bộ delta và bộ đếm theo user
+
+DDL được cố định trong revision (không gọi các hàm install_* của app.core, không đọc
+settings): sửa code ứng dụng sau này không làm đổi lịch sử migration. Cấu hình FTS cố định
+là "ainote_vi" (mặc định của FTS_CONFIG); deployment dùng cấu hình khác chạy
+`python -m app.commands.rebuild_fts` - startup sẽ nhắc vì chữ ký không khớp.
+
+Lưu ý vận hành: thêm cột GENERATED ... STORED (search_text, entities_text) ghi lại toàn bộ
+note_items dưới khóa ACCESS EXCLUSIVE - chạy trong cửa sổ bảo trì với bảng lớn. Các GIN index
+được tạo sau đó bằng CREATE INDEX CONCURRENTLY (autocommit_block) để không khóa ghi thêm.
+
+Revision ID: 0002_search_sync_counters
+Revises: 0001_baseline
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+
+revision = "0002_search_sync_counters"
+down_revision = "0001_baseline"
+branch_labels = None
+depends_on = None
+
+
+FTS_CONFIG = "ainote_vi"
+FTS_SIGNATURE = "cfg=ainote_vi;weights=A:title,B:content+ocr,C:summary;v=2"
+
+# (tên index, bảng, định nghĩa)
+INDEXES = [
+    ("idx_note_items_search_text_trgm", "note_items", "USING GIN (search_text gin_trgm_ops)"),
+    ("idx_note_items_entities_path", "note_items", "USING GIN (entities jsonb_path_ops)"),
+    ("idx_note_items_entities_text_trgm", "note_items", "USING GIN (entities_text gin_trgm_ops)"),
+    ("idx_note_items_entity_phones", "note_items", "USING GIN (entity_phones)"),
+    ("idx_note_items_entity_emails", "note_items", "USING GIN (entity_emails)"),
+    ("idx_note_items_entity_prices", "note_items", "USING GIN (entity_prices)"),
+]
+
+
+def _drop_invalid_index(name: str) -> None:
+    """Xóa index INVALID (CREATE INDEX CONCURRENTLY bị gián đoạn) để IF NOT EXISTS không bỏ qua nó."""
+    is_invalid = op.get_bind().exec_driver_sql(
+        "SELECT EXISTS (SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = %(name)s AND NOT i.indisvalid)",
+        {"name": name},
+    ).scalar()
+    if is_invalid:
+        op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+
+    # FTS có trọng số, cấu hình bỏ dấu tiếng Việt
+    op.execute(
+        f"""
+CREATE EXTENSION IF NOT EXISTS unaccent;
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = '{FTS_CONFIG}') THEN
+        CREATE TEXT SEARCH CONFIGURATION {FTS_CONFIG} (COPY = simple);
+        ALTER TEXT SEARCH CONFIGURATION {FTS_CONFIG}
+            ALTER MAPPING FOR hword, hword_part, word WITH unaccent, simple;
+    END IF;
+END$$;
+
+CREATE OR REPLACE FUNCTION note_items_build_tsv(
+    p_title text, p_content text, p_ocr text, p_summary text
+) RETURNS tsvector AS $fn$
+    SELECT setweight(to_tsvector('{FTS_CONFIG}'::regconfig, coalesce(p_title, '')), 'A')
+        || setweight(to_tsvector('{FTS_CONFIG}'::regconfig, coalesce(p_content, '') || ' ' || coalesce(p_ocr, '')), 'B')
+        || setweight(to_tsvector('{FTS_CONFIG}'::regconfig, coalesce(p_summary, '')), 'C')
+$fn$ LANGUAGE sql STABLE;
+
+COMMENT ON FUNCTION note_items_build_tsv(text, text, text, text) IS '{FTS_SIGNATURE}';
+
+CREATE OR REPLACE FUNCTION note_items_tsv_trigger() RETURNS trigger AS $fn$
+BEGIN
+    NEW.tsv_content := note_items_build_tsv(
+        NEW.title, NEW.content_text, NEW.ocr_text, NEW.semantic_summary
+    );
+    RETURN NEW;
+END
+$fn$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS note_items_tsv_content_trigger ON note_items;
+CREATE TRIGGER note_items_tsv_content_trigger
+BEFORE INSERT OR UPDATE OF title, content_text, ocr_text, semantic_summary
+ON note_items
+FOR EACH ROW EXECUTE FUNCTION note_items_tsv_trigger();
+"""
+    )
+
+    # Cột sinh cho trigram và giá trị entity chuẩn hóa (ghi lại bảng - xem docstring)
+    op.execute(
+        """
+ALTER TABLE note_items
+    ADD COLUMN IF NOT EXISTS search_text text
+        GENERATED ALWAYS AS (
+            lower(coalesce(title, '') || ' ' || coalesce(content_text, '') || ' ' || coalesce(ocr_text, ''))
+        ) STORED,
+    ADD COLUMN IF NOT EXISTS entities_text text
+        GENERATED ALWAYS AS (lower(entities::text)) STORED,
+    ADD COLUMN IF NOT EXISTS entity_phones text[],
+    ADD COLUMN IF NOT EXISTS entity_emails text[],
+    ADD COLUMN IF NOT EXISTS entity_prices numeric[];
+"""
+    )
+
+    op.execute(
+        r"""
+CREATE OR REPLACE FUNCTION note_items_entity_values_trigger() RETURNS trigger AS $fn$
+DECLARE
+    doc text := lower(coalesce(NEW.entities::text, ''));
+BEGIN
+    NEW.entity_phones := ARRAY(
+        SELECT DISTINCT p.digits
+        FROM (
+            SELECT regexp_replace(regexp_replace(m[1], '\D', '', 'g'), '^84(\d{9,10})$', '0\1') AS digits
+            FROM regexp_matches(doc, '(\+?\d[\d .-]{7,}\d)', 'g') AS m
+        ) p
+        WHERE p.digits ~ '^0\d{8,10}$'
+    );
+    NEW.entity_emails := ARRAY(
+        SELECT DISTINCT m[1]
+        FROM regexp_matches(doc, '([a-z0-9._%+-]+@[a-z0-9.-]+\.[a-z]{2,})', 'g') AS m
+    );
+    NEW.entity_prices := ARRAY(
+        SELECT DISTINCT regexp_replace(m[1], '[.,]', '', 'g')::numeric
+            * CASE WHEN m[2] = 'k' THEN 1000 ELSE 1 END
+        FROM regexp_matches(doc, '(\d{1,3}(?:[.,]\d{3})+|\d+)\s*(k|đ|₫|vnd|vnđ|đồng)?', 'g') AS m
+        WHERE m[2] IS NOT NULL OR m[1] ~ '[.,]'
+    );
+    RETURN NEW;
+END
+$fn$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS note_items_entity_values_trigger ON note_items;
+CREATE TRIGGER note_items_entity_values_trigger
+BEFORE INSERT OR UPDATE OF entities
+ON note_items
+FOR EACH ROW EXECUTE FUNCTION note_items_entity_values_trigger();
+
+UPDATE note_items SET entities = entities
+WHERE entities IS NOT NULL AND entity_phones IS NULL;
+"""
+    )
+
+    # Bộ đếm theo user: notes_version (ETag) và số ghi chú theo entity_type
+    op.execute(
+        """
+ALTER TABLE users
+    ADD COLUMN IF NOT EXISTS notes_version bigint NOT NULL DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION note_items_version_trigger() RETURNS trigger AS $fn$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE users SET notes_version = notes_version + 1 WHERE id = OLD.user_id;
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.user_id IS DISTINCT FROM OLD.user_id) THEN
+        UPDATE users SET notes_version = notes_version + 1 WHERE id = NEW.user_id;
+    END IF;
+    RETURN NULL;
+END
+$fn$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS note_items_version_trigger ON note_items;
+CREATE TRIGGER note_items_version_trigger
+AFTER INSERT OR DELETE OR UPDATE OF user_id, title, content_text, ocr_text, raw_image_url,
+    image_metadata, semantic_summary, entity_type, entities, is_archived
+ON note_items
+FOR EACH ROW EXECUTE FUNCTION note_items_version_trigger();
+
+CREATE TABLE IF NOT EXISTS user_entity_type_counts (
+    user_id uuid NOT NULL,
+    entity_type varchar NOT NULL,
+    count bigint NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, entity_type)
+);
+
+CREATE OR REPLACE FUNCTION note_items_entity_count_trigger() RETURNS trigger AS $fn$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.entity_type IS NOT NULL AND NOT OLD.is_archived THEN
+        UPDATE user_entity_type_counts SET count = count - 1
+        WHERE user_id = OLD.user_id AND entity_type = OLD.entity_type;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.entity_type IS NOT NULL AND NOT NEW.is_archived THEN
+        INSERT INTO user_entity_type_counts AS c (user_id, entity_type, count)
+        VALUES (NEW.user_id, NEW.entity_type, 1)
+        ON CONFLICT (user_id, entity_type) DO UPDATE SET count = c.count + 1;
+    END IF;
+    RETURN NULL;
+END
+$fn$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS note_items_entity_count_trigger ON note_items;
+CREATE TRIGGER note_items_entity_count_trigger
+AFTER INSERT OR DELETE OR UPDATE OF user_id, entity_type, is_archived
+ON note_items
+FOR EACH ROW EXECUTE FUNCTION note_items_entity_count_trigger();
+
+LOCK TABLE note_items IN SHARE MODE;
+DELETE FROM user_entity_type_counts;
+INSERT INTO user_entity_type_counts (user_id, entity_type, count)
+SELECT user_id, entity_type, count(*)
+FROM note_items
+WHERE entity_type IS NOT NULL AND NOT is_archived
+GROUP BY user_id, entity_type;
+"""
+    )
+
+    op.execute(
+        """
+CREATE TABLE IF NOT EXISTS note_tombstones (
+    note_id uuid PRIMARY KEY,
+    user_id uuid NOT NULL,
+    deleted_at timestamptz NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS ix_note_tombstones_user_deleted
+    ON note_tombstones (user_id, deleted_at, note_id);
+"""
+    )
+
+    # Database rỗng không cần backfill tsv_content; có dữ liệu thì startup nhắc chạy rebuild_fts
+    has_notes = conn.exec_driver_sql("SELECT EXISTS (SELECT 1 FROM note_items)").scalar()
+    if not has_notes:
+        op.execute(f"COMMENT ON COLUMN note_items.tsv_content IS '{FTS_SIGNATURE}'")
+
+    with op.get_context().autocommit_block():
+        for name, table, definition in INDEXES:
+            _drop_invalid_index(name)
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}")
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+DROP TABLE IF EXISTS note_tombstones;
+
+DROP TRIGGER IF EXISTS note_items_entity_count_trigger ON note_items;
+DROP FUNCTION IF EXISTS note_items_entity_count_trigger();
+DROP TABLE IF EXISTS user_entity_type_counts;
+
+DROP TRIGGER IF EXISTS note_items_version_trigger ON note_items;
+DROP FUNCTION IF EXISTS note_items_version_trigger();
+ALTER TABLE users DROP COLUMN IF EXISTS notes_version;
+
+DROP TRIGGER IF EXISTS note_items_entity_values_trigger ON note_items;
+DROP FUNCTION IF EXISTS note_items_entity_values_trigger();
+ALTER TABLE note_items
+    DROP COLUMN IF EXISTS entities_text,
+    DROP COLUMN IF EXISTS entity_phones,
+    DROP COLUMN IF EXISTS entity_emails,
+    DROP COLUMN IF EXISTS entity_prices,
+    DROP COLUMN IF EXISTS search_text;
+DROP INDEX IF EXISTS idx_note_items_entities_path;
+
+DROP TRIGGER IF EXISTS note_items_tsv_content_trigger ON note_items;
+CREATE OR REPLACE FUNCTION note_items_tsv_trigger() RETURNS trigger AS $fn$
+BEGIN
+    NEW.tsv_content := to_tsvector(
+        'simple',
+        coalesce(NEW.title,'') || ' ' ||
+        coalesce(NEW.content_text,'') || ' ' ||
+        coalesce(NEW.ocr_text,'') || ' ' ||
+        coalesce(NEW.image_metadata::text,'')
+    );
+    RETURN NEW;
+END
+$fn$ LANGUAGE plpgsql;
+CREATE TRIGGER note_items_tsv_content_trigger
+BEFORE INSERT OR UPDATE OF title, content_text, ocr_text, image_metadata
+ON note_items
+FOR EACH ROW EXECUTE FUNCTION note_items_tsv_trigger();
+DROP FUNCTION IF EXISTS note_items_build_tsv(text, text, text, text);
+COMMENT ON COLUMN note_items.tsv_content IS NULL;
+"""
+    )
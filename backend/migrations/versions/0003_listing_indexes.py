@@ -0,0 +1,67 @@
+"""Index phân trang keyset và đồng bộ delta (CREATE INDEX CONCURRENTLY)
+
+Tạo online để không khóa ghi trên note_items / qa_requests lớn. CONCURRENTLY không
+chạy được trong transaction nên dùng autocommit_block; index INVALID còn sót từ lần
+chạy lỗi trước được xóa rồi tạo lại.
+
+Revision ID: 0003_listing_indexes
+Revises: 0002_search_sync_counters
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003_listing_indexes"
+down_revision = "0002_search_sync_counters"
+branch_labels = None
+depends_on = None
+
+
+# (tên index, bảng, các cột)
+INDEXES = [
+    (
+        "ix_note_items_user_archived_created",
+        "note_items",
+        ["user_id", "is_archived", sa.text("created_at DESC"), sa.text("id DESC")],
+    ),
+    (
+        "ix_note_items_user_entity_type_created",
+        "note_items",
+        ["user_id", "entity_type", "is_archived", sa.text("created_at DESC"), sa.text("id DESC")],
+    ),
+    (
+        "ix_note_items_user_updated",
+        "note_items",
+        ["user_id", "updated_at", "id"],
+    ),
+    (
+        "ix_qa_requests_user_created",
+        "qa_requests",
+        ["user_id", sa.text("created_at DESC"), sa.text("id DESC")],
+    ),
+]
+
+
+def _drop_invalid_index(name: str) -> None:
+    """Xóa index INVALID (CREATE INDEX CONCURRENTLY bị gián đoạn) để IF NOT EXISTS không bỏ qua nó."""
+    is_invalid = op.get_bind().exec_driver_sql(
+        "SELECT EXISTS (SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = %(name)s AND NOT i.indisvalid)",
+        {"name": name},
+    ).scalar()
+    if is_invalid:
+        op.drop_index(name, postgresql_concurrently=True, if_exists=True)
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            _drop_invalid_index(name)
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, _table, _columns in reversed(INDEXES):
+            op.drop_index(name, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,104 @@
+"""Chuyển qa_requests sang bảng partition theo tháng (RANGE created_at)
+
+Bảng cũ được đổi tên thành qa_requests_legacy, dữ liệu chép sang bảng partitioned
+rồi xóa bảng cũ. Khóa chính mới là (id, created_at) vì phải chứa khóa partition.
+Partition được tạo từ tháng (UTC) của bản ghi cũ nhất tới 2 tháng tới, cùng DEFAULT
+partition qa_requests_default cho bản ghi ngoài các tháng đó; job qa_partitions
+(app/services/jobs.py) tiếp tục tạo trước theo QA_PARTITION_MONTHS_AHEAD và lưu trữ partition.
+DDL được cố định trong revision (không gọi app.core.qa_partitions, không đọc settings).
+
+Lưu ý vận hành: toàn bộ qa_requests được chép sang bảng mới trong một transaction, bảng cũ
+bị khóa ACCESS EXCLUSIVE từ lúc đổi tên tới khi commit - chạy trong cửa sổ bảo trì với bảng lớn.
+
+Revision ID: 0004_qa_requests_partitioned
+Revises: 0003_listing_indexes
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+
+revision = "0004_qa_requests_partitioned"
+down_revision = "0003_listing_indexes"
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = "id, user_id, question, context, response, created_at"
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE qa_requests RENAME TO qa_requests_legacy")
+    op.execute("ALTER INDEX qa_requests_pkey RENAME TO qa_requests_legacy_pkey")
+    op.execute("ALTER INDEX IF EXISTS ix_qa_requests_user_created RENAME TO ix_qa_requests_legacy_user_created")
+
+    op.execute(
+        """
+CREATE TABLE qa_requests (
+    id UUID NOT NULL,
+    user_id UUID,
+    question TEXT NOT NULL,
+    context JSONB,
+    response JSONB,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    CONSTRAINT qa_requests_pkey PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at)
+"""
+    )
+
+    # Partition tháng qa_requests_yYYYYmMM, biên theo UTC (không theo múi giờ của phiên)
+    op.execute(
+        """
+DO $$
+DECLARE
+    part_start timestamp := date_trunc(
+        'month', coalesce((SELECT min(created_at) FROM qa_requests_legacy), now()) AT TIME ZONE 'UTC'
+    );
+    part_last timestamp := date_trunc('month', now() AT TIME ZONE 'UTC') + interval '2 months';
+BEGIN
+    WHILE part_start <= part_last LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF qa_requests FOR VALUES FROM (%L) TO (%L)',
+            to_char(part_start, '"qa_requests_y"YYYY"m"MM'),
+            part_start::text || '+00',
+            (part_start + interval '1 month')::text || '+00'
+        );
+        part_start := part_start + interval '1 month';
+    END LOOP;
+END$$;
+
+CREATE TABLE qa_requests_default PARTITION OF qa_requests DEFAULT;
+"""
+    )
+
+    # Index trên bảng cha được tạo tương ứng trên từng partition
+    op.execute(
+        "CREATE INDEX ix_qa_requests_user_created ON qa_requests (user_id, created_at DESC, id DESC)"
+    )
+
+    op.execute(f"INSERT INTO qa_requests ({COLUMNS}) SELECT {COLUMNS} FROM qa_requests_legacy")
+    op.execute("DROP TABLE qa_requests_legacy")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE qa_requests RENAME TO qa_requests_partitioned")
+    op.execute("ALTER INDEX qa_requests_pkey RENAME TO qa_requests_partitioned_pkey")
+    op.execute("ALTER INDEX ix_qa_requests_user_created RENAME TO ix_qa_requests_partitioned_user_created")
+
+    op.execute(
+        """
+CREATE TABLE qa_requests (
+    id UUID PRIMARY KEY,
+    user_id UUID,
+    question TEXT NOT NULL,
+    context JSONB,
+    response JSONB,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+)
+"""
+    )
+    op.execute(f"INSERT INTO qa_requests ({COLUMNS}) SELECT {COLUMNS} FROM qa_requests_partitioned")
+    op.execute(
+        "CREATE INDEX ix_qa_requests_user_created ON qa_requests (user_id, created_at DESC, id DESC)"
+    )
+    # DROP bảng cha xóa luôn mọi partition
+    op.execute("DROP TABLE qa_requests_partitioned")
@@ -0,0 +1,73 @@
+"""Index cho auth_refresh_tokens: unique token_hash + partial index cho job dọn dẹp
+
+/auth/refresh tra cứu theo token_hash (trước đây quét tuần tự). Hash trùng nhau
+(token cấp trong cùng một giây trước khi có jti) được loại bỏ trước khi tạo unique
+index, giữ lại bản ghi mới nhất. Index tạo bằng CONCURRENTLY như 0003.
+
+Revision ID: 0005_refresh_token_indexes
+Revises: 0004_qa_requests_partitioned
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005_refresh_token_indexes"
+down_revision = "0004_qa_requests_partitioned"
+branch_labels = None
+depends_on = None
+
+
+# (tên index, các cột, unique, điều kiện partial)
+INDEXES = [
+    ("ux_auth_refresh_tokens_token_hash", ["token_hash"], True, None),
+    ("ix_auth_refresh_tokens_unrevoked_expires", ["expires_at"], False, sa.text("revoked_at IS NULL")),
+    ("ix_auth_refresh_tokens_revoked", ["revoked_at"], False, sa.text("revoked_at IS NOT NULL")),
+]
+
+
+def _drop_invalid_index(name: str) -> None:
+    """Xóa index INVALID (CREATE INDEX CONCURRENTLY bị gián đoạn) để IF NOT EXISTS không bỏ qua nó."""
+    is_invalid = op.get_bind().exec_driver_sql(
+        "SELECT EXISTS (SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = %(name)s AND NOT i.indisvalid)",
+        {"name": name},
+    ).scalar()
+    if is_invalid:
+        op.drop_index(name, postgresql_concurrently=True, if_exists=True)
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+DELETE FROM auth_refresh_tokens
+WHERE id IN (
+    SELECT id FROM (
+        SELECT id, row_number() OVER (
+            PARTITION BY token_hash ORDER BY (revoked_at IS NULL) DESC, created_at DESC
+        ) AS rn
+        FROM auth_refresh_tokens
+    ) ranked
+    WHERE rn > 1
+)
+"""
+    )
+
+    with op.get_context().autocommit_block():
+        for name, columns, unique, where in INDEXES:
+            _drop_invalid_index(name)
+            op.create_index(
+                name,
+                "auth_refresh_tokens",
+                columns,
+                unique=unique,
+                postgresql_where=where,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, _columns, _unique, _where in reversed(INDEXES):
+            op.drop_index(name, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,25 @@
+"""Thêm note_items.processing_stats (trạng thái + thời gian từng bước của pipeline ảnh)
+
+Cột JSONB cho phép NULL, không có default: ADD COLUMN chỉ cập nhật catalog, không ghi lại bảng.
+
+Revision ID: 0006_note_processing_stats
+Revises: 0005_refresh_token_indexes
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "0006_note_processing_stats"
+down_revision = "0005_refresh_token_indexes"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("note_items", sa.Column("processing_stats", postgresql.JSONB(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("note_items", "processing_stats")
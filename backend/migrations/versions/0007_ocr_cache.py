@@ -0,0 +1,40 @@
+"""Bảng ocr_cache: kết quả OCR theo SHA-256 ảnh gốc + provider / model / phiên bản prompt
+
+Revision ID: 0007_ocr_cache
+Revises: 0006_note_processing_stats
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "0007_ocr_cache"
+down_revision = "0006_note_processing_stats"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "ocr_cache",
+        sa.Column("content_sha256", sa.String(64), primary_key=True),
+        sa.Column("provider", sa.String(), primary_key=True),
+        sa.Column("model", sa.String(), primary_key=True),
+        sa.Column("prompt_version", sa.String(), primary_key=True),
+        sa.Column("user_id", postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column("dhash", sa.BigInteger(), nullable=True),
+        sa.Column("text", sa.Text(), nullable=False),
+        sa.Column("confidence", sa.Float(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    )
+    op.create_index(
+        "ix_ocr_cache_user_dhash",
+        "ocr_cache",
+        ["user_id", "provider", "model", "prompt_version", "dhash"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_ocr_cache_user_dhash", table_name="ocr_cache")
+    op.drop_table("ocr_cache")
@@ -0,0 +1,26 @@
+"""Thêm note_items.image_derivatives (ảnh thu nhỏ WebP của ảnh ghi chú)
+
+Cột JSONB cho phép NULL, không có default: ADD COLUMN chỉ cập nhật catalog, không ghi lại bảng.
+Ghi chú cũ giữ NULL - client dùng raw_image_url khi không có thumbnail_url.
+
+Revision ID: 0008_note_image_derivatives
+Revises: 0007_ocr_cache
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "0008_note_image_derivatives"
+down_revision = "0007_ocr_cache"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("note_items", sa.Column("image_derivatives", postgresql.JSONB(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("note_items", "image_derivatives")
@@ -0,0 +1,28 @@
+"""Bảng storage_pending_deletes: hàng đợi xóa object S3 (job storage_gc)
+
+Revision ID: 0009_storage_pending_deletes
+Revises: 0008_note_image_derivatives
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0009_storage_pending_deletes"
+down_revision = "0008_note_image_derivatives"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "storage_pending_deletes",
+        sa.Column("storage_key", sa.Text(), primary_key=True),
+        sa.Column("attempts", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("storage_pending_deletes")
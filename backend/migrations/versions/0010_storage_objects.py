@@ -0,0 +1,30 @@
+"""Bảng storage_objects: chỉ mục + đếm tham chiếu cho ảnh lưu theo nội dung (SHA-256)
+
+Revision ID: 0010_storage_objects
+Revises: 0009_storage_pending_deletes
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0010_storage_objects"
+down_revision = "0009_storage_pending_deletes"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "storage_objects",
+        sa.Column("storage_key", sa.Text(), primary_key=True),
+        sa.Column("content_sha256", sa.String(64), nullable=True),
+        sa.Column("size", sa.BigInteger(), nullable=True),
+        sa.Column("ref_count", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("storage_objects")
@@ -0,0 +1,29 @@
+"""Bảng storage_upload_claims: finalize upload trực tiếp idempotent theo storage key
+
+Revision ID: 0011_storage_upload_claims
+Revises: 0010_storage_objects
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "0011_storage_upload_claims"
+down_revision = "0010_storage_objects"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "storage_upload_claims",
+        sa.Column("storage_key", sa.Text(), primary_key=True),
+        sa.Column("user_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("note_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("storage_upload_claims")
@@ -0,0 +1,40 @@
+"""Mốc đồng bộ delta theo thời điểm ghi: DEFAULT clock_timestamp() thay cho now()
+
+now() là lúc transaction bắt đầu; transaction mở lâu (chờ OCR / LLM) commit với mốc cũ hơn
+change token client đã nhận và bị /notes/changes bỏ sót. Chỉ đổi DEFAULT (không ghi lại bảng).
+
+Revision ID: 0012_sync_clock_timestamps
+Revises: 0011_storage_upload_claims
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+
+revision = "0012_sync_clock_timestamps"
+down_revision = "0011_storage_upload_claims"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+ALTER TABLE note_items
+    ALTER COLUMN created_at SET DEFAULT clock_timestamp(),
+    ALTER COLUMN updated_at SET DEFAULT clock_timestamp();
+ALTER TABLE note_tombstones
+    ALTER COLUMN deleted_at SET DEFAULT clock_timestamp();
+"""
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+ALTER TABLE note_tombstones
+    ALTER COLUMN deleted_at SET DEFAULT now();
+ALTER TABLE note_items
+    ALTER COLUMN created_at SET DEFAULT now(),
+    ALTER COLUMN updated_at SET DEFAULT now();
+"""
+    )
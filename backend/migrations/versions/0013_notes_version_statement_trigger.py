@@ -0,0 +1,94 @@
+"""notes_version: trigger cấp câu lệnh (transition table) thay cho trigger từng dòng
+
+Trigger từng dòng chạy UPDATE users một lần cho mỗi ghi chú - lô 16 ghi chú khóa và cập nhật
+cùng dòng users 16 lần. Trigger cấp câu lệnh tăng bộ đếm của mỗi user bị ảnh hưởng một lần
+cho mỗi câu lệnh; UPDATE chỉ tính khi giá trị cột mà API trả về thực sự thay đổi.
+
+Revision ID: 0013_notes_version_statement_trigger
+Revises: 0012_sync_clock_timestamps
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+
+revision = "0013_notes_version_statement_trigger"
+down_revision = "0012_sync_clock_timestamps"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+CREATE OR REPLACE FUNCTION note_items_version_stmt_trigger() RETURNS trigger AS $fn$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE users SET notes_version = notes_version + 1
+        WHERE id IN (SELECT user_id FROM new_notes);
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE users SET notes_version = notes_version + 1
+        WHERE id IN (SELECT user_id FROM old_notes);
+    ELSE
+        UPDATE users SET notes_version = notes_version + 1
+        WHERE id IN (
+            SELECT unnest(ARRAY[o.user_id, n.user_id])
+            FROM old_notes o JOIN new_notes n ON n.id = o.id
+            WHERE (o.user_id, o.title, o.content_text, o.ocr_text, o.raw_image_url, o.image_metadata,
+                   o.semantic_summary, o.entity_type, o.entities, o.is_archived)
+                IS DISTINCT FROM
+                  (n.user_id, n.title, n.content_text, n.ocr_text, n.raw_image_url, n.image_metadata,
+                   n.semantic_summary, n.entity_type, n.entities, n.is_archived)
+        );
+    END IF;
+    RETURN NULL;
+END
+$fn$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS note_items_version_trigger ON note_items;
+DROP FUNCTION IF EXISTS note_items_version_trigger();
+
+CREATE TRIGGER note_items_version_insert_trigger
+AFTER INSERT ON note_items
+REFERENCING NEW TABLE AS new_notes
+FOR EACH STATEMENT EXECUTE FUNCTION note_items_version_stmt_trigger();
+
+CREATE TRIGGER note_items_version_update_trigger
+AFTER UPDATE ON note_items
+REFERENCING OLD TABLE AS old_notes NEW TABLE AS new_notes
+FOR EACH STATEMENT EXECUTE FUNCTION note_items_version_stmt_trigger();
+
+CREATE TRIGGER note_items_version_delete_trigger
+AFTER DELETE ON note_items
+REFERENCING OLD TABLE AS old_notes
+FOR EACH STATEMENT EXECUTE FUNCTION note_items_version_stmt_trigger();
+"""
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+DROP TRIGGER IF EXISTS note_items_version_insert_trigger ON note_items;
+DROP TRIGGER IF EXISTS note_items_version_update_trigger ON note_items;
+DROP TRIGGER IF EXISTS note_items_version_delete_trigger ON note_items;
+DROP FUNCTION IF EXISTS note_items_version_stmt_trigger();
+
+CREATE OR REPLACE FUNCTION note_items_version_trigger() RETURNS trigger AS $fn$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE users SET notes_version = notes_version + 1 WHERE id = OLD.user_id;
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.user_id IS DISTINCT FROM OLD.user_id) THEN
+        UPDATE users SET notes_version = notes_version + 1 WHERE id = NEW.user_id;
+    END IF;
+    RETURN NULL;
+END
+$fn$ LANGUAGE plpgsql;
+
+CREATE TRIGGER note_items_version_trigger
+AFTER INSERT OR DELETE OR UPDATE OF user_id, title, content_text, ocr_text, raw_image_url,
+    image_metadata, semantic_summary, entity_type, entities, is_archived
+ON note_items
+FOR EACH ROW EXECUTE FUNCTION note_items_version_trigger();
+"""
+    )
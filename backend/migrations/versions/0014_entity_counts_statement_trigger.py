@@ -0,0 +1,140 @@
+"""user_entity_type_counts: duy trì trong trigger cấp câu lệnh, sau khi khóa dòng users
+
+Trigger từng dòng sửa user_entity_type_counts trước khi trigger cấp câu lệnh khóa dòng users;
+đối soát một user (khóa dòng users FOR UPDATE rồi ghi lại thống kê) có thể deadlock với nó.
+Gộp phần thống kê vào note_items_version_stmt_trigger(), chạy sau UPDATE users: mọi thay đổi
+bộ đếm của một user tuần tự theo dòng users, và lô ghi chú chỉ ghi mỗi (user, entity_type) một lần.
+
+Revision ID: 0014_entity_counts_statement_trigger
+Revises: 0013_notes_version_statement_trigger
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+
+revision = "0014_entity_counts_statement_trigger"
+down_revision = "0013_notes_version_statement_trigger"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+CREATE OR REPLACE FUNCTION note_items_version_stmt_trigger() RETURNS trigger AS $fn$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE users SET notes_version = notes_version + 1
+        WHERE id IN (SELECT user_id FROM new_notes);
+
+        INSERT INTO user_entity_type_counts AS c (user_id, entity_type, count)
+        SELECT user_id, entity_type, count(*)
+        FROM new_notes
+        WHERE entity_type IS NOT NULL AND NOT is_archived
+        GROUP BY user_id, entity_type
+        ORDER BY user_id, entity_type
+        ON CONFLICT (user_id, entity_type) DO UPDATE SET count = c.count + EXCLUDED.count;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE users SET notes_version = notes_version + 1
+        WHERE id IN (SELECT user_id FROM old_notes);
+
+        UPDATE user_entity_type_counts c SET count = c.count - d.n
+        FROM (
+            SELECT user_id, entity_type, count(*) AS n
+            FROM old_notes
+            WHERE entity_type IS NOT NULL AND NOT is_archived
+            GROUP BY user_id, entity_type
+        ) d
+        WHERE c.user_id = d.user_id AND c.entity_type = d.entity_type;
+    ELSE
+        UPDATE users SET notes_version = notes_version + 1
+        WHERE id IN (
+            SELECT unnest(ARRAY[o.user_id, n.user_id])
+            FROM old_notes o JOIN new_notes n ON n.id = o.id
+            WHERE (o.user_id, o.title, o.content_text, o.ocr_text, o.raw_image_url, o.image_metadata,
+                   o.semantic_summary, o.entity_type, o.entities, o.is_archived)
+                IS DISTINCT FROM
+                  (n.user_id, n.title, n.content_text, n.ocr_text, n.raw_image_url, n.image_metadata,
+                   n.semantic_summary, n.entity_type, n.entities, n.is_archived)
+        );
+
+        WITH delta AS (
+            SELECT user_id, entity_type, sum(n) AS n
+            FROM (
+                SELECT user_id, entity_type, -1 AS n FROM old_notes
+                WHERE entity_type IS NOT NULL AND NOT is_archived
+                UNION ALL
+                SELECT user_id, entity_type, 1 AS n FROM new_notes
+                WHERE entity_type IS NOT NULL AND NOT is_archived
+            ) s
+            GROUP BY user_id, entity_type
+            HAVING sum(n) <> 0
+        ), decremented AS (
+            UPDATE user_entity_type_counts c SET count = c.count + d.n
+            FROM delta d
+            WHERE d.n < 0 AND c.user_id = d.user_id AND c.entity_type = d.entity_type
+        )
+        INSERT INTO user_entity_type_counts AS c (user_id, entity_type, count)
+        SELECT user_id, entity_type, n FROM delta
+        WHERE n > 0
+        ORDER BY user_id, entity_type
+        ON CONFLICT (user_id, entity_type) DO UPDATE SET count = c.count + EXCLUDED.count;
+    END IF;
+    RETURN NULL;
+END
+$fn$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS note_items_entity_count_trigger ON note_items;
+DROP FUNCTION IF EXISTS note_items_entity_count_trigger();
+"""
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+CREATE OR REPLACE FUNCTION note_items_version_stmt_trigger() RETURNS trigger AS $fn$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE users SET notes_version = notes_version + 1
+        WHERE id IN (SELECT user_id FROM new_notes);
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE users SET notes_version = notes_version + 1
+        WHERE id IN (SELECT user_id FROM old_notes);
+    ELSE
+        UPDATE users SET notes_version = notes_version + 1
+        WHERE id IN (
+            SELECT unnest(ARRAY[o.user_id, n.user_id])
+            FROM old_notes o JOIN new_notes n ON n.id = o.id
+            WHERE (o.user_id, o.title, o.content_text, o.ocr_text, o.raw_image_url, o.image_metadata,
+                   o.semantic_summary, o.entity_type, o.entities, o.is_archived)
+                IS DISTINCT FROM
+                  (n.user_id, n.title, n.content_text, n.ocr_text, n.raw_image_url, n.image_metadata,
+                   n.semantic_summary, n.entity_type, n.entities, n.is_archived)
+        );
+    END IF;
+    RETURN NULL;
+END
+$fn$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION note_items_entity_count_trigger() RETURNS trigger AS $fn$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.entity_type IS NOT NULL AND NOT OLD.is_archived THEN
+        UPDATE user_entity_type_counts SET count = count - 1
+        WHERE user_id = OLD.user_id AND entity_type = OLD.entity_type;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.entity_type IS NOT NULL AND NOT NEW.is_archived THEN
+        INSERT INTO user_entity_type_counts AS c (user_id, entity_type, count)
+        VALUES (NEW.user_id, NEW.entity_type, 1)
+        ON CONFLICT (user_id, entity_type) DO UPDATE SET count = c.count + 1;
+    END IF;
+    RETURN NULL;
+END
+$fn$ LANGUAGE plpgsql;
+
+CREATE TRIGGER note_items_entity_count_trigger
+AFTER INSERT OR DELETE OR UPDATE OF user_id, entity_type, is_archived
+ON note_items
+FOR EACH ROW EXECUTE FUNCTION note_items_entity_count_trigger();
+"""
+    )
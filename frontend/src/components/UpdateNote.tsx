@@ -1,6 +1,5 @@
 import React, { useState, useEffect } from 'react';
 import { notesAPI } from '../services/api';
-import type { Note } from '../services/api';
 import './CreateNote.css';
 
 interface UpdateNoteProps {
@@ -25,8 +24,7 @@ export const UpdateNote: React.FC<UpdateNoteProps> = ({ noteId, onBack, onSaved
   useEffect(() => {
     const loadNote = async () => {
       try {
-        const notesList = await notesAPI.list();
-        const note = notesList.find((n: Note) => n.id === noteId);
+        const note = await notesAPI.get(noteId);
         if (note) {
           // Detect if image or text note
           if (note.raw_image_url) {
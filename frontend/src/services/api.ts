@@ -103,6 +103,13 @@ export interface Note {
   updated_at: string;
 }
 
+export interface NoteChanges {
+  notes: Note[];
+  deleted_ids: string[];
+  next_token: string;
+  has_more: boolean;
+}
+
 export interface TokenPair {
   access_token: string;
   refresh_token: string;
@@ -143,9 +150,30 @@ export const authAPI = {
 };
 
 // Notes API
+const NOTES_PAGE_SIZE = 100;
+
 export const notesAPI = {
+  // Server phân trang theo cursor (header X-Next-Cursor) - đi hết các trang
   list: async (): Promise<Note[]> => {
-    const response = await api.get('/notes/');
+    const notes: Note[] = [];
+    let cursor: string | undefined;
+    do {
+      const response = await api.get('/notes/', {
+        params: { limit: NOTES_PAGE_SIZE, ...(cursor ? { cursor } : {}) },
+      });
+      notes.push(...response.data);
+      cursor = response.headers['x-next-cursor'] || undefined;
+    } while (cursor);
+    return notes;
+  },
+
+  get: async (id: string): Promise<Note> => {
+    const response = await api.get(`/notes/${id}`);
+    return response.data;
+  },
+
+  changes: async (since?: string | null): Promise<NoteChanges> => {
+    const response = await api.get('/notes/changes', { params: since ? { since } : {} });
     return response.data;
   },
 